@@ -0,0 +1,334 @@
+# bench.py
+# Throughput benchmark for every pipeline stage, on seeded synthetic data.
+#
+#     py -m sloppy_detector.bench --n_reports 100000 --work_dir bench_work --out_json bench_results.json
+#     py -m sloppy_detector.bench ... --compare bench_results_previous.json
+#
+# The generator writes structured_<ID>.json, quote_stub_<ID>.csv, findings_<ID>.csv (as the
+# PDF extractor would) and a labels CSV into --work_dir; the same --seed and --n_reports
+# always give the same files, and an existing matching set is reused. Each stage then runs
+# in a fresh process, so its peak RSS is its own (it includes loading the stage's inputs).
+import argparse, json, os, platform, random, shutil, subprocess, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from pathlib import Path
+from .sloppy_ml.instrument import peak_rss_mb
+
+HERE = Path(__file__).resolve().parent
+ML_DIR = HERE / "sloppy_ml"
+GEN_MARKER = "generated.json"
+# everything generate() and the stages write into work_dir; cleared before regenerating, so a
+# corpus never mixes with files left by a run with another --n_reports / --seed
+WORK_OUTPUTS = ["structured", "quote_stub", "findings", "labels.csv", "quote_rows.csv",
+                "predicted", "final", "model_out", "dataset.parquet"]
+STAGES = ["run_rules", "run_rules_frame", "featureize_record", "featureize_frame",
+          "load_structured_jsons", "attach_labels", "train_multilabel", "predict_multilabel", "merge_hybrid"]
+FIRST_ID = 5000000
+CHUNK = 5000
+
+# --- synthetic data
+COMMENT_BITS = [
+    "Quarterly Maintenance", "Last Minute Risk Analysis (LMRA) done", "Check if you are at the right Genset location",
+    "Oil sample taken", "Coolant sample Hi/Low temp circuit", "Test run without load 5 minutes",
+    "Left installation on stand-by", "Lube oil cap checked", "Fuel polisher pump leaking at the seal",
+    "fuel level indicator not working, customer to decide", "Record data on run log not possible, tooling missing",
+    "Record data on run log done", "replaced fuel filter", "Used materials from service car supplies",
+    "Repair or replacement advice: starter battery", "Waited for instructions on location", "Opdracht: Jaarlijks onderhoud",
+    "batterijen vervangen", "discussed with technical support", "video uploaded to sharepoint",
+]
+ATTR_BITS = [
+    "Power 500 kVA", "Type starter batteries 2x 12V", "Battery voltage 24.6 V", "Fuel tank 1000 L",
+    "Coolant temp 82 °C", "Oil pressure 4.2 bar", "Device data", "Installation details (When applicable)",
+    "Point of inspection Measured value and/or", "Type fueltank",
+]
+ADVICE = ["Fuel polisher pump repair/replacement", "Fuel level indicator replacement", "Starter battery replacement",
+          "Coolant hose", "Repl", "Exhaust gasket replacement"]
+
+def _hhmm(rng):
+    return f"{rng.randint(6, 18)}:{rng.choice(['00', '15', '30', '45'])}"
+
+def synth_report(rng, rid):
+    """One synthetic report -> (structured dict, quote stub rows, extractor findings, label codes)."""
+    missing_hours = rng.random() < 0.15
+    attributes_filled = rng.random() < 0.7
+    flags = dict(fuel_polisher_pump_leak=rng.random() < 0.2, fuel_level_indicator_issue=rng.random() < 0.1,
+                 repair_advice_present=rng.random() < 0.3, run_log_incomplete=rng.random() < 0.15)
+    comments = " ".join(rng.sample(COMMENT_BITS, rng.randint(2, 8)))[:400]
+    attrs = " ".join(rng.sample(ATTR_BITS, rng.randint(1, 6) if attributes_filled else 1))[:400]
+    structured = dict(
+        report_id=rid,
+        arrival=None if missing_hours and rng.random() < 0.5 else _hhmm(rng),
+        departure=None if missing_hours else _hhmm(rng),
+        total_time_spent="0:00" if missing_hours else f"{rng.randint(0, 6)}:{rng.choice(['00', '30'])}",
+        attributes_filled=attributes_filled, flags=flags,
+        excerpts=dict(comments=comments, attributes=attrs),
+    )
+
+    quote = []
+    for _ in range(rng.choice([0, 0, 1, 1, 2, 3]) if flags["repair_advice_present"] or flags["fuel_polisher_pump_leak"] else 0):
+        full = rng.random() < 0.4
+        quote.append(dict(repair_advice=rng.choice(ADVICE),
+                          material_code=f"MAT-{rng.randint(10000, 99999)}" if full or rng.random() < 0.3 else "",
+                          specification="as per manufacturer" if full else "",
+                          quantity=str(rng.choice([1, 2, 4, -1])) if full or rng.random() < 0.3 else "",
+                          hours_estimate=str(rng.choice([0.5, 1, 1.5, 2, "abc"])) if full else ""))
+
+    findings = []
+    if missing_hours:
+        findings.append(("Admin", "Working hours missing/zero", "Enter arrival, departure, and total working time."))
+    if not attributes_filled:
+        findings.append(("Attributes", "Attributes not filled", "Fill power/battery/capacity/spec fields."))
+    if flags["fuel_polisher_pump_leak"] and rng.random() < 0.5:
+        findings.append(("Fuel System", "Action missing for fuel polisher pump leak",
+                         "Add remedy (repair/replace), parts, and hours estimate."))
+    if flags["fuel_level_indicator_issue"]:
+        findings.append(("Fuel System", "Fuel level indicator decision missing",
+                         "Record customer decision (do not use / do not replace / replace)."))
+    if flags["run_log_incomplete"]:
+        findings.append(("Electrical/Logging", "Run log not completed", "Attach metering run log or reschedule with tooling."))
+
+    # labels follow the cues (with some noise), so the models have something to learn
+    labels = []
+    for code, on in [("HOURS_MISSING", missing_hours), ("ATTRIBUTES_PARTIAL", not attributes_filled),
+                     ("RUN_LOG_INCOMPLETE", flags["run_log_incomplete"]),
+                     ("FUEL_LEVEL_DECISION_MISSING", flags["fuel_level_indicator_issue"]),
+                     ("MATERIALS_NOT_BOOKED", "Used materials" in comments),
+                     ("VIDEO_MISSING", "sharepoint" not in comments),
+                     ("TECH_SUPPORT_NOT_CONSULTED", flags["fuel_polisher_pump_leak"] and "technical support" not in comments),
+                     ("MATERIALS_DETAILS_MISSING", any(not q["material_code"] for q in quote))]:
+        if on != (rng.random() < 0.05):
+            labels.append(code)
+    return structured, quote, findings, labels
+
+def _csv_field(v, sep):
+    v = str(v)
+    return '"' + v.replace('"', '""') + '"' if any(c in v for c in sep + '"\n') else v
+
+def _write_csv(path, header, rows, sep=","):
+    # the extractor writes a bare newline for reports without rows (empty DataFrame.to_csv)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if not rows:
+            f.write("\n")
+            return
+        f.write(sep.join(header) + "\n")
+        for r in rows:
+            f.write(sep.join(_csv_field(v, sep) for v in r) + "\n")
+
+QUOTE_COLS = ["repair_advice", "material_code", "specification", "quantity", "hours_estimate"]
+
+def _generate_chunk(work_dir, seed, start, stop):
+    rng = random.Random(seed * 1000003 + start)
+    work_dir = Path(work_dir)
+    labels, quote_all = [], []
+    for i in range(start, stop):
+        rid = FIRST_ID + i
+        structured, quote, findings, codes = synth_report(rng, rid)
+        with open(work_dir / "structured" / f"structured_{rid}.json", "w", encoding="utf-8") as f:
+            json.dump(structured, f, ensure_ascii=False)
+        _write_csv(work_dir / "quote_stub" / f"quote_stub_{rid}.csv", QUOTE_COLS, [[q[c] for c in QUOTE_COLS] for q in quote])
+        _write_csv(work_dir / "findings" / f"findings_{rid}.csv", ["category", "issue", "action_request"], findings)
+        labels.append((rid, ";".join(codes)))
+        quote_all += [[rid] + [q[c] for c in QUOTE_COLS] for q in quote]
+    return labels, quote_all
+
+def generate(work_dir, n_reports, seed=0, workers=None):
+    """Write the synthetic corpus into work_dir (reused if already generated with the same n/seed)."""
+    work_dir = Path(work_dir)
+    marker = work_dir / GEN_MARKER
+    want = {"n_reports": n_reports, "seed": seed}
+    if marker.exists() and json.loads(marker.read_text()) == want:
+        print(f"[INFO] reusing synthetic data in {work_dir}")
+        return
+    if marker.exists():
+        marker.unlink()
+    for name in WORK_OUTPUTS:
+        path = work_dir / name
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+    for d in ("structured", "quote_stub", "findings"):
+        (work_dir / d).mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    bounds = [(s, min(s + CHUNK, n_reports)) for s in range(0, n_reports, CHUNK)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as ex:
+        parts = list(ex.map(_generate_chunk, [work_dir] * len(bounds), [seed] * len(bounds),
+                            [b[0] for b in bounds], [b[1] for b in bounds]))
+    # ';'-separated like an Excel export, which sniff_read_csv detects; codes are quoted
+    _write_csv(work_dir / "labels.csv", ["report_id", "label_codes"], [r for lab, _ in parts for r in lab], sep=";")
+    _write_csv(work_dir / "quote_rows.csv", ["report_id"] + QUOTE_COLS, [r for _, q in parts for r in q])
+    marker.write_text(json.dumps(want))
+    print(f"[OK] generated {n_reports} reports in {work_dir} in {time.perf_counter() - t0:.1f}s")
+
+# --- measurement
+def _run_main(main, argv):
+    old = sys.argv
+    sys.argv = argv
+    try:
+        main()
+    finally:
+        sys.argv = old
+
+def _stage(name, cfg):
+    """Runs in a fresh process: set up inputs, then time only the stage itself -> (rows, seconds, cpu seconds)."""
+    import pandas as pd
+    sys.path.insert(0, str(ML_DIR))
+    from .rules import run_rules, run_rules_frame, compile_rules
+    from .features import featureize_record, featureize_frame
+
+    work = Path(cfg["work_dir"])
+    schema = json.load(open(cfg["schema_json"]))
+    ft = "quote_stub"
+    timed = {}
+
+    def clock(fn):
+        t0, c0 = time.perf_counter(), time.process_time()
+        fn()
+        timed["seconds"] = time.perf_counter() - t0
+        timed["cpu_seconds"] = time.process_time() - c0
+
+    rows = None
+    if name in ("run_rules", "run_rules_frame", "featureize_record", "featureize_frame"):
+        df = pd.read_csv(work / "quote_rows.csv", keep_default_na=False, dtype=str).drop(columns=["report_id"])
+        rows = len(df)
+        if name == "run_rules":
+            recs = df.to_dict("records")
+            clock(lambda: [run_rules(r, schema, ft) for r in recs])
+        elif name == "featureize_record":
+            recs = df.to_dict("records")
+            clock(lambda: [featureize_record(r, schema, ft) for r in recs])
+        elif name == "run_rules_frame":
+            clock(lambda: run_rules_frame(df, compile_rules(schema, ft)))
+        else:
+            clock(lambda: featureize_frame(df, schema, ft))
+    elif name in ("load_structured_jsons", "attach_labels"):
+        from aggregate_dataset import load_structured_jsons, attach_labels, load_taxonomy
+        from dataset_io import write_dataset
+        glob_ = str(work / "structured" / "structured_*.json")
+        out = {}
+        if name == "load_structured_jsons":
+            clock(lambda: out.update(df=load_structured_jsons(glob_)))
+            rows = len(out["df"])
+        else:
+            df = load_structured_jsons(glob_)
+            rows = len(df)
+            tax = load_taxonomy(cfg["taxonomy_yaml"])
+            clock(lambda: out.update(xy=attach_labels(df, str(work / "labels.csv"), tax)))
+            # input for train_multilabel
+            write_dataset(out["xy"][0], work / "dataset.parquet", out["xy"][1])
+    elif name == "train_multilabel":
+        import train_multilabel
+        rows = int(json.loads((work / GEN_MARKER).read_text())["n_reports"])
+        clock(lambda: _run_main(train_multilabel.main, ["train_multilabel", "--dataset", str(work / "dataset.parquet"),
+                                                        "--out_dir", str(work / "model_out")]))
+    elif name == "predict_multilabel":
+        import predict_multilabel
+        rows = len(list((work / "structured").glob("structured_*.json")))
+        clock(lambda: _run_main(predict_multilabel.main, [
+            "predict_multilabel", "--structured_glob", str(work / "structured" / "structured_*.json"),
+            "--model_path", str(work / "model_out" / "multilabel_model.joblib"),
+            "--taxonomy_yaml", cfg["taxonomy_yaml"], "--threshold", "0.5", "--out_dir", str(work / "predicted")]))
+    elif name == "merge_hybrid":
+        import merge_hybrid
+        rows = len(list((work / "findings").glob("findings_*.csv")))
+        clock(lambda: _run_main(merge_hybrid.main, [
+            "merge_hybrid", "--rule_glob", str(work / "findings"), "--ml_glob", str(work / "predicted"),
+            "--out_dir", str(work / "final")]))
+    else:
+        raise ValueError(f"unknown stage '{name}'")
+    return rows, timed["seconds"], timed["cpu_seconds"], peak_rss_mb()
+
+def _stage_quiet(name, cfg):
+    # the CLI stages print a line per report
+    with open(os.devnull, "w") as null, redirect_stdout(null):
+        return _stage(name, cfg)
+
+def run_stage(name, cfg):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+        rows, secs, cpu, rss = ex.submit(_stage_quiet, name, cfg).result()
+    return {"rows": rows, "seconds": round(secs, 4), "cpu_seconds": round(cpu, 4),
+            "rows_per_sec": round(rows / secs, 1) if secs > 0 else None, "peak_rss_mb": rss}
+
+def environment():
+    import numpy, pandas, sklearn
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "numpy": numpy.__version__, "pandas": pandas.__version__, "sklearn": sklearn.__version__}
+
+def compare(results, baseline_path, tolerance):
+    """Print speed/memory against an earlier results JSON -> list of regressed stages."""
+    base = json.load(open(baseline_path))
+    regressed = []
+    print(f"\n{'stage':24s} {'rows/s':>12s} {'before':>12s} {'ratio':>7s} {'RSS MB':>9s} {'before':>9s}")
+    for name, r in results["stages"].items():
+        b = base.get("stages", {}).get(name)
+        if not b or not b.get("rows_per_sec") or not r.get("rows_per_sec"):
+            continue
+        ratio = r["rows_per_sec"] / b["rows_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  [WARN] slower"
+            regressed.append(name)
+        print(f"{name:24s} {r['rows_per_sec']:12.1f} {b['rows_per_sec']:12.1f} {ratio:7.2f} "
+              f"{r['peak_rss_mb'] or 0:9.1f} {b.get('peak_rss_mb') or 0:9.1f}{flag}")
+    if base.get("meta", {}).get("n_reports") != results["meta"]["n_reports"]:
+        print("[WARN] baseline was run with a different --n_reports; rates are not directly comparable")
+    return regressed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n_reports", type=int, default=10000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--work_dir", default="bench_work", help="Synthetic data and stage outputs")
+    ap.add_argument("--stages", default=",".join(STAGES), help="Comma-separated subset of: " + ", ".join(STAGES))
+    ap.add_argument("--schema_json", default=str(HERE / "schema.json"))
+    ap.add_argument("--taxonomy_yaml", default=str(ML_DIR / "labels_taxonomy.yaml"))
+    ap.add_argument("--gen_workers", type=int, default=None, help="Processes writing the synthetic files")
+    ap.add_argument("--generate_only", action="store_true")
+    ap.add_argument("--out_json", default=None, help="Save results here (e.g. bench_results/<commit>.json)")
+    ap.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="Slowdown that counts as a regression")
+    args = ap.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        ap.error(f"unknown stages: {unknown}")
+
+    generate(args.work_dir, args.n_reports, args.seed, args.gen_workers)
+    if args.generate_only:
+        return
+
+    cfg = {"work_dir": str(Path(args.work_dir).resolve()), "schema_json": str(Path(args.schema_json).resolve()),
+           "taxonomy_yaml": str(Path(args.taxonomy_yaml).resolve())}
+    results = {"meta": {**environment(), "n_reports": args.n_reports, "seed": args.seed}, "stages": {}}
+    for name in STAGES:
+        if name not in stages:
+            continue
+        try:
+            r = run_stage(name, cfg)
+        except Exception as e:
+            # later stages need the outputs of earlier ones (dataset -> model -> predictions)
+            print(f"[SKIP] {name}: {type(e).__name__}: {e}")
+            continue
+        results["stages"][name] = r
+        print(f"[OK] {name:22s} {r['rows']:>9d} rows  {r['seconds']:9.3f}s  {r['rows_per_sec'] or 0:12.1f} rows/s  "
+              f"peak RSS {r['peak_rss_mb']} MB")
+
+    if args.out_json:
+        Path(args.out_json).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out_json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print("Wrote", args.out_json)
+    if args.compare:
+        if compare(results, args.compare, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
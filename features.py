@@ -1,6 +1,15 @@
 import re
 import numpy as np
 import pandas as pd
+from .rules import compile_rules, _column, _str_values
+
+# yes/no cells that arrive as text (CSV): these spell False, any other text counts as True
+FALSE_TEXT = {"", "false", "f", "no", "n", "0", "0.0"}
+
+def _is_true(v):
+    if isinstance(v, str):
+        return v.strip().lower() not in FALSE_TEXT
+    return bool(v)
 
 def _is_missing(v):
     if v is None:
@@ -62,7 +71,7 @@ def featureize_record(rec: dict, schema: dict, form_type: str) -> dict:
     # booleans expected True
     for f in bool_expected_true:
         v = rec.get(f, False)
-        bad = not bool(v)
+        bad = not _is_true(v)
         ft[f"false__{f}"] = 1.0 if bad else 0.0
 
     # aggregate
@@ -70,4 +79,95 @@ def featureize_record(rec: dict, schema: dict, form_type: str) -> dict:
     ft["agg_missing_required"] = float(np.mean(req_flags)) if req_flags else 0.0
     ft["agg_flags_count"] = float(sum(ft.values()))
 
-    return ft
\ No newline at end of file
+    return ft
+
+# ---------------------------------------------------------------------------
+# Batch featurization: same features as featureize_record, computed column-wise
+# for a whole frame into a dense float32 matrix with a schema-derived order.
+# ---------------------------------------------------------------------------
+
+def feature_names(schema: dict, form_type: str) -> list:
+    """Column order of featureize_frame: schema order per block, then the aggregates."""
+    c = compile_rules(schema, form_type)
+    names = [f"missing__{f}" for f in c["required_fields"]]
+    names += [f"short__{f}" for f in c["min_length"]]
+    names += [f"ltmin__{f}" for f in c["numeric_min"]]
+    names += [f"url_contains__{spec['field']}" for spec in c["url_fields"]]
+    names += [f"false__{f}" for f in c["bool_expected_true"]]
+    names = list(dict.fromkeys(names))
+    return names + ["agg_missing_required", "agg_flags_count"]
+
+def _truthy(s):
+    """_is_true per cell: bool() for booleans and numbers, FALSE_TEXT for strings."""
+    vals = s.to_numpy(dtype=object, na_value=np.nan) if isinstance(s.dtype, pd.api.extensions.ExtensionDtype) else s.to_numpy()
+    out = np.asarray(vals).astype(bool)
+    txt = _str_values(s)
+    is_txt = txt.notna().to_numpy()
+    if is_txt.any():
+        out[is_txt] = ~txt[is_txt].str.strip().str.lower().isin(FALSE_TEXT).to_numpy(dtype=bool)
+    return out
+
+def featureize_frame(df: pd.DataFrame, schema: dict, form_type: str) -> np.ndarray:
+    c = compile_rules(schema, form_type)
+    n = len(df)
+    cols = {}
+
+    # basic missingness on required fields
+    for f in c["required_fields"]:
+        s = _column(df, f, None)
+        empty = (_str_values(s).str.strip() == "").fillna(False).to_numpy(dtype=bool)
+        cols[f"missing__{f}"] = s.isna().to_numpy() | empty
+
+    # string length checks (non-strings count as length 0)
+    for f, m in c["min_length"].items():
+        lens = _str_values(_column(df, f, "")).str.strip().str.len().fillna(0)
+        cols[f"short__{f}"] = (lens < m).to_numpy(dtype=bool)
+
+    # numeric min checks (None/NaN and unparseable values are bad)
+    for f, m in c["numeric_min"].items():
+        if f not in df.columns:
+            cols[f"ltmin__{f}"] = np.ones(n, dtype=bool)
+            continue
+        s = df[f]
+        num = pd.to_numeric(s, errors="coerce")
+        bad = (num < float(m)).to_numpy(dtype=bool) | s.isna().to_numpy()
+        odd = np.flatnonzero((num.isna() & s.notna()).to_numpy(dtype=bool))
+        for i in odd:
+            try:
+                bad[i] = float(s.iat[i]) < float(m)
+            except Exception:
+                bad[i] = True
+        cols[f"ltmin__{f}"] = bad
+
+    # URL content checks: flag 1.0 if missing or doesn't contain expected
+    for spec in c["url_fields"]:
+        f = spec["field"]
+        if spec["pattern"] is None:
+            cols[f"url_contains__{f}"] = np.ones(n, dtype=bool)
+            continue
+        hit = _str_values(_column(df, f, "")).str.lower().str.contains(spec["pattern"], regex=True)
+        cols[f"url_contains__{f}"] = ~hit.fillna(False).to_numpy(dtype=bool)
+
+    # booleans expected True
+    for f in c["bool_expected_true"]:
+        cols[f"false__{f}"] = ~_truthy(df[f]) if f in df.columns else np.ones(n, dtype=bool)
+
+    names = feature_names(schema, form_type)
+    X = np.zeros((n, len(names)), dtype=np.float32)
+    for j, name in enumerate(names[:-2]):
+        X[:, j] = cols[name]
+
+    # aggregate
+    req = [j for j, name in enumerate(names) if name.startswith("missing__")]
+    X[:, -2] = X[:, req].mean(axis=1) if req else 0.0
+    X[:, -1] = X[:, :-1].sum(axis=1)
+    return X
+
+def align_features(X: np.ndarray, names: list, wanted) -> np.ndarray:
+    """Reorder columns of X to `wanted` (e.g. model.feature_names_in_); unknown names are 0.0."""
+    pos = {name: j for j, name in enumerate(names)}
+    out = np.zeros((X.shape[0], len(wanted)), dtype=X.dtype)
+    for j, name in enumerate(wanted):
+        if name in pos:
+            out[:, j] = X[:, pos[name]]
+    return out
@@ -0,0 +1,322 @@
+# orchestrate.py
+# Nightly pipeline runner, replacing runchecks.bat / runtraining.bat:
+#
+#     extract (PDFs, --extract) -> score_quotes (--schema_json)
+#                               -> aggregate -> train (--train)
+#                               -> predict -> merge
+#
+# Each stage declares its inputs and outputs. A stage whose input fingerprint (size/mtime
+# of every input file + its arguments) matches the last successful run, and whose outputs
+# still exist, is skipped. predict and merge are tracked per report, so only new or changed
+# reports are re-predicted and re-merged (and all of them after the model changes). Stages
+# call the existing main() functions in this process; large per-report batches are split
+# over --workers processes. Works the same on Windows and Linux.
+#
+#     py run_orchestrate.py --reports_dir sloppy_reports --ml_dir sloppy_ml           (runchecks.bat)
+#     py run_orchestrate.py --reports_dir sloppy_reports --ml_dir sloppy_ml --train   (runtraining.bat)
+#
+# run_orchestrate.py imports this folder as the package sloppy_detector whatever the folder
+# is called; `py -m sloppy_detector.orchestrate` needs the folder to carry that name.
+import argparse, glob, hashlib, importlib, io, json, sys, time, traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from .sloppy_reports_reader import load_manifest, save_manifest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "sloppy_ml"))
+from instrument import Metrics, add_metrics_args
+
+STATE_NAME = "orchestrate_state.json"
+MIN_SHARD = 5000  # reports per worker before a per-report stage is split over processes
+
+_STATS = {}  # path -> "size:mtime_ns" for this run; a folder of 100k JSONs is only stat'ed once
+
+def _stat(path):
+    if path not in _STATS:
+        try:
+            st = Path(path).stat()
+            _STATS[path] = f"{st.st_size}:{st.st_mtime_ns}"
+        except OSError:
+            _STATS[path] = "-"
+    return _STATS[path]
+
+def _forget_stats(paths):
+    # outputs of a stage that just ran are inputs of the next one
+    for p in paths:
+        _STATS.pop(str(p), None)
+
+def expand(patterns):
+    """Files matched by globs / plain paths (directories are left out), sorted."""
+    out = set()
+    for pat in patterns:
+        out.update(p for p in glob.glob(str(pat)) if not Path(p).is_dir())
+    return sorted(out)
+
+def fingerprint(paths, params=()):
+    h = hashlib.sha256(json.dumps([str(p) for p in params]).encode("utf-8"))
+    for p in paths:
+        h.update(f"{p}\0{_stat(str(p))}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def report_key(path, prefix):
+    """findings_<ID>.csv / predicted_findings_<ID>.csv / structured_<ID>.json -> <ID>."""
+    stem = Path(path).stem
+    return stem[len(prefix):] if stem.startswith(prefix) else stem
+
+def run_main(module, argv):
+    """module.main() with argv, in this process -> (ok, captured stdout)."""
+    mod = importlib.import_module(module, __package__)
+    buf = io.StringIO()
+    old = sys.argv
+    sys.argv = [module.lstrip(".")] + [str(a) for a in argv]
+    try:
+        with redirect_stdout(buf):
+            mod.main()
+        ok = True
+    except SystemExit as e:
+        ok = e.code in (0, None)
+        if not ok:
+            buf.write(f"exit code {e.code}\n")
+    except Exception:
+        ok = False
+        buf.write(traceback.format_exc())
+    finally:
+        sys.argv = old
+    return ok, buf.getvalue()
+
+class Stage:
+    """One step of the DAG.
+
+    argv/inputs/outputs are filled in by the layout. Per-report stages set `items`
+    (report ID -> input files) and `item_argv` (changed IDs -> argv); `params` are
+    inputs that invalidate every report (model file, taxonomy, arguments).
+    """
+
+    def __init__(self, name, module, deps=(), argv=(), inputs=(), outputs=(),
+                 items=None, item_argv=None, params=()):
+        self.name = name
+        self.module = module
+        self.deps = list(deps)
+        self.argv = list(argv)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.items = items
+        self.item_argv = item_argv
+        self.params = list(params)
+
+class Orchestrator:
+    def __init__(self, stages, state_path, workers=1, log_dir=None, verbose=False):
+        self.stages = {s.name: s for s in stages}
+        self.state_path = Path(state_path)
+        self.state = load_manifest(self.state_path)
+        self.workers = workers
+        self.log_dir = Path(log_dir) if log_dir else self.state_path.parent / "orchestrate_logs"
+        self.verbose = verbose
+        self._logged = set()
+
+    def order(self):
+        done, out = set(), []
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError(f"cycle in stages: {' -> '.join(path + (name,))}")
+            if name in done or name not in self.stages:
+                return
+            for d in self.stages[name].deps:
+                visit(d, path + (name,))
+            done.add(name); out.append(self.stages[name])
+        for name in self.stages:
+            visit(name)
+        return out
+
+    def _log(self, stage, text):
+        if self.verbose:
+            print(text, end="")
+        if text:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            # one log per stage, holding its last run
+            mode = "a" if stage.name in self._logged else "w"
+            self._logged.add(stage.name)
+            with open(self.log_dir / f"{stage.name}.log", mode, encoding="utf-8") as f:
+                f.write(text)
+
+    def _run(self, stage, argv):
+        ok, text = run_main(stage.module, argv)
+        self._log(stage, text)
+        return ok
+
+    def _run_sharded(self, stage, keys):
+        """Per-report stage over `keys`; big batches go to worker processes in shards."""
+        n_shards = min(self.workers, len(keys) // MIN_SHARD)
+        if n_shards <= 1:
+            return self._run(stage, stage.item_argv(keys))
+        shards = [keys[i::n_shards] for i in range(n_shards)]
+        with ProcessPoolExecutor(max_workers=n_shards) as ex:
+            results = list(ex.map(run_main, [stage.module] * n_shards, [stage.item_argv(s) for s in shards]))
+        for _, text in results:
+            self._log(stage, text)
+        return all(ok for ok, _ in results)
+
+    def plan(self, stage, force=False):
+        """-> (fingerprint, changed report IDs or None for whole-stage, reason) ; reason None = up to date."""
+        old = self.state.get(stage.name, {})
+        if stage.items is None:
+            fp = fingerprint(expand(stage.inputs), stage.argv)
+            missing = [o for o in stage.outputs if not glob.glob(str(o))]
+            if force or old.get("fingerprint") != fp or missing:
+                why = "forced" if force else f"missing {missing[0]}" if missing else "inputs changed"
+                return fp, None, why
+            return fp, None, None
+        items = stage.items()
+        fp = fingerprint(expand(stage.params), stage.argv)
+        seen = {} if force or old.get("fingerprint") != fp else old.get("items", {})
+        current = {k: "|".join(_stat(str(p)) for p in paths) for k, paths in items.items()}
+        changed = sorted(k for k, v in current.items() if seen.get(k) != v)
+        if not changed:
+            return (fp, current), [], None
+        why = "forced" if force else "model/arguments changed" if not seen and old else f"{len(changed)} new or changed reports"
+        return (fp, current), changed, why
+
+    def run(self, force=(), dry_run=False, metrics=None):
+        metrics = metrics or Metrics(None)
+        failed = set()
+        for stage in self.order():
+            bad = [d for d in stage.deps if d in failed]
+            if bad:
+                print(f"[SKIP] {stage.name}: {bad[0]} failed")
+                failed.add(stage.name)
+                continue
+            fp, changed, why = self.plan(stage, "all" in force or stage.name in force)
+            if why is None:
+                print(f"[SKIP] {stage.name}: up to date")
+                continue
+            print(f"[INFO] {stage.name}: {why}" + (" (dry run)" if dry_run else ""))
+            if dry_run:
+                continue
+            t0 = time.perf_counter()
+            with metrics.stage(stage.name) as st:
+                if changed is None:
+                    ok = self._run(stage, stage.argv)
+                else:
+                    ok = self._run_sharded(stage, changed)
+                    st.rows = len(changed)
+            _forget_stats(expand(stage.outputs))
+            if not ok:
+                print(f"[WARN] {stage.name} failed after {time.perf_counter() - t0:.1f}s; see {self.log_dir / (stage.name + '.log')}")
+                failed.add(stage.name)
+                continue
+            if changed is None:
+                self.state[stage.name] = {"fingerprint": fp, "finished": time.time()}
+            else:
+                self.state[stage.name] = {"fingerprint": fp[0], "items": fp[1], "finished": time.time()}
+            save_manifest(self.state, self.state_path)
+            print(f"[OK] {stage.name} in {time.perf_counter() - t0:.1f}s")
+        return not failed
+
+def build_stages(args):
+    R, M = Path(args.reports_dir), Path(args.ml_dir)
+    structured, findings = R / "structured", R / "findings"
+    predicted = Path(args.pred_dir) if args.pred_dir else M / "predicted"
+    labels, taxonomy = M / "labels_template.csv", M / "labels_taxonomy.yaml"
+    dataset = M / "dataset.parquet"
+    model = Path(args.model_path) if args.model_path else M / "model_out" / "multilabel_model.joblib"
+    model_files = [model / "*"] if model.suffix == ".compact" else [model]
+    cache = ["--cache_dir", args.cache_dir] if args.cache_dir else []
+    dup = ["--dup_index", args.dup_index] if args.dup_index else []
+    store = ["--store", args.store] if args.store else []
+    stages = []
+
+    if args.extract:
+        stages.append(Stage("extract", ".sloppy_reports_reader",
+                            argv=["--base_dir", R, "--workers", args.workers],
+                            # editing the cue rules re-derives outputs from the cached PDF text
+                            inputs=[R / "*.pdf", R / "*.PDF", Path(__file__).resolve().parent / "sloppy_reports_reader.py"],
+                            outputs=[structured]))
+    up = ["extract"] if args.extract else []
+
+    if args.schema_json:
+        quotes, quote_findings = R / "quote_stub", R / "quote_findings"
+        anomaly = ["--model_path", args.anomaly_model_path] if args.anomaly_model_path else []
+        stages.append(Stage("score_quotes", ".score", deps=up,
+                            argv=["--input_glob", quotes / "quote_stub_*.csv", "--schema_json", args.schema_json,
+                                  "--form_type", "quote_stub", "--out_dir", quote_findings,
+                                  "--workers", args.workers] + anomaly + store,
+                            inputs=[quotes / "quote_stub_*.csv", args.schema_json] +
+                                   ([args.anomaly_model_path, Path(args.anomaly_model_path) / "*"] if anomaly else []),
+                            outputs=[quote_findings]))
+
+    if args.train:
+        stages.append(Stage("aggregate", "aggregate_dataset", deps=up,
+                            argv=["--structured_glob", structured / "structured_*.json", "--labels_csv", labels,
+                                  "--taxonomy_yaml", taxonomy, "--out_dataset", dataset] + cache + store,
+                            inputs=[structured / "structured_*.json", labels, taxonomy], outputs=[dataset]))
+        stages.append(Stage("train", "train_multilabel", deps=["aggregate"],
+                            argv=["--dataset", dataset, "--out_dir", model.parent,
+                                  "--test_size", args.test_size, "--min_positives", args.min_positives]
+                                 + (["--compact"] if model.suffix == ".compact" else []),
+                            inputs=[dataset], outputs=[model]))
+
+    threshold = ["--threshold", args.threshold] if args.threshold is not None else []
+    stages.append(Stage(
+        "predict", "predict_multilabel", deps=up + (["train"] if args.train else []),
+        argv=threshold + dup + store, params=model_files + [taxonomy],
+        items=lambda: {report_key(p, "structured_"): [p] for p in expand([structured / "structured_*.json"])},
+        item_argv=lambda keys: ["--structured_glob"] + [structured / f"structured_{k}.json" for k in keys] +
+                               ["--model_path", model, "--taxonomy_yaml", taxonomy, "--out_dir", predicted] +
+                               threshold + cache + dup + store,
+        outputs=[predicted / "predicted_findings_*.csv"]))
+
+    def merge_items():
+        items = {}
+        for p in expand([findings / "findings_*.csv"]):
+            items.setdefault(report_key(p, "findings_"), []).append(p)
+        for p in expand([predicted / "predicted_findings_*.csv"]):
+            items.setdefault(report_key(p, "predicted_findings_"), []).append(p)
+        return items
+    def merge_argv(keys):
+        rule = [p for k in keys for p in expand([findings / f"findings_{k}.csv"])]
+        ml = [p for k in keys for p in expand([predicted / f"predicted_findings_{k}.csv"])]
+        return (["--rule_glob"] + rule if rule else []) + (["--ml_glob"] + ml if ml else []) + ["--out_dir", predicted] + store
+    stages.append(Stage("merge", "merge_hybrid", deps=["predict"], argv=store, items=merge_items, item_argv=merge_argv,
+                        outputs=[predicted / "final_findings_*.csv"]))
+    return stages
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reports_dir", default="sloppy_reports", help="Holds structured/, findings/, quote_stub/ (and the PDFs)")
+    ap.add_argument("--ml_dir", default="sloppy_ml", help="Holds labels_template.csv, labels_taxonomy.yaml, model_out/")
+    ap.add_argument("--pred_dir", default=None, help="Default: <ml_dir>/predicted")
+    ap.add_argument("--model_path", default=None,
+                    help="Default: <ml_dir>/model_out/multilabel_model.joblib (a .compact folder also works)")
+    ap.add_argument("--extract", action="store_true", help="Start with PDF extraction (sloppy_reports_reader)")
+    ap.add_argument("--schema_json", default=None, help="Also run the quote-stub rules (score) into <reports_dir>/quote_findings")
+    ap.add_argument("--anomaly_model_path", default=None, help="Optional IsolationForest for score_quotes")
+    ap.add_argument("--train", action="store_true", help="Also aggregate the dataset and retrain (runtraining.bat)")
+    ap.add_argument("--test_size", type=float, default=0.2)
+    ap.add_argument("--min_positives", type=int, default=1)
+    ap.add_argument("--threshold", type=float, default=None)
+    ap.add_argument("--cache_dir", default=None, help="Feature cache for aggregate and predict")
+    ap.add_argument("--dup_index", default=None, help="near_dup index: predict also flags copy-pasted narratives")
+    ap.add_argument("--store", default=None, help="report_store SQLite file every stage also writes to")
+    ap.add_argument("--workers", type=int, default=1, help="Processes for extraction, quote scoring and big per-report batches")
+    ap.add_argument("--state", default=None, help=f"Default: <ml_dir>/{STATE_NAME}")
+    ap.add_argument("--force", nargs="*", default=None, metavar="STAGE",
+                    help="Re-run these stages regardless of fingerprints (no names: all)")
+    ap.add_argument("--dry_run", action="store_true", help="Only print what would run")
+    ap.add_argument("--verbose", action="store_true", help="Echo stage output (otherwise in <ml_dir>/orchestrate_logs/)")
+    add_metrics_args(ap)
+    args = ap.parse_args()
+
+    stages = build_stages(args)
+    force = set() if args.force is None else (set(args.force) or {"all"})
+    unknown = force - {"all"} - {s.name for s in stages}
+    if unknown:
+        ap.error(f"unknown stage(s) for --force: {', '.join(sorted(unknown))}")
+    orch = Orchestrator(stages, args.state or Path(args.ml_dir) / STATE_NAME, max(1, args.workers),
+                        verbose=args.verbose)
+    with Metrics.from_args("orchestrate", args) as metrics:
+        ok = orch.run(force, args.dry_run, metrics)
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
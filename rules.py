@@ -1,5 +1,6 @@
 import re
 import numpy as np
+import pandas as pd
 
 def run_rules(rec: dict, schema: dict, form_type: str):
     cfg = schema["form_types"].get(form_type, {})
@@ -69,4 +70,147 @@ def run_rules(rec: dict, schema: dict, form_type: str):
                 "action_request": "Provide material code, specification and quantity; ensure the booking order is created."
             })
 
-    return findings
\ No newline at end of file
+    return findings
+
+# ---------------------------------------------------------------------------
+# Columnar engine: compile a form type's schema block once, then check whole
+# pandas columns at a time. Produces the same findings as run_rules per row.
+# ---------------------------------------------------------------------------
+
+def compile_rules(schema: dict, form_type: str) -> dict:
+    cfg = schema["form_types"].get(form_type, {})
+    url_fields = []
+    for spec in cfg.get("url_fields", []):
+        substrs = spec.get("contains_any", [])
+        lowered = [s.lower() for s in substrs]
+        url_fields.append({
+            "field": spec.get("field"),
+            "contains_any": substrs,
+            "pattern": "|".join(re.escape(s) for s in lowered) if lowered else None,
+        })
+    return {
+        "form_type": form_type,
+        "required_fields": list(cfg.get("required_fields", [])),
+        "min_length": dict(cfg.get("min_length", {})),
+        "numeric_min": dict(cfg.get("numeric_min", {})),
+        "url_fields": url_fields,
+        "bool_expected_true": list(dict.fromkeys(cfg.get("bool_expected_true", []))),
+        "materials_fields": ["material_code", "specification", "quantity"] if form_type == "quote_stub" else [],
+    }
+
+def _column(df, f, default):
+    if f in df.columns:
+        return df[f]
+    return pd.Series([default] * len(df), index=df.index, dtype=object)
+
+def _is_none(s):
+    # elementwise `v is None`; isna() would also catch NaN, which run_rules treats differently
+    if s.dtype != object:
+        return np.zeros(len(s), dtype=bool)
+    return np.equal(s.to_numpy(), None)
+
+def _str_values(s):
+    """Return s with non-string cells as NaN, so .str ops mirror isinstance(v, str)."""
+    if s.dtype != object and not pd.api.types.is_string_dtype(s):
+        return pd.Series(np.nan, index=s.index, dtype=object)
+    try:
+        lens = s.str.len()
+    except AttributeError:
+        return pd.Series(np.nan, index=s.index, dtype=object)
+    return s.where(lens.notna())
+
+def rule_masks(df: pd.DataFrame, compiled: dict):
+    """Yield (finding, mask) pairs in the same order run_rules emits findings."""
+    n = len(df)
+
+    # Required fields
+    for f in compiled["required_fields"]:
+        s = _column(df, f, None)
+        txt = _str_values(s)
+        mask = s.isna().to_numpy() | (txt.str.strip() == "").fillna(False).to_numpy(dtype=bool)
+        yield {
+            "category": "Attributes",
+            "issue": f"Required field '{f}' missing",
+            "action_request": f"Fill in the '{f}' field completely."
+        }, mask
+
+    # String min length
+    for f, m in compiled["min_length"].items():
+        lens = _str_values(_column(df, f, "")).str.strip().str.len()
+        mask = ~(lens >= m).fillna(False).to_numpy(dtype=bool)
+        yield {
+            "category": "Attributes",
+            "issue": f"Text for '{f}' too short",
+            "action_request": f"Provide a more descriptive '{f}' (min {m} characters)."
+        }, mask
+
+    # Numeric min (NaN passes, as float(nan) < m is False in run_rules)
+    for f, m in compiled["numeric_min"].items():
+        if f not in df.columns:
+            mask = np.ones(n, dtype=bool)
+        else:
+            s = df[f]
+            num = pd.to_numeric(s, errors="coerce")
+            mask = (num < float(m)).to_numpy(dtype=bool) | _is_none(s)
+            # cells to_numeric rejected: re-check the (few) leftovers with float() itself
+            odd = np.flatnonzero((num.isna() & s.notna()).to_numpy(dtype=bool))
+            for i in odd:
+                try:
+                    mask[i] = float(s.iat[i]) < float(m)
+                except Exception:
+                    mask[i] = True
+        yield {
+            "category": "Attributes",
+            "issue": f"Numeric value '{f}' below minimum ({m}) or missing",
+            "action_request": f"Enter a valid number for '{f}' (>= {m})."
+        }, mask
+
+    # URL contains rule
+    for spec in compiled["url_fields"]:
+        f = spec["field"]
+        if spec["pattern"] is None:
+            mask = np.ones(n, dtype=bool)
+        else:
+            txt = _str_values(_column(df, f, ""))
+            hit = txt.str.lower().str.contains(spec["pattern"], regex=True)
+            mask = ~hit.fillna(False).to_numpy(dtype=bool)
+        yield {
+            "category": "Evidence",
+            "issue": f"Missing/invalid link in '{f}'",
+            "action_request": f"Attach a valid URL containing one of: {', '.join(spec['contains_any'])}."
+        }, mask
+
+    # Domain-specific: materials booked. None/"" trip it; NaN never matches `in (None, "", nan)`.
+    if compiled["materials_fields"]:
+        mask = np.zeros(n, dtype=bool)
+        for k in compiled["materials_fields"]:
+            if k not in df.columns:
+                mask[:] = True
+                break
+            mask |= _is_none(df[k]) | (_str_values(df[k]) == "").fillna(False).to_numpy(dtype=bool)
+        yield {
+            "category": 'Materials',
+            "issue": "Materials not fully specified for invoicing",
+            "action_request": "Provide material code, specification and quantity; ensure the booking order is created."
+        }, mask
+
+def run_rules_frame(df: pd.DataFrame, compiled: dict) -> pd.DataFrame:
+    """Columnar run_rules over a whole frame; one row per finding, ordered by row then rule."""
+    cols = ["row_index", "category", "issue", "action_request"]
+    positions, rule_ids, texts = [], [], []
+    for i, (finding, mask) in enumerate(rule_masks(df, compiled)):
+        pos = np.flatnonzero(mask)
+        positions.append(pos)
+        rule_ids.append(np.full(len(pos), i, dtype=np.int32))
+        texts.append(finding)
+    if not positions or sum(len(p) for p in positions) == 0:
+        return pd.DataFrame(columns=cols)
+
+    pos = np.concatenate(positions)
+    rid = np.concatenate(rule_ids)
+    order = np.lexsort((rid, pos))
+    pos, rid = pos[order], rid[order]
+    out = pd.DataFrame({"row_index": df.index.to_numpy()[pos]})
+    for k in cols[1:]:
+        out[k] = np.array([t[k] for t in texts], dtype=object)[rid]
+    return out
@@ -0,0 +1,24 @@
+# run_orchestrate.py
+# Launcher for orchestrate.py that works from any checkout folder name (a GitHub zip unpacks
+# to SloppyReports-main, which `python -m <folder>.orchestrate` cannot import): this folder is
+# registered as the package `sloppy_detector`, then orchestrate.main() runs.
+#
+#     python run_orchestrate.py --reports_dir sloppy_reports --ml_dir sloppy_ml [--train]
+import sys, types
+from pathlib import Path
+
+PACKAGE = "sloppy_detector"
+
+here = Path(__file__).resolve().parent
+# at import time, not under __main__: spawned worker processes (Windows, forkserver) re-run
+# this file as __mp_main__ and need the package to unpickle their tasks. That only holds while
+# __main__ stays this file: running orchestrate as __main__ (runpy) would make the workers
+# import it by name, before anything registered the package.
+if PACKAGE not in sys.modules:
+    pkg = types.ModuleType(PACKAGE)
+    pkg.__path__ = [str(here)]
+    sys.modules[PACKAGE] = pkg
+
+if __name__ == "__main__":
+    from sloppy_detector.orchestrate import main
+    main()
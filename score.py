@@ -1,67 +1,267 @@
-import argparse, json, os, pandas as pd
+import argparse, glob, json, os, re, time, numpy as np, pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from joblib import load
-from .features import featureize_record
-from .rules import run_rules
+from .features import featureize_frame, feature_names, align_features
+from .rules import compile_rules, run_rules_frame
+from .sloppy_ml.compact_model import is_compact, load_compact
+from .sloppy_ml.instrument import Metrics, add_metrics_args
+from .sloppy_ml.report_store import ReportStore, save_findings
+
+def load_model(model_path):
+    if model_path and os.path.exists(model_path):
+        try:
+            return load_compact(model_path) if is_compact(model_path) else load(model_path)
+        except Exception:
+            return None
+    return None
+
+def text_dtypes(compiled):
+    """read_csv dtype for the schema's text columns (min_length, url_fields) and yes/no
+    columns (bool_expected_true, parsed by features._truthy).
+
+    Left to inference, an all-digit column (or chunk of one) would load as numbers, which the
+    rules count as non-text, and a True/False column as bool in one chunk but text in another;
+    pinning str keeps whole-file, chunked and batch reads alike.
+    """
+    fields = (list(compiled["min_length"]) + [spec["field"] for spec in compiled["url_fields"]]
+              + compiled["bool_expected_true"])
+    return {f: str for f in fields if f}
+
+def read_input_csv(path, dtype=None):
+    try:
+        return pd.read_csv(path, dtype=dtype)
+    except pd.errors.EmptyDataError:
+        # the PDF extractor writes header-less empty stubs for reports without quote lines
+        return pd.DataFrame()
+
+def report_id_from_path(path):
+    """quote_stub_<ID>.csv -> <ID> (last number in the file name, else the bare stem)."""
+    stem = Path(path).stem
+    m = re.findall(r"(\d+)", stem)
+    return m[-1] if m else stem
+
+def anomaly_scores(model, X):
+    """(sloppiness score, flagged) per row of X.
+
+    Models calibrated by train.py carry score_quantiles_: the score is then the row's
+    percentile among the training rows (0..1) and a row is flagged past the model's
+    contamination cut. Older models: max(0, -decision_function), flagged above 0.5.
+    """
+    q = getattr(model, "score_quantiles_", None)
+    if q is None:
+        raw = np.maximum(0.0, -model.decision_function(X)).astype(float)
+        return raw, raw > 0.5
+    raw = -model.score_samples(X)
+    # mid-rank, so rows tied with many training rows land in the middle of the tie
+    pct = (np.searchsorted(q, raw, "left") + np.searchsorted(q, raw, "right")) / (2.0 * len(q))
+    return pct, raw > -model.offset_
+
+def score_frame(df, schema, form_type, model=None, compiled=None, metrics=None):
+    metrics = metrics or Metrics(None)
+    # Rule-based findings (deterministic), checked column-wise over the whole frame
+    with metrics.stage("rules", len(df)):
+        if compiled is None:
+            compiled = compile_rules(schema, form_type)
+        out = run_rules_frame(df, compiled)
+
+    # Optional anomaly score, one batched decision_function call for the whole frame
+    anom_scores, flagged = {}, []
+    if model is not None and len(df):
+        with metrics.stage("featurize", len(df)):
+            X = featureize_frame(df, schema, form_type)
+            names = feature_names(schema, form_type)
+            wanted = list(getattr(model, "feature_names_in_", names))
+            X = pd.DataFrame(align_features(X, names, wanted), columns=wanted)
+        with metrics.stage("predict", len(df)):
+            # IsolationForest: the lower decision_function, the more abnormal; higher score => more sloppy
+            scores, flags = anomaly_scores(model, X)
+            anom_scores = dict(zip(df.index, scores))
+            flagged = list(df.index[flags])
+    out["sloppiness_score"] = out["row_index"].map(anom_scores) if anom_scores else None
+
+    # If there were no rule-based findings but the model flags it as abnormal, still log a generic note
+    if flagged:
+        with_rules = set(out["row_index"])
+        notes = pd.DataFrame([{
+            "row_index": idx,
+            "category": "Anomaly",
+            "issue": "Potentially incomplete/inconsistent row",
+            "action_request": "Review this row; model flagged it as unusual compared to good history.",
+            "sloppiness_score": anom_scores[idx]
+        } for idx in flagged if idx not in with_rules], columns=out.columns)
+        out = pd.concat([out, notes], ignore_index=True).sort_values("row_index", kind="stable", ignore_index=True)
+    return out
+
+# Per-process state for batch mode: schema, compiled rules and model are loaded once per worker
+_STATE = {}
+
+def _init_batch(schema, form_type, model_path):
+    _STATE["schema"] = schema
+    _STATE["form_type"] = form_type
+    _STATE["compiled"] = compile_rules(schema, form_type)
+    _STATE["model"] = load_model(model_path)
+
+def _score_one(path, out_dir, keep_frame):
+    rid = report_id_from_path(path)
+    t0 = time.perf_counter()
+    try:
+        df = read_input_csv(path, text_dtypes(_STATE["compiled"]))
+        out = score_frame(df, _STATE["schema"], _STATE["form_type"], _STATE["model"], _STATE["compiled"])
+    except Exception as e:
+        return rid, path, None, f"{type(e).__name__}: {e}", 0, time.perf_counter() - t0
+    if out_dir:
+        out.to_csv(Path(out_dir) / f"findings_{rid}.csv", index=False)
+    return rid, path, (out if keep_frame else len(out)), None, len(df), time.perf_counter() - t0
+
+def run_batch(paths, schema, form_type, model_path, out_dir=None, out_combined_csv=None, workers=1, metrics=None,
+              store=None):
+    metrics = metrics or Metrics(None)
+    if out_dir:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    keep = bool(out_combined_csv or store)
+    # per file: read, rules, anomaly score and findings_<ID>.csv (in the workers)
+    with metrics.stage("score") as st:
+        if workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch,
+                                     initargs=(schema, form_type, model_path)) as ex:
+                chunk = max(1, len(paths) // (workers * 8))
+                results = list(ex.map(_score_one, paths, [out_dir] * len(paths), [keep] * len(paths), chunksize=chunk))
+        else:
+            _init_batch(schema, form_type, model_path)
+            results = [_score_one(p, out_dir, keep) for p in paths]
+        st.rows = sum(r[4] for r in results)
+
+    scored, n_ok = [], 0
+    for rid, path, res, err, _, secs in results:
+        metrics.slow("score", path, secs)
+        if err:
+            print(f"[SKIP] {path}: {err}")
+            continue
+        n_ok += 1
+        if keep:
+            scored.append((rid, res))
+    if store:
+        with metrics.stage("store", len(scored)):
+            save_findings(store, "score", scored)
+    if out_combined_csv:
+        with metrics.stage("write", len(scored)):
+            frames = [res.assign(report_id=rid) for rid, res in scored]
+            combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["report_id", "row_index"])
+            combined = combined[["report_id"] + [c for c in combined.columns if c != "report_id"]]
+            Path(out_combined_csv).parent.mkdir(parents=True, exist_ok=True)
+            combined.to_csv(out_combined_csv, index=False)
+        print(f"Wrote combined findings to {out_combined_csv}")
+    print(f"[OK] Scored {n_ok}/{len(paths)} files" + (f" into {out_dir}" if out_dir else ""))
+
+def iter_input_chunks(path, chunksize, dtype=None):
+    """pd.read_csv in chunks; the index keeps counting across chunks, so row_index stays global.
+
+    Pass dtype (text_dtypes) for columns whose type must not depend on which rows share a chunk.
+    """
+    try:
+        reader = pd.read_csv(path, chunksize=chunksize, dtype=dtype)
+    except pd.errors.EmptyDataError:
+        return
+    with reader:
+        yield from reader
+
+def score_chunked(in_csv, out_csv, schema, form_type, model, chunksize, metrics=None, store=None):
+    """Stream in_csv through score_frame chunk by chunk, appending findings to out_csv.
+
+    Only one chunk and its findings are in memory at a time; the output is the same as
+    scoring the whole file at once. Returns the number of findings written.
+    """
+    metrics = metrics or Metrics(None)
+    compiled = compile_rules(schema, form_type)
+    n = 0
+    header = True
+    Path(out_csv).parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(str(out_csv) + ".tmp")
+    # each chunk's findings go to the store as they are written, all in one run
+    db = ReportStore(store) if store else None
+    run_id = db.start_run("score") if db is not None else None
+    rid = report_id_from_path(in_csv)
+    try:
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            for df in metrics.iterate("load", iter_input_chunks(in_csv, chunksize, text_dtypes(compiled))):
+                out = score_frame(df, schema, form_type, model, compiled, metrics=metrics)
+                with metrics.stage("write", len(out)):
+                    out.to_csv(f, header=header, index=False)
+                    if db is not None:
+                        db.write_findings(run_id, "score", [(rid, out)])
+                header = False
+                n += len(out)
+            if header:  # empty input: header only
+                score_frame(pd.DataFrame(), schema, form_type, None, compiled).to_csv(f, index=False)
+        os.replace(tmp, out_csv)
+        if db is not None:
+            db.finish_run(run_id)
+    finally:
+        if db is not None:
+            db.close()
+    return n
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--input_csv", required=True)
+    ap.add_argument("--input_csv", default=None)
     ap.add_argument("--schema_json", required=True)
     ap.add_argument("--form_type", required=True, choices=["quote_stub","service_report"])
-    ap.add_argument("--out_findings_csv", required=True)
-    ap.add_argument("--model_path", default=None)  # optional isolation forest
+    ap.add_argument("--out_findings_csv", default=None)
+    ap.add_argument("--model_path", default=None)  # optional isolation forest (.joblib or .compact folder)
+    # batch mode: many quote_stub_<ID>.csv in one process
+    ap.add_argument("--input_glob", default=None, help='Glob to quote_stub_*.csv (batch mode)')
+    ap.add_argument("--out_dir", default=None, help="Batch mode: write findings_<ID>.csv per input here")
+    ap.add_argument("--out_combined_csv", default=None, help="Batch mode: one CSV for all inputs, with report_id")
+    ap.add_argument("--workers", type=int, default=1, help="Batch mode: worker processes")
+    ap.add_argument("--chunksize", type=int, default=None,
+                    help="Single-file mode: read and score --input_csv this many rows at a time (flat memory)")
+    ap.add_argument("--store", default=None, help="report_store SQLite file: also save the findings there")
+    add_metrics_args(ap)
     args = ap.parse_args()
 
-    schema = json.load(open(args.schema_json))
-    df = pd.read_csv(args.input_csv)
+    if args.input_glob:
+        if not (args.out_dir or args.out_combined_csv):
+            ap.error("--input_glob needs --out_dir and/or --out_combined_csv")
+    elif not (args.input_csv and args.out_findings_csv):
+        ap.error("either --input_csv with --out_findings_csv, or --input_glob is required")
 
-    findings_rows = []
-    model = None
-    if args.model_path and os.path.exists(args.model_path):
-        try:
-            model = load(args.model_path)
-        except Exception:
-            model = None
-
-    # Build features and findings for each row independently
-    for idx, row in df.iterrows():
-        rec = row.to_dict()
-
-        # Rule-based findings (deterministic)
-        rb_findings = run_rules(rec, schema, args.form_type)
-
-        # Optional anomaly score
-        feat = featureize_record(rec, schema, args.form_type)
-        anom_score = None
-        if model is not None:
-            import pandas as pd
-            X = pd.DataFrame([feat]).fillna(0.0)
-            # IsolationForest decision_function: the lower, the more abnormal. We'll convert to a 0..1 "sloppiness" score.
-            raw = -model.decision_function(X)[0]  # higher => more sloppy
-            anom_score = max(0.0, float(raw))
-
-        for f in rb_findings:
-            findings_rows.append({
-                "row_index": idx,
-                "category": f.get("category"),
-                "issue": f.get("issue"),
-                "action_request": f.get("action_request"),
-                "sloppiness_score": anom_score
-            })
-
-        # If there were no rule-based findings but the model flags it as abnormal, still log a generic note
-        if not rb_findings and anom_score is not None and anom_score > 0.5:
-            findings_rows.append({
-                "row_index": idx,
-                "category": "Anomaly",
-                "issue": "Potentially incomplete/inconsistent row",
-                "action_request": "Review this row; model flagged it as unusual compared to good history.",
-                "sloppiness_score": anom_score
-            })
-
-    out = pd.DataFrame(findings_rows)
-    out.to_csv(args.out_findings_csv, index=False)
+    with Metrics.from_args("score", args) as metrics:
+        run(args, metrics)
+
+def run(args, metrics):
+    with metrics.stage("load"):
+        schema = json.load(open(args.schema_json))
+
+    if args.input_glob:
+        paths = sorted(glob.glob(args.input_glob))
+        if not paths:
+            print(f"[WARN] No input CSVs matched: {args.input_glob}")
+            return
+        run_batch(paths, schema, args.form_type, args.model_path,
+                  out_dir=args.out_dir, out_combined_csv=args.out_combined_csv,
+                  workers=max(1, args.workers), metrics=metrics, store=args.store)
+        return
+
+    if args.chunksize:
+        with metrics.stage("load"):
+            model = load_model(args.model_path)
+        n = score_chunked(args.input_csv, args.out_findings_csv, schema, args.form_type, model,
+                          args.chunksize, metrics, store=args.store)
+        print(f"Wrote {n} findings to {args.out_findings_csv}")
+        return
+
+    with metrics.stage("load") as st:
+        df = pd.read_csv(args.input_csv, dtype=text_dtypes(compile_rules(schema, args.form_type)))
+        model = load_model(args.model_path)
+        st.rows = len(df)
+    out = score_frame(df, schema, args.form_type, model, metrics=metrics)
+    with metrics.stage("write", len(out)):
+        out.to_csv(args.out_findings_csv, index=False)
     print(f"Wrote findings to {args.out_findings_csv}")
+    if args.store:
+        with metrics.stage("store", len(out)):
+            save_findings(args.store, "score", [(report_id_from_path(args.input_csv), out)])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
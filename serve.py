@@ -0,0 +1,192 @@
+# serve.py
+# Resident scoring service on localhost.
+#
+# Loads the schema, the optional IsolationForest and the multi-label pipeline once, then
+# answers HTTP requests:
+#
+#     GET  /health
+#     POST /score   {"report": {...structured JSON...} | "reports": [...],
+#                    "quote_stub_rows": [{...}, ...], "form_type": "quote_stub",
+#                    "threshold": 0.5}    (optional; default: the model's per-label thresholds)
+#
+# and returns {"rule_findings": [...], "ml_findings": [...]}. ML predictions from concurrent
+# requests are micro-batched into one predict_proba call, waiting at most --max_wait_ms
+# for a batch to fill.
+import argparse, json, sys, threading, time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from queue import Queue, Empty
+import pandas as pd
+from .rules import compile_rules
+from .score import load_model, score_frame
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "sloppy_ml"))
+from predict_multilabel import (load_taxonomy, taxonomy_lookup, rec_to_row,
+                                predict_proba_batch, findings_for_report, resolve_thresholds,
+                                load_multilabel)
+
+class MicroBatcher:
+    """Collect single reports from many request threads and score them together.
+
+    Items are rows already built by rec_to_row in the request thread. If a batch call fails,
+    its items are retried one by one, so only the request with the bad report gets the error.
+    """
+
+    def __init__(self, mdl, max_batch=256, max_wait_ms=20):
+        self.pipe = mdl["pipe"]; self.labels = mdl["label_cols"]; self.num_cols = mdl["num_cols"]
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.q = Queue()
+        self.batches = self.items = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, row):
+        fut = Future()
+        self.q.put((row, fut))
+        return fut
+
+    def _run(self):
+        while True:
+            batch = [self.q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(self.q.get(timeout=left))
+                except Empty:
+                    break
+            try:
+                proba = predict_proba_batch(self.pipe, pd.DataFrame([r for r, _ in batch]))
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                proba = None
+            self.batches += 1; self.items += len(batch)
+            if proba is not None:
+                for (_, fut), p in zip(batch, proba):
+                    fut.set_result(p)
+                continue
+            for row, fut in batch:
+                try:
+                    fut.set_result(predict_proba_batch(self.pipe, pd.DataFrame([row]))[0])
+                except Exception as e:
+                    fut.set_exception(e)
+
+class Scorer:
+    def __init__(self, schema, model_path=None, ml_model_path=None, taxonomy_yaml=None,
+                 threshold=None, max_batch=256, max_wait_ms=20):
+        self.schema = schema
+        self.threshold = threshold
+        self.compiled = {ft: compile_rules(schema, ft) for ft in schema["form_types"]}
+        self.model = load_model(model_path)
+        self.lookup = taxonomy_lookup(load_taxonomy(taxonomy_yaml)) if taxonomy_yaml else {}
+        self.batcher = None
+        if ml_model_path:
+            mdl = load_multilabel(ml_model_path)
+            self.labels = mdl["label_cols"]
+            self.threshold = resolve_thresholds(mdl, threshold)
+            self.batcher = MicroBatcher(mdl, max_batch, max_wait_ms)
+
+    def rule_findings(self, rows, form_type):
+        if form_type not in self.compiled:
+            raise ValueError(f"unknown form_type '{form_type}'")
+        out = score_frame(pd.DataFrame(rows), self.schema, form_type, self.model, self.compiled[form_type])
+        return out.astype(object).where(out.notna(), None).to_dict("records")
+
+    def ml_findings(self, reports, threshold, timeout=30.0):
+        if self.batcher is None:
+            raise ValueError("no --ml_model_path loaded")
+        # a malformed report fails here, in its own request, before it can reach a shared batch
+        rows = []
+        for i, rec in enumerate(reports):
+            if not isinstance(rec, dict):
+                raise TypeError(f"report {i}: expected a JSON object, got {type(rec).__name__}")
+            try:
+                rows.append(rec_to_row(rec, self.batcher.num_cols))
+            except Exception as e:
+                raise ValueError(f"report {i}: {type(e).__name__}: {e}")
+        futs = [self.batcher.submit(r) for r in rows]
+        found = []
+        for rec, fut in zip(reports, futs):
+            found += findings_for_report(rec.get("report_id"), fut.result(timeout), self.labels, threshold, self.lookup)
+        return found
+
+    def handle(self, body):
+        result = {}
+        rows = body.get("quote_stub_rows")
+        if rows is not None:
+            result["rule_findings"] = self.rule_findings(rows, body.get("form_type", "quote_stub"))
+        reports = body.get("reports") or ([body["report"]] if body.get("report") else [])
+        if reports:
+            result["ml_findings"] = self.ml_findings(reports, float(body["threshold"]) if body.get("threshold") is not None else self.threshold)
+        return result
+
+def make_handler(scorer):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, obj):
+            data = json.dumps(obj, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, {"error": "not found"})
+            b = scorer.batcher
+            self._send(200, {"ok": True, "ml_model": b is not None, "anomaly_model": scorer.model is not None,
+                             "ml_batches": b.batches if b else 0, "ml_reports": b.items if b else 0})
+
+        def do_POST(self):
+            if self.path != "/score":
+                return self._send(404, {"error": "not found"})
+            t0 = time.perf_counter()
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                result = scorer.handle(body)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": str(e)})
+            except Exception as e:
+                return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            self._send(200, result)
+
+        def log_message(self, fmt, *args):
+            pass  # keep the console for startup/errors only
+
+    return Handler
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--schema_json", required=True)
+    ap.add_argument("--model_path", default=None, help="Optional IsolationForest (.joblib or .compact) for quote-stub rows")
+    ap.add_argument("--ml_model_path", default=None, help="multilabel_model.joblib or multilabel_model.compact")
+    ap.add_argument("--taxonomy_yaml", default=None)
+    ap.add_argument("--threshold", type=float, default=None,
+                    help="Default: the model's tuned per-label thresholds if it has them, else 0.5")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--max_batch", type=int, default=256, help="Most reports per predict_proba call")
+    ap.add_argument("--max_wait_ms", type=float, default=20, help="Longest a report waits for its batch to fill")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    schema = json.load(open(args.schema_json))
+    scorer = Scorer(schema, args.model_path, args.ml_model_path, args.taxonomy_yaml,
+                    args.threshold, args.max_batch, args.max_wait_ms)
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(scorer))
+    print(f"[INFO] models loaded in {time.perf_counter() - t0:.1f}s; serving on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+if __name__ == "__main__":
+    main()
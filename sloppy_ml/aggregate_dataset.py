@@ -1,8 +1,14 @@
 import argparse, json, glob, os, re
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MultiLabelBinarizer
 import yaml
+from dataset_io import write_dataset, check_format
+from feature_cache import FeatureCache, DEFAULT_MAX_MB
+from instrument import Metrics, add_metrics_args
+from report_store import ReportStore
+from structured_io import iter_structured_rows, DEFAULT_WORKERS, DEFAULT_BATCH
 
 def load_taxonomy(tax_path):
     with open(tax_path, "r", encoding="utf-8") as f:
@@ -27,45 +33,30 @@ def clean_report_id_series(s):
          .astype("Int64")
     )
 
-def load_structured_jsons(folder_glob):
-    rows = []
+def load_structured_jsons(folder_glob, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH, cache=None):
     paths = glob.glob(folder_glob)
     if not paths:
         print(f"[WARN] No structured JSONs matched: {folder_glob}")
-    for path in paths:
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                s = json.load(f)
-            # normalize report_id
-            rid = s.get("report_id")
-            if rid is None or str(rid).strip() == "":
-                # fallback: last number in filename
-                m = re.findall(r"(\d+)", Path(path).stem)
-                rid = int(m[-1]) if m else None
-            else:
-                rid = int(re.findall(r"(\d+)", str(rid))[0])
-            row = {
-                "report_id": rid,
-                "arrival": s.get("arrival"),
-                "departure": s.get("departure"),
-                "total_time_spent": s.get("total_time_spent"),
-                "attributes_filled": bool(s.get("attributes_filled", False)),
-                "comments": (s.get("excerpts", {}) or {}).get("comments", ""),
-                "attributes_excerpt": (s.get("excerpts", {}) or {}).get("attributes", ""),
-            }
-            # boolean flags
-            for k, v in (s.get("flags", {}) or {}).items():
-                row[f"flag__{k}"] = bool(v)
-            rows.append(row)
-        except Exception as e:
-            print(f"[SKIP] {path}: {e}")
-    df = pd.DataFrame(rows)
+    frames = [pd.DataFrame(rows) for rows in iter_structured_rows(paths, batch_size, workers, cache) if rows]
+    df = pd.concat(frames, ignore_index=True, sort=False) if frames else pd.DataFrame()
     if "report_id" in df.columns:
         df["report_id"] = pd.to_numeric(df["report_id"], errors="coerce").astype("Int64")
     return df
 
-def attach_labels(df, labels_csv, taxonomy):
+def read_labels(labels_csv):
+    """{report_id: [codes]} as attach_labels reads them (last entry per report wins), for the store."""
     lab = sniff_read_csv(labels_csv)
+    label_col = next((c for c in ["label_codes", "labels", "codes"] if c in lab.columns), None)
+    if "report_id" not in lab.columns or label_col is None:
+        return {}
+    lab["report_id"] = clean_report_id_series(lab["report_id"])
+    lab = lab.dropna(subset=["report_id"]).drop_duplicates("report_id", keep="last")
+    return {int(rid): [c.strip() for c in str(codes).split(";") if c.strip()] if pd.notna(codes) else []
+            for rid, codes in zip(lab["report_id"], lab[label_col])}
+
+def attach_labels(df, labels_csv, taxonomy):
+    # labels_csv: path of labels_template.csv, or the same table as a DataFrame (from the store)
+    lab = labels_csv.copy() if isinstance(labels_csv, pd.DataFrame) else sniff_read_csv(labels_csv)
 
     # validate columns
     if "report_id" not in lab.columns:
@@ -90,24 +81,21 @@ def attach_labels(df, labels_csv, taxonomy):
     # make sure we use the taxonomy order
     classes = taxonomy["code"].tolist()
     mlb = MultiLabelBinarizer(classes=classes)
-    _ = mlb.fit([[]])  # lock classes; we set 0/1 manually below
-
-    # merge labels onto features
-    merged = df.merge(lab[["report_id", "label_list"]], on="report_id", how="left")
-
-    # initialize label columns to 0
-    for c in classes:
-        merged[c] = 0
-
-    # set 1s per labeled report
-    lab_map = dict(zip(lab["report_id"], lab["label_list"]))
-    for rid, codes in lab_map.items():
-        if pd.isna(rid):
-            continue
-        codes = set(codes)
-        for c in codes:
-            if c in merged.columns:
-                merged.loc[merged["report_id"] == rid, c] = 1
+    _ = mlb.fit([[]])  # lock classes
+
+    # one label row per report (last entry wins), unknown codes dropped
+    known = set(classes)
+    per_report = lab.dropna(subset=["report_id"]).drop_duplicates("report_id", keep="last")
+    rid_index = pd.Index(per_report["report_id"])
+    Y_report = mlb.transform([[c for c in codes if c in known] for codes in per_report["label_list"]])
+
+    # index straight onto the structured rows (one dataset row per structured row); unlabeled rows stay 0
+    merged = df.reset_index(drop=True)
+    at = rid_index.get_indexer(merged["report_id"])
+    Y = np.zeros((len(merged), len(classes)), dtype="int64")
+    hit = at >= 0
+    Y[hit] = Y_report[at[hit]]
+    merged = pd.concat([merged, pd.DataFrame(Y, columns=classes, index=merged.index)], axis=1)
 
     # summary/debug
     set_struct = set(merged["report_id"].dropna().astype(int).tolist())
@@ -124,29 +112,78 @@ def attach_labels(df, labels_csv, taxonomy):
         print(f"[WARN] Structured JSONs with no labels: {sorted(list(only_struct))[:10]}{' ...' if len(only_struct)>10 else ''}")
 
     # show positive counts
-    pos = {c: int(merged[c].sum()) for c in classes}
+    pos = dict(zip(classes, Y.sum(axis=0).astype(int).tolist()))
     print(f"[INFO] Label positives in merged dataset: {pos}")
 
     return merged, classes
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--structured_glob", required=True, help='Glob to structured_*.json')
-    ap.add_argument("--labels_csv", required=True)
+    ap.add_argument("--structured_glob", default=None, help='Glob to structured_*.json (default with --store: the stored reports)')
+    ap.add_argument("--labels_csv", default=None, help="Default with --store: the stored labels")
     ap.add_argument("--taxonomy_yaml", required=True)
-    ap.add_argument("--out_csv", required=True)
+    ap.add_argument("--out_csv", default=None, help="CSV export of the dataset")
+    ap.add_argument("--out_dataset", default=None,
+                    help="Columnar dataset (.parquet, or .arrow/.feather for Arrow IPC); .csv also accepted")
+    ap.add_argument("--io_workers", type=int, default=DEFAULT_WORKERS, help="Threads reading structured JSONs")
+    ap.add_argument("--cache_dir", default=None, help="Feature cache folder; unchanged JSONs are not re-read")
+    ap.add_argument("--cache_max_mb", type=float, default=DEFAULT_MAX_MB)
+    ap.add_argument("--store", default=None,
+                    help="report_store SQLite file: reports/labels read from files are saved to it, missing ones are read from it")
+    add_metrics_args(ap)
     args = ap.parse_args()
-
-    taxonomy = load_taxonomy(args.taxonomy_yaml)
-    X = load_structured_jsons(args.structured_glob)
-    if X.empty:
-        raise SystemExit(f"[ERROR] No structured data found for: {args.structured_glob}")
-
-    Xy, label_order = attach_labels(X, args.labels_csv, taxonomy)
-
-    Path(args.out_csv).parent.mkdir(parents=True, exist_ok=True)
-    Xy.to_csv(args.out_csv, index=False)
-    print(f"[OK] Wrote dataset with {len(Xy)} rows and {len(label_order)} labels to {args.out_csv}")
+    if not (args.out_csv or args.out_dataset):
+        ap.error("give --out_dataset and/or --out_csv")
+    if not args.store and not (args.structured_glob and args.labels_csv):
+        ap.error("give --structured_glob and --labels_csv, or --store")
+    if args.out_dataset:
+        check_format(args.out_dataset)
+
+    with Metrics.from_args("aggregate_dataset", args) as metrics:
+        store = ReportStore(args.store) if args.store else None
+        try:
+            X, labels = load_inputs(args, store, metrics)
+        finally:
+            if store is not None:
+                store.close()
+        if X.empty:
+            raise SystemExit(f"[ERROR] No structured data found for: {args.structured_glob or args.store}")
+
+        with metrics.stage("labels", len(X)):
+            Xy, label_order = attach_labels(X, labels, taxonomy=load_taxonomy(args.taxonomy_yaml))
+
+        for out_path in (args.out_dataset, args.out_csv):
+            if out_path:
+                with metrics.stage("write", len(Xy)):
+                    write_dataset(Xy, out_path, label_order)
+                print(f"[OK] Wrote dataset with {len(Xy)} rows and {len(label_order)} labels to {out_path}")
+
+def load_inputs(args, store, metrics):
+    """-> (structured rows, labels CSV path or stored labels frame); file inputs are also saved to the store."""
+    with metrics.stage("load") as st:
+        if args.structured_glob:
+            cache = FeatureCache(args.cache_dir, args.cache_max_mb) if args.cache_dir else None
+            try:
+                X = load_structured_jsons(args.structured_glob, workers=args.io_workers, cache=cache)
+            finally:
+                if cache is not None:
+                    cache.close()
+        else:
+            X = store.structured_rows()
+        st.rows = len(X)
+    labels = args.labels_csv or store.labels_frame()
+    if store is not None and (args.structured_glob or args.labels_csv):
+        with metrics.stage("store") as st:
+            n = 0
+            if args.structured_glob and not X.empty:
+                # one transaction per batch
+                for i in range(0, len(X), DEFAULT_BATCH):
+                    n += store.upsert_reports(X.iloc[i:i + DEFAULT_BATCH])
+            if args.labels_csv:
+                store.replace_labels(read_labels(args.labels_csv))
+            st.rows = n
+        print(f"[INFO] saved {n} reports" + (" and the labels" if args.labels_csv else "") + f" to {args.store}")
+    return X, labels
 
 if __name__ == "__main__":
     main()
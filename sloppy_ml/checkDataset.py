@@ -1,14 +1,10 @@
-import pandas as pd, re
+import pandas as pd, re, sys
+from dataset_io import read_dataset
 
-CSV = r"C:\Users\sokade\Downloads\sloppy_ml\dataset.csv"
-df = pd.read_csv(CSV)
-
-# infer label columns: UPPERCASE and 0/1
-def is_bin(c):
-    s = set(df[c].dropna().unique())
-    return s.issubset({0,1})
-
-label_cols = [c for c in df.columns if c.isupper() and is_bin(c)]
+# dataset.parquet / .arrow / .csv; pass another path as the first argument
+DATASET = sys.argv[1] if len(sys.argv) > 1 else r"C:\Users\sokade\Downloads\sloppy_ml\dataset.csv"
+# label columns: stored in columnar metadata, else UPPERCASE and 0/1
+df, label_cols = read_dataset(DATASET)
 print("Label columns:", label_cols)
 
 # count positives
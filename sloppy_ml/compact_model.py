@@ -0,0 +1,308 @@
+# compact_model.py
+# Compact model artifacts: a folder of plain .npy arrays plus meta.json, loaded with
+# np.load(mmap_mode="r"). Every worker process maps the same files, so the OS keeps one
+# physical copy in the page cache, and loading takes milliseconds. Predicting needs only
+# numpy. Exporting reads the attributes of fitted sklearn objects but does not import sklearn.
+#
+#   multilabel  TF-IDF + scaled flags -> one-vs-rest logistic regression
+#               (train_multilabel.py without --streaming): sorted vocabulary, IDF,
+#               coefficients, intercepts, flag scales
+#   iforest     IsolationForest (train.py): all trees as flat node arrays
+#
+# Export from an existing joblib file:
+#   python compact_model.py --model_path model_out/multilabel_model.joblib --out_dir model_out/multilabel_model.compact
+import argparse, json, os, re, shutil
+from pathlib import Path
+import numpy as np
+
+FORMAT_VERSION = 1
+TOKEN_PATTERN = r"(?u)\b\w\w+\b"  # TfidfVectorizer default
+
+def is_compact(path):
+    return path is not None and (Path(path) / "meta.json").is_file()
+
+def _write(out_dir, meta, arrays):
+    """Write arrays + meta.json into a fresh folder, then swap it in (readers never see half a model)."""
+    out = Path(out_dir)
+    tmp = out.with_name(out.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, arr in arrays.items():
+        np.save(tmp / f"{name}.npy", np.ascontiguousarray(arr), allow_pickle=False)
+    meta = dict(meta, format_version=FORMAT_VERSION, arrays=sorted(arrays))
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    if out.exists():
+        shutil.rmtree(out)
+    os.replace(tmp, out)
+    return out
+
+def _read(path):
+    path = Path(path)
+    meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+    if meta.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: compact format {meta.get('format_version')}, expected {FORMAT_VERSION}")
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r", allow_pickle=False) for name in meta["arrays"]}
+    return meta, arrays
+
+def load_compact(path):
+    meta, arrays = _read(path)
+    kind = {"multilabel": CompactMultilabel, "iforest": CompactIsolationForest}.get(meta.get("kind"))
+    if kind is None:
+        raise ValueError(f"{path}: unknown compact model kind {meta.get('kind')!r}")
+    return kind(meta, arrays)
+
+# ---------------------------------------------------------------------------
+# Multi-label text model
+# ---------------------------------------------------------------------------
+
+def _check_tfidf(vec):
+    if type(vec).__name__ != "TfidfVectorizer":
+        raise ValueError(f"compact export needs a TF-IDF model, got {type(vec).__name__} "
+                         "(models trained with --streaming are not supported)")
+    expected = {"analyzer": "word", "lowercase": True, "token_pattern": TOKEN_PATTERN, "strip_accents": None,
+                "preprocessor": None, "tokenizer": None, "stop_words": None, "binary": False}
+    for k, v in expected.items():
+        if getattr(vec, k) != v:
+            raise ValueError(f"compact export does not support TfidfVectorizer({k}={getattr(vec, k)!r})")
+    if vec.norm not in ("l2", None):
+        raise ValueError(f"compact export does not support TfidfVectorizer(norm={vec.norm!r})")
+
+def export_multilabel(mdl, out_dir):
+    """{'pipe','label_cols','num_cols',...} from train_multilabel -> compact folder."""
+    pipe = mdl["pipe"]
+    pre, clf = pipe.steps[0][1], pipe.steps[-1][1]
+    fitted = {name: (trans, cols) for name, trans, cols in pre.transformers_}
+    vec, _ = fitted["txt"]
+    _check_tfidf(vec)
+    scaler, num_cols = fitted.get("num", (None, []))
+    num_cols = list(num_cols)
+    if list(num_cols) != list(mdl["num_cols"]):
+        raise ValueError("num_cols of the artifact do not match the fitted ColumnTransformer")
+
+    terms = sorted(vec.vocabulary_, key=vec.vocabulary_.get)
+    order = np.argsort(np.array(terms, dtype=str), kind="stable")
+    vocab = np.array(terms, dtype=str)[order]          # sorted, for searchsorted lookup
+    vocab_cols = order.astype(np.int32)                 # sorted position -> feature column
+    n_txt = len(terms)
+    n_feat = n_txt + len(num_cols)
+
+    labels = list(mdl["label_cols"])
+    coef = np.zeros((n_feat, len(labels)))
+    intercept = np.zeros(len(labels))
+    const = np.full(len(labels), np.nan)                # labels that had one class in training
+    for j, est in enumerate(clf.estimators_):
+        if hasattr(est, "coef_"):
+            coef[:, j] = np.asarray(est.coef_).ravel()
+            intercept[j] = np.ravel(est.intercept_)[0]
+        else:
+            const[j] = float(np.ravel(est.y_)[0])
+    scale = np.ones(len(num_cols))
+    if scaler is not None and len(num_cols) and getattr(scaler, "scale_", None) is not None:
+        if getattr(scaler, "with_mean", False):
+            raise ValueError("compact export expects StandardScaler(with_mean=False)")
+        scale = np.asarray(scaler.scale_, dtype=float)
+
+    meta = {"kind": "multilabel", "label_cols": labels, "num_cols": num_cols,
+            "ngram_range": list(vec.ngram_range), "norm": vec.norm, "sublinear_tf": bool(vec.sublinear_tf),
+            "use_idf": bool(vec.use_idf)}
+    if mdl.get("thresholds") is not None:
+        meta["thresholds"] = mdl["thresholds"]
+    if mdl.get("params"):
+        meta["params"] = mdl["params"]
+    arrays = {"vocab": vocab, "vocab_cols": vocab_cols,
+              "idf": np.asarray(vec.idf_, dtype=float) if vec.use_idf else np.ones(n_txt),
+              "coef_txt": coef[:n_txt], "coef_num": coef[n_txt:], "intercept": intercept,
+              "const": const, "scale": scale}
+    return _write(out_dir, meta, arrays)
+
+class CompactMultilabel:
+    """predict_proba(df) on a frame with __text__ and the flag columns, like the sklearn Pipeline."""
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.label_cols = meta["label_cols"]
+        self.num_cols = meta["num_cols"]
+        self.thresholds = meta.get("thresholds")
+        self.ngram_range = tuple(meta["ngram_range"])
+        self.a = arrays
+        self._token = re.compile(TOKEN_PATTERN)
+
+    def as_model(self):
+        """Same keys as the joblib artifact, so callers can treat both alike."""
+        return {"pipe": self, "label_cols": self.label_cols, "num_cols": self.num_cols,
+                "thresholds": self.thresholds, "params": self.meta.get("params")}
+
+    def _grams(self, text):
+        tokens = self._token.findall(str(text).lower())
+        lo, hi = self.ngram_range
+        if hi == 1:
+            return tokens
+        grams = list(tokens) if lo == 1 else []
+        for n in range(max(2, lo), hi + 1):
+            grams += [" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+        return grams
+
+    def weights(self, df):
+        """Features of df: (docs, cols, w) tf-idf weights of the text columns, and the scaled flags (n x n_num)."""
+        a = self.a
+        n = len(df)
+        texts = df["__text__"].fillna("").to_numpy(dtype=object) if "__text__" in df else np.full(n, "", dtype=object)
+        docs, grams = [], []
+        for i, t in enumerate(texts):
+            g = self._grams(t)
+            grams += g
+            docs += [i] * len(g)
+        cols, w = np.zeros(0, dtype=np.int64), np.zeros(0)
+        if grams:
+            grams = np.array(grams, dtype=str)
+            vocab = a["vocab"]
+            pos = np.minimum(np.searchsorted(vocab, grams), len(vocab) - 1)
+            hit = vocab[pos] == grams
+            docs = np.asarray(docs)[hit]
+            cols = np.asarray(a["vocab_cols"])[pos[hit]]
+            # term counts per (doc, column)
+            keys, tf = np.unique(docs.astype(np.int64) * len(vocab) + cols, return_counts=True)
+            docs, cols = keys // len(vocab), keys % len(vocab)
+            tf = tf.astype(float)
+            if self.meta.get("sublinear_tf"):
+                tf = np.log(tf) + 1
+            w = tf * np.asarray(a["idf"])[cols]
+            if self.meta.get("norm") == "l2":
+                norms = np.sqrt(np.bincount(docs, weights=w * w, minlength=n))
+                w = w / norms[docs]
+        docs = np.asarray(docs, dtype=np.int64)
+        num = np.zeros((n, 0))
+        if self.num_cols:
+            num = np.column_stack([df[c].to_numpy(dtype=float) if c in df else np.zeros(n) for c in self.num_cols])
+            num = num / np.asarray(a["scale"])
+        return docs, cols, w, num
+
+    def feature_names(self):
+        """Name of every feature column: vocabulary terms in column order, then num_cols."""
+        names = np.empty(len(self.a["vocab"]), dtype=object)
+        names[np.asarray(self.a["vocab_cols"])] = self.a["vocab"]
+        return np.concatenate([names, np.array(self.num_cols, dtype=object)])
+
+    def decision_function(self, df, weights=None):
+        a = self.a
+        n = len(df)
+        docs, cols, w, num = weights if weights is not None else self.weights(df)
+        dec = np.tile(np.asarray(a["intercept"]), (n, 1))
+        if len(w):
+            contrib = w[:, None] * np.asarray(a["coef_txt"][cols])
+            for j in range(dec.shape[1]):
+                dec[:, j] += np.bincount(docs, weights=contrib[:, j], minlength=n)
+        if self.num_cols:
+            dec += num @ np.asarray(a["coef_num"])
+        return dec
+
+    def predict_proba(self, df, weights=None):
+        """weights: the result of weights(df), when the caller already has it."""
+        proba = 1 / (1 + np.exp(-self.decision_function(df, weights)))
+        const = np.asarray(self.a["const"])
+        fixed = ~np.isnan(const)
+        proba[:, fixed] = const[fixed]
+        return proba
+
+# ---------------------------------------------------------------------------
+# IsolationForest
+# ---------------------------------------------------------------------------
+
+def _average_path_length(n):
+    """Expected path length of an unsuccessful BST search over n points (as in sklearn)."""
+    n = np.asarray(n, dtype=float)
+    out = np.where(n == 2, 1.0, 0.0)
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + np.euler_gamma) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+def export_isolation_forest(model, out_dir):
+    n_features = int(model.n_features_in_)
+    subsample = getattr(model, "_max_features", n_features) != n_features
+    left, right, feature, threshold, leaf_value, roots = [], [], [], [], [], []
+    offset = max_depth = 0
+    for est, feats in zip(model.estimators_, model.estimators_features_):
+        t = est.tree_
+        depth = t.compute_node_depths()
+        is_leaf = t.children_left == -1
+        f = np.where(is_leaf, 0, t.feature)
+        roots.append(offset)
+        # leaves point to themselves with an always-true split, so traversal can run a fixed
+        # number of steps (the tree depth) without checking which rows reached a leaf
+        own = np.arange(t.node_count) + offset
+        left.append(np.where(is_leaf, own, t.children_left + offset))
+        right.append(np.where(is_leaf, own, t.children_right + offset))
+        feature.append(np.asarray(feats)[f] if subsample else f)
+        threshold.append(np.where(is_leaf, np.inf, t.threshold))
+        leaf_value.append(depth + _average_path_length(t.n_node_samples) - 1.0)
+        max_depth = max(max_depth, int(depth.max()))
+        offset += t.node_count
+    names = getattr(model, "feature_names_in_", None)
+    meta = {"kind": "iforest", "n_features": n_features, "n_estimators": len(model.estimators_),
+            "max_samples": int(model._max_samples), "max_depth": max_depth, "offset": float(model.offset_),
+            "feature_names": [str(x) for x in names] if names is not None else None}
+    arrays = {"left": np.concatenate(left).astype(np.int32), "right": np.concatenate(right).astype(np.int32),
+              "feature": np.concatenate(feature).astype(np.int32), "threshold": np.concatenate(threshold),
+              "leaf_value": np.concatenate(leaf_value), "roots": np.asarray(roots, dtype=np.int32)}
+    if getattr(model, "score_quantiles_", None) is not None:   # train.py calibration
+        arrays["score_quantiles"] = np.asarray(model.score_quantiles_, dtype=float)
+    return _write(out_dir, meta, arrays)
+
+class CompactIsolationForest:
+    """score_samples/decision_function of the exported IsolationForest (same numbers)."""
+
+    def __init__(self, meta, arrays, chunk_rows=1024):
+        self.meta = meta
+        self.a = arrays
+        self.offset_ = meta["offset"]
+        self.chunk_rows = chunk_rows
+        if meta.get("feature_names") is not None:
+            self.feature_names_in_ = np.array(meta["feature_names"], dtype=object)
+        if "score_quantiles" in arrays:
+            self.score_quantiles_ = np.asarray(arrays["score_quantiles"])
+        self._c = float(_average_path_length([meta["max_samples"]])[0]) * meta["n_estimators"]
+
+    def _depths(self, X):
+        a = self.a
+        left, right, feature, threshold = a["left"], a["right"], a["feature"], a["threshold"]
+        n, n_feat = X.shape
+        flat = X.ravel()
+        base = (np.arange(n) * n_feat)[:, None]
+        nodes = np.broadcast_to(np.asarray(a["roots"]), (n, len(a["roots"]))).copy()
+        for _ in range(self.meta["max_depth"]):
+            go_left = flat[base + feature[nodes]] <= threshold[nodes]
+            nodes = np.where(go_left, left[nodes], right[nodes])
+        # summed tree by tree, in the same order as sklearn, so scores match bit for bit
+        values = np.asarray(a["leaf_value"])[nodes]
+        depths = np.zeros(n)
+        for t in range(values.shape[1]):
+            depths += values[:, t]
+        return depths
+
+    def score_samples(self, X):
+        X = np.asarray(X, dtype=np.float32)  # trees split on float32 inputs
+        depths = np.concatenate([self._depths(X[i:i + self.chunk_rows])
+                                 for i in range(0, len(X), self.chunk_rows)]) if len(X) else np.zeros(0)
+        if self._c == 0:
+            return -np.ones(len(X))
+        return -(2 ** (-depths / self._c))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset_
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_path", required=True, help="multilabel_model.joblib or model_<form_type>.joblib")
+    ap.add_argument("--out_dir", required=True, help="Compact model folder to write")
+    args = ap.parse_args()
+
+    import joblib
+    mdl = joblib.load(args.model_path)
+    if isinstance(mdl, dict):
+        out = export_multilabel(mdl, args.out_dir)
+    else:
+        out = export_isolation_forest(mdl, args.out_dir)
+    print("Wrote compact model", out)
+
+if __name__ == "__main__":
+    main()
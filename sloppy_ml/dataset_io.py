@@ -0,0 +1,117 @@
+# dataset_io.py
+# Read/write the training dataset as a columnar artifact (Parquet or Arrow IPC/Feather),
+# with CSV kept as an export format. Columnar files carry compact dtypes (bool flags,
+# uint8 labels, dictionary-encoded short text) and the label column list in their metadata,
+# so readers can memory-map them and load only the columns they need.
+import json
+from pathlib import Path
+import pandas as pd
+
+META_KEY = b"sloppy_ml"
+COLUMNAR_SUFFIXES = {".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+# short, repetitive text -> dictionary encoded
+CATEGORY_COLS = ["arrival", "departure", "total_time_spent", "label_list"]
+
+def dataset_format(path):
+    return COLUMNAR_SUFFIXES.get(Path(path).suffix.lower(), "csv")
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+    except ImportError:
+        raise SystemExit("[ERROR] Parquet/Arrow datasets need pyarrow: py -m pip install pyarrow")
+    return pa, pq, feather
+
+def check_format(path):
+    """Fail now, not after hours of work, if writing `path` will need a missing pyarrow."""
+    if dataset_format(path) != "csv":
+        _pyarrow()
+
+def infer_label_cols(df):
+    """Legacy CSV rule: label columns are UPPERCASE and hold only 0/1."""
+    return [c for c in df.columns if c.isupper() and set(df[c].dropna().unique()) <= {0,1}]
+
+def compact_dtypes(df, label_cols):
+    out = df.copy()
+    for c in out.columns:
+        if c.startswith("flag__") or c == "attributes_filled":
+            # missing flags are False, as at prediction time
+            out[c] = out[c].fillna(False).astype(bool)
+    for c in label_cols:
+        out[c] = out[c].fillna(0).astype("uint8")
+    if "label_list" in out.columns:
+        out["label_list"] = out["label_list"].map(lambda v: ";".join(v) if isinstance(v, (list, tuple)) else v)
+    for c in CATEGORY_COLS:
+        if c in out.columns:
+            out[c] = out[c].astype("category")
+    return out
+
+def write_dataset(df, path, label_cols):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fmt = dataset_format(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+        return path
+    pa, pq, feather = _pyarrow()
+    table = pa.Table.from_pandas(compact_dtypes(df, label_cols), preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[META_KEY] = json.dumps({"label_cols": list(label_cols)}).encode("utf-8")
+    table = table.replace_schema_metadata(meta)
+    if fmt == "parquet":
+        pq.write_table(table, path, compression="zstd")
+    else:
+        feather.write_feather(table, path, compression="uncompressed")  # uncompressed IPC can be memory-mapped
+    return path
+
+def dataset_columns(path):
+    """(column names, label columns or None) without loading any data (CSV: header only)."""
+    fmt = dataset_format(path)
+    if fmt == "csv":
+        return list(pd.read_csv(path, nrows=0).columns), None
+    pa, pq, feather = _pyarrow()
+    if fmt == "parquet":
+        schema = pq.read_schema(path)
+    else:
+        with pa.memory_map(str(path)) as src:
+            schema = pa.ipc.open_file(src).schema
+    meta = (schema.metadata or {}).get(META_KEY)
+    label_cols = json.loads(meta)["label_cols"] if meta else None
+    return list(schema.names), label_cols
+
+def read_dataset(path, columns=None):
+    """Load a dataset -> (DataFrame, label columns). Columnar formats read only `columns`."""
+    fmt = dataset_format(path)
+    if fmt == "csv":
+        df = pd.read_csv(path, usecols=columns)
+        return df, infer_label_cols(df)
+    pa, pq, feather = _pyarrow()
+    _, label_cols = dataset_columns(path)
+    if fmt == "parquet":
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    df = table.to_pandas()
+    if label_cols is None:
+        label_cols = infer_label_cols(df)
+    return df, [c for c in label_cols if c in df.columns]
+
+def iter_dataset(path, columns=None, chunk_rows=50000):
+    """Yield the dataset as DataFrames of at most chunk_rows rows, never holding it all in memory.
+
+    CSV label columns are not known up front; use infer_label_cols on the first chunk.
+    """
+    fmt = dataset_format(path)
+    if fmt == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+        return
+    pa, pq, feather = _pyarrow()
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        yield batch.to_pandas()
@@ -0,0 +1,134 @@
+# feature_cache.py
+# On-disk, content-addressed cache shared by aggregate_dataset and predict_multilabel.
+# Entries are keyed by the sha256 of a structured_<ID>.json plus a version:
+#   rows/   normalized training row (structured_io.structured_to_row), per ROW_VERSION
+#   feats/  transformed sparse feature row (CSR .npz, uncompressed), per model file hash
+# A small SQLite index remembers path/size/mtime -> sha256 (so unchanged files are not
+# even opened) and entry sizes/last use for LRU eviction under a size cap.
+import hashlib, json, os, sqlite3, time
+from pathlib import Path
+import numpy as np
+import scipy.sparse as sp
+
+DEFAULT_MAX_MB = 2048
+
+def file_sha256(path, bufsize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(bufsize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class FeatureCache:
+    def __init__(self, cache_dir, max_mb=DEFAULT_MAX_MB):
+        self.root = Path(cache_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.db = sqlite3.connect(str(self.root / "index.sqlite"))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        self._touched = {}
+        self.hits = self.misses = 0
+
+    # --- path -> content hash
+    def known_hash(self, path):
+        """sha256 recorded for this path if its size and mtime are unchanged, else None."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self.db.execute("SELECT size, mtime_ns, sha256 FROM files WHERE path=?", (str(path),)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        return None
+
+    def remember_hash(self, path, sha):
+        st = os.stat(path)
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)", (str(path), st.st_size, st.st_mtime_ns, sha))
+
+    # --- entries
+    def _path(self, kind, version, sha, ext):
+        return self.root / kind / str(version) / sha[:2] / f"{sha}{ext}"
+
+    def _key(self, kind, version, sha):
+        return f"{kind}/{version}/{sha}"
+
+    def _hit(self, key):
+        self.hits += 1
+        self._touched[key] = time.time()
+
+    def _store(self, key, path, write):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        write(tmp)
+        os.replace(tmp, path)
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?)", (key, path.stat().st_size, time.time()))
+
+    def get_row(self, sha, version):
+        path = self._path("rows", version, sha, ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                row = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self._hit(self._key("rows", version, sha))
+        return row
+
+    def put_row(self, sha, version, row):
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(row, f, ensure_ascii=False)
+        self._store(self._key("rows", version, sha), self._path("rows", version, sha, ".json"), write)
+
+    def get_vector(self, sha, version):
+        """(1 x n_features CSR row, report_id) or None."""
+        path = self._path("feats", version, sha, ".npz")
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                vec = sp.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+                rid = json.loads(str(z["report_id"]))
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self._hit(self._key("feats", version, sha))
+        return vec, rid
+
+    def put_vector(self, sha, version, vec, report_id):
+        vec = sp.csr_matrix(vec)
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                np.savez(f, data=vec.data, indices=vec.indices, indptr=vec.indptr,
+                         shape=np.array(vec.shape), report_id=np.array(json.dumps(report_id)))
+        self._store(self._key("feats", version, sha), self._path("feats", version, sha, ".npz"), write)
+
+    # --- housekeeping
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        removed = 0
+        if total > self.max_bytes:
+            for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+                kind, version, sha = key.split("/")
+                ext = ".json" if kind == "rows" else ".npz"
+                try:
+                    os.remove(self._path(kind, version, sha, ext))
+                except OSError:
+                    pass
+                self.db.execute("DELETE FROM entries WHERE key=?", (key,))
+                total -= size; removed += 1
+                if total <= self.max_bytes:
+                    break
+        return removed
+
+    def close(self):
+        if self._touched:
+            self.db.executemany("UPDATE entries SET last_used=? WHERE key=?",
+                                [(t, k) for k, t in self._touched.items()])
+            self._touched = {}
+        removed = self.evict()
+        self.db.commit()
+        self.db.close()
+        print(f"[INFO] feature cache {self.root}: {self.hits} hits, {self.misses} misses, {removed} evicted")
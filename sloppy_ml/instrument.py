@@ -0,0 +1,180 @@
+# instrument.py
+# Per-stage metrics shared by the CLIs (score, train, aggregate_dataset, train_multilabel,
+# predict_multilabel, merge_hybrid): wall and CPU time, rows processed and peak memory per
+# stage, the slowest individual items (files/reports), an optional cProfile dump, and an
+# export as JSON or as a Prometheus textfile (node_exporter textfile collector).
+# Standard library only, so both the sloppy_ml scripts and the top-level package can use it.
+import cProfile, io, json, os, pstats, sys, time
+from contextlib import contextmanager
+from heapq import heappush, heappushpop
+from pathlib import Path
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (MB), or None if the platform has no cheap way."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil  # Windows: peak working set
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+def cpu_seconds():
+    # includes worker processes that have exited (ProcessPoolExecutor after shutdown; POSIX only)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def add_metrics_args(ap):
+    ap.add_argument("--metrics_out", default=None,
+                    help="Write per-stage metrics: .json, or .prom for a Prometheus textfile")
+    ap.add_argument("--profile", default=None, help="Run under cProfile and dump pstats to this file")
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Stage:
+    __slots__ = ("rows",)
+    def __init__(self, rows=None):
+        self.rows = rows
+
+class Metrics:
+    def __init__(self, job, metrics_out=None, profile=None, top_n=10):
+        self.job = job
+        self.metrics_out = metrics_out
+        self.profile = profile
+        self.top_n = top_n
+        self.stages = {}
+        self.slowest = {}
+        self.status = "ok"
+        self._profiler = None
+
+    @classmethod
+    def from_args(cls, job, args):
+        return cls(job, getattr(args, "metrics_out", None), getattr(args, "profile", None))
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time a block; set .rows on the yielded object when the count is only known inside.
+        Repeated stages (e.g. one per batch) are summed."""
+        st = Stage(rows)
+        t0, c0 = time.perf_counter(), cpu_seconds()
+        try:
+            yield st
+        finally:
+            wall, cpu = time.perf_counter() - t0, cpu_seconds() - c0
+            s = self.stages.setdefault(name, {"seconds": 0.0, "cpu_seconds": 0.0, "rows": None, "calls": 0})
+            s["seconds"] += wall
+            s["cpu_seconds"] += cpu
+            s["calls"] += 1
+            if st.rows is not None:
+                s["rows"] = (s["rows"] or 0) + int(st.rows)
+            s["peak_rss_mb"] = peak_rss_mb()
+
+    def iterate(self, name, iterable, count=len):
+        """Yield from iterable, timing each next() as stage `name` (rows += count(item))."""
+        it = iter(iterable)
+        while True:
+            with self.stage(name) as st:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                st.rows = count(item)
+            yield item
+
+    def slow(self, stage, item, seconds):
+        """Remember the top_n slowest items of a stage (e.g. a huge PDF or comment field)."""
+        heap = self.slowest.setdefault(stage, [])
+        entry = (float(seconds), str(item))
+        if len(heap) < self.top_n:
+            heappush(heap, entry)
+        else:
+            heappushpop(heap, entry)
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        self._started = time.time()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if exc_type is not None and not issubclass(exc_type, SystemExit):
+            self.status = "failed"
+        self.total_seconds = time.perf_counter() - self._t0
+        self.report()
+        return False
+
+    # --- output
+    def as_dict(self):
+        stages = {}
+        for name, s in self.stages.items():
+            s = dict(s)
+            s["seconds"] = round(s["seconds"], 4); s["cpu_seconds"] = round(s["cpu_seconds"], 4)
+            s["rows_per_sec"] = round(s["rows"] / s["seconds"], 1) if s["rows"] and s["seconds"] > 0 else None
+            stages[name] = s
+        return {"job": self.job, "status": self.status, "started": self._started,
+                "seconds": round(self.total_seconds, 4), "peak_rss_mb": peak_rss_mb(), "stages": stages,
+                "slowest": {k: [{"item": i, "seconds": round(t, 4)} for t, i in sorted(v, reverse=True)]
+                            for k, v in self.slowest.items()}}
+
+    def prometheus(self):
+        d = self.as_dict()
+        job = d["job"]
+        lines = []
+        def metric(name, help_, typ, samples):
+            lines.append(f"# HELP sloppy_{name} {help_}")
+            lines.append(f"# TYPE sloppy_{name} {typ}")
+            for labels, v in samples:
+                if v is None:
+                    continue
+                lab = ",".join(f'{k}="{_escape(x)}"' for k, x in labels.items())
+                lines.append(f"sloppy_{name}{{{lab}}} {v}")
+        st = d["stages"]
+        metric("stage_seconds", "Wall time per pipeline stage", "gauge",
+               [({"job": job, "stage": k}, s["seconds"]) for k, s in st.items()])
+        metric("stage_cpu_seconds", "CPU time per pipeline stage", "gauge",
+               [({"job": job, "stage": k}, s["cpu_seconds"]) for k, s in st.items()])
+        metric("stage_rows", "Rows processed per pipeline stage", "gauge",
+               [({"job": job, "stage": k}, s["rows"]) for k, s in st.items()])
+        metric("stage_peak_rss_bytes", "Process peak RSS at the end of the stage", "gauge",
+               [({"job": job, "stage": k}, int(s["peak_rss_mb"] * 1024 * 1024) if s["peak_rss_mb"] else None)
+                for k, s in st.items()])
+        metric("job_seconds", "Wall time of the whole run", "gauge", [({"job": job}, d["seconds"])])
+        metric("job_success", "1 if the last run finished without error", "gauge",
+               [({"job": job}, int(d["status"] == "ok"))])
+        metric("job_last_run_timestamp_seconds", "Start time of the last run", "gauge",
+               [({"job": job}, round(d["started"], 3))])
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        for name, s in self.stages.items():
+            rows = f", {s['rows']} rows ({s['rows'] / s['seconds']:.0f}/s)" if s["rows"] and s["seconds"] > 0 else ""
+            print(f"[INFO] {self.job} {name}: {s['seconds']:.2f}s wall, {s['cpu_seconds']:.2f}s CPU{rows}, "
+                  f"peak RSS {s.get('peak_rss_mb')} MB")
+        for name, heap in self.slowest.items():
+            worst = sorted(heap, reverse=True)[:3]
+            print(f"[INFO] slowest in {name}: " + ", ".join(f"{i} ({t:.2f}s)" for t, i in worst))
+        if self._profiler is not None:
+            Path(self.profile).parent.mkdir(parents=True, exist_ok=True)
+            self._profiler.dump_stats(self.profile)
+            buf = io.StringIO()
+            pstats.Stats(self._profiler, stream=buf).sort_stats("cumulative").print_stats(15)
+            print(buf.getvalue())
+            print("Wrote profile", self.profile, f"(py -m pstats {self.profile})")
+        if self.metrics_out:
+            path = Path(self.metrics_out)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            text = self.prometheus() if path.suffix in (".prom", ".txt") else json.dumps(self.as_dict(), indent=2)
+            # write-then-rename, so a textfile collector never reads half a file
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, path)
+            print("Wrote metrics", path)
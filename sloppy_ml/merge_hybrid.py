@@ -1,25 +1,260 @@
-import argparse, pandas as pd
+import argparse, glob, io, os, re, numpy as np, pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--rule_findings_csv", required=True)
-    ap.add_argument("--ml_findings_csv", required=True)
-    ap.add_argument("--out_csv", required=True)
-    args = ap.parse_args()
-    rule = pd.read_csv(args.rule_findings_csv) if Path(args.rule_findings_csv).exists() else pd.DataFrame()
-    ml = pd.read_csv(args.ml_findings_csv) if Path(args.ml_findings_csv).exists() else pd.DataFrame()
+from instrument import Metrics, add_metrics_args
+from report_store import save_findings
+from structured_io import DEFAULT_WORKERS
+
+def read_findings(path):
+    if not Path(path).exists():
+        return pd.DataFrame()
+    try:
+        return pd.read_csv(path)
+    except pd.errors.EmptyDataError:
+        # predict_multilabel writes an empty file when no label passes the threshold
+        return pd.DataFrame()
+
+def report_id_from_path(path):
+    m = re.findall(r"(\d+)", Path(path).stem)
+    return m[-1] if m else Path(path).stem
+
+def prepare(rule, ml):
     if not rule.empty:
         rule["source"] = "rules"
         rule["label_code"] = rule["issue"].str.upper().str.replace(r"[^A-Z0-9]+","_", regex=True)
         rule["confidence"] = 1.0
     if not ml.empty:
         ml["source"] = "ml"
+    return rule, ml
+
+def merge_one(rule, ml):
+    rule, ml = prepare(rule, ml)
     combined = pd.concat([rule, ml], ignore_index=True, sort=False)
     if not combined.empty:
         combined["key"] = combined["label_code"].fillna("") + "|" + combined["issue"].fillna("")
         combined = combined.sort_values(["source","confidence"], ascending=[True, False]).drop_duplicates("key", keep="first")
         combined.drop(columns=["key"], inplace=True)
-    combined.to_csv(args.out_csv, index=False)
+    return combined
+
+def _read_bytes(path):
+    try:
+        return Path(path).read_bytes()
+    except OSError:
+        return b""
+
+# read_csv's default true/false spellings: a column of only these parses as bool
+BOOL_TEXT = ["True", "TRUE", "true", "False", "FALSE", "false"]
+
+def _parse(header, lines):
+    return pd.read_csv(io.BytesIO(header + b"\n" + b"\n".join(lines)))
+
+def _own_dtype_rids(df):
+    """Report IDs in a jointly parsed frame whose rows alone would parse to other dtypes."""
+    rid, own = df["__rid__"], set()
+    for c in df.columns.drop("__rid__"):
+        s = df[c]
+        if pd.api.types.is_float_dtype(s):
+            # only whole numbers, no blanks: int64 on its own
+            alone = (s.notna() & (s % 1 == 0)).groupby(rid).all()
+        elif pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s):
+            # only numbers, only true/false, or all blank: numeric or bool on its own
+            na = s.isna()
+            alone = ((na | pd.to_numeric(s, errors="coerce").notna()).groupby(rid).all()
+                     | (na | s.isin(BOOL_TEXT)).groupby(rid).all())
+        else:
+            continue  # int and bool columns stay int and bool for any subset of rows
+        own.update(alone.index[alone])
+    return own
+
+def load_all(paths, workers=DEFAULT_WORKERS):
+    """Many findings CSVs -> (frames tagged with __rid__, {report ID: index in frames}, every report ID seen).
+
+    Each frame holds files whose rows read_findings would give the same columns and dtypes,
+    so a report merged from its frames matches merge_one. Files are read in threads and
+    parsed with one read_csv per distinct header line; a file is parsed on its own when it
+    has a line break inside a quoted field or stray whitespace lines, or when its rows alone
+    would infer other dtypes (e.g. only whole numbers in a float column). Header-only files
+    share one empty frame per header; empty files get no frame (read_findings: empty frame).
+    """
+    rids, frame_of, groups, frames = [], {}, {}, []
+
+    def add(df, members):
+        frame_of.update(dict.fromkeys(members, len(frames)))
+        frames.append(df)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for path, data in zip(paths, ex.map(_read_bytes, paths)):
+            rid = report_id_from_path(path)
+            rids.append(rid)
+            header, _, body = data.replace(b"\r\n", b"\n").partition(b"\n")
+            lines = [l for l in body.split(b"\n") if l]
+            if not data.strip():
+                continue  # empty stub, or no label passed the threshold
+            if (not header.strip() or b"\r" in header + body
+                    or any(l.count(b'"') % 2 or not l.strip() for l in [header] + lines)):
+                add(pd.read_csv(io.BytesIO(data)).assign(__rid__=rid), [rid])
+                continue
+            groups.setdefault(header, {})[rid] = lines
+    for header, files in groups.items():
+        bare = [rid for rid, lines in files.items() if not lines]
+        if bare:
+            add(_parse(header, []).assign(__rid__=None), bare)
+        files = {rid: lines for rid, lines in files.items() if lines}
+        if not files:
+            continue
+        df = _parse(header, [l for lines in files.values() for l in lines])
+        df["__rid__"] = np.repeat(np.array(list(files), dtype=object), [len(lines) for lines in files.values()])
+        own = _own_dtype_rids(df)
+        for rid in own:
+            add(_parse(header, files[rid]).assign(__rid__=rid), [rid])
+        add(df[~df["__rid__"].isin(own)], [rid for rid in files if rid not in own])
+    return frames, frame_of, rids
+
+def _rows_for(frames, i, rids):
+    if i is None:
+        return pd.DataFrame()
+    df = frames[i]
+    return df[df["__rid__"].isin(rids)].copy()
+
+def merge_all(rule_paths, ml_paths, metrics=None, workers=DEFAULT_WORKERS):
+    """All reports, each with the same rows, columns and dtypes as merge_one on its two files.
+
+    Reports whose rule and ML files landed in the same pair of load_all frames are merged
+    together: one stable sort and drop_duplicates on (report, label_code, issue).
+    Returns ([(merged rows with __rid__ sorted by report, report IDs)], every report ID).
+    """
+    metrics = metrics or Metrics(None)
+    with metrics.stage("load", len(rule_paths) + len(ml_paths)):
+        rule_frames, rule_of, rule_rids = load_all(rule_paths, workers)
+        ml_frames, ml_of, ml_rids = load_all(ml_paths, workers)
+    rids = sorted(set(rule_rids) | set(ml_rids))
+    pairs = {}
+    for rid in rids:
+        pairs.setdefault((rule_of.get(rid), ml_of.get(rid)), []).append(rid)
+    parts = []
+    with metrics.stage("merge") as st:
+        for (i, j), pair_rids in pairs.items():
+            rule, ml = prepare(_rows_for(rule_frames, i, pair_rids), _rows_for(ml_frames, j, pair_rids))
+            # rule rows first, like merge_one, so the stable sort below breaks ties the same way
+            combined = pd.concat([rule, ml], ignore_index=True, sort=False)
+            if not combined.empty:
+                combined["key"] = combined["label_code"].fillna("") + "|" + combined["issue"].fillna("")
+                combined = combined.sort_values(["__rid__", "source", "confidence"], ascending=[True, True, False], kind="stable")
+                combined = combined.drop_duplicates(["__rid__", "key"], keep="first").drop(columns=["key"])
+            parts.append((combined, pair_rids))
+        st.rows = sum(len(df) for df, _ in parts)
+    return parts, rids
+
+def flatten(parts):
+    """All merged rows in one frame, sorted by report (--out_csv)."""
+    frames = [df for df, _ in parts if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=["__rid__"])
+    return pd.concat(frames, ignore_index=True, sort=False).sort_values("__rid__", kind="stable")
+
+def write_reports(parts, out_dir, workers=DEFAULT_WORKERS):
+    """final_findings_<ID>.csv for every report, byte for byte what single-file mode writes.
+
+    Each part is rendered to CSV in one call and cut into per-report files (reports with no
+    rows get the header only); a cell with a line break falls back to one to_csv per report.
+    """
+    out = Path(out_dir)
+    nl = os.linesep  # to_csv's default line ending
+    jobs = []
+    for combined, pair_rids in parts:
+        cols = [c for c in combined.columns if c != "__rid__"]
+        header = combined[cols].iloc[:0].to_csv(index=False, lineterminator=nl)
+        at = combined["__rid__"].to_numpy(dtype=object) if len(combined) else np.zeros(0, dtype=object)
+        starts = np.flatnonzero(np.r_[True, at[1:] != at[:-1]]) if len(at) else np.zeros(0, dtype=int)
+        spans = dict(zip(at[starts], zip(starts, np.r_[starts[1:], len(at)])))
+        if any(combined[c].astype(str).str.contains("[\r\n]").any() for c in cols
+               if pd.api.types.is_object_dtype(combined[c]) or pd.api.types.is_string_dtype(combined[c])):
+            body = lambda a, b, df=combined[cols]: df.iloc[a:b].to_csv(index=False, header=False, lineterminator=nl)
+        else:
+            lines = combined[cols].to_csv(index=False, header=False, lineterminator=nl).split(nl)
+            body = lambda a, b, lines=lines: "".join(l + nl for l in lines[a:b])
+        jobs.extend((rid, header, body, spans.get(rid, (0, 0))) for rid in pair_rids)
+
+    def write_one(job):
+        rid, header, body, (a, b) = job
+        with open(out / f"final_findings_{rid}.csv", "w", encoding="utf-8", newline="") as f:
+            f.write(header + body(a, b))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        list(ex.map(write_one, jobs))
+
+def report_rows(parts):
+    """(report_id, merged rows as dicts) for every report (report_store)."""
+    by_rid = {rid: [] for _, pair_rids in parts for rid in pair_rids}
+    for combined, _ in parts:
+        for r in combined.to_dict("records"):
+            by_rid[r.pop("__rid__")].append(r)
+    return by_rid.items()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rule_findings_csv", default=None)
+    ap.add_argument("--ml_findings_csv", default=None)
+    ap.add_argument("--out_csv", default=None)
+    # all-reports mode
+    ap.add_argument("--rule_glob", default=None, nargs="+", help="Glob(s)/dir(s)/file(s) of findings_<ID>.csv (all-reports mode)")
+    ap.add_argument("--ml_glob", default=None, nargs="+", help="Glob(s)/dir(s)/file(s) of predicted_findings_<ID>.csv (all-reports mode)")
+    ap.add_argument("--out_dir", default=None, help="All-reports mode: write final_findings_<ID>.csv here")
+    ap.add_argument("--io_workers", type=int, default=DEFAULT_WORKERS, help="All-reports mode: threads reading/writing files")
+    ap.add_argument("--store", default=None, help="report_store SQLite file: also save the merged findings there")
+    add_metrics_args(ap)
+    args = ap.parse_args()
+
+    if args.rule_glob or args.ml_glob:
+        if not (args.out_dir or args.out_csv):
+            ap.error("all-reports mode needs --out_dir and/or --out_csv")
+    elif not (args.rule_findings_csv and args.ml_findings_csv and args.out_csv):
+        ap.error("give --rule_findings_csv, --ml_findings_csv and --out_csv, or use --rule_glob/--ml_glob")
+
+    with Metrics.from_args("merge_hybrid", args) as metrics:
+        run(args, metrics)
+
+def run(args, metrics):
+    if args.rule_glob or args.ml_glob:
+        def expand(globs, pattern):
+            paths = set()
+            for g in globs or []:
+                paths.update(glob.glob(str(Path(g) / pattern) if Path(g).is_dir() else g))
+            return sorted(paths)
+        rule_paths = expand(args.rule_glob, "findings_*.csv")
+        ml_paths = expand(args.ml_glob, "predicted_findings_*.csv")
+        parts, rids = merge_all(rule_paths, ml_paths, metrics, args.io_workers)
+        n = sum(len(df) for df, _ in parts)
+        print(f"[INFO] {len(rule_paths)} rule files, {len(ml_paths)} ML files, {len(rids)} reports, {n} merged findings")
+        if args.out_csv:
+            with metrics.stage("write", n):
+                flat = flatten(parts)
+                flat = flat.drop(columns=[c for c in ("report_id",) if c in flat.columns])
+                flat = flat.rename(columns={"__rid__": "report_id"})
+                flat = flat[["report_id"] + [c for c in flat.columns if c != "report_id"]]
+                Path(args.out_csv).parent.mkdir(parents=True, exist_ok=True)
+                flat.to_csv(args.out_csv, index=False)
+            print("Wrote", args.out_csv)
+        if args.out_dir:
+            out = Path(args.out_dir); out.mkdir(parents=True, exist_ok=True)
+            with metrics.stage("write", len(rids)):
+                write_reports(parts, out, args.io_workers)
+            print(f"Wrote {len(rids)} final_findings_<ID>.csv to {out}")
+        if args.store:
+            with metrics.stage("store", len(rids)):
+                save_findings(args.store, "merge", report_rows(parts))
+        return
+
+    with metrics.stage("load", 2):
+        rule, ml = read_findings(args.rule_findings_csv), read_findings(args.ml_findings_csv)
+    with metrics.stage("merge", len(rule) + len(ml)):
+        combined = merge_one(rule, ml)
+    with metrics.stage("write", len(combined)):
+        combined.to_csv(args.out_csv, index=False)
     print("Wrote", args.out_csv)
+    if args.store:
+        with metrics.stage("store", 1):
+            save_findings(args.store, "merge", [(report_id_from_path(args.out_csv), combined)])
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,333 @@
+# near_dup.py
+# Copy-paste detection: reports whose comments/attributes excerpt is (nearly) the same
+# text as another report's. Each excerpt becomes a MinHash signature over word 3-grams;
+# an LSH index (signature split into bands, one indexed bucket per band) finds candidate
+# reports in a handful of indexed lookups instead of comparing against the whole archive,
+# and candidates are confirmed by their estimated Jaccard similarity.
+#
+# The index is a SQLite file that grows as reports are loaded: unchanged reports are
+# skipped (text hash), changed ones are re-indexed, and confirmed matches are stored in
+# both directions, so an older report also learns about the newer copy. A new index holds
+# its first reports back (pending) until it has seen enough texts (boilerplate_sample) to
+# learn the form text from; they are then indexed and matched together.
+#
+#   python near_dup.py --structured_glob "sloppy_reports/structured/structured_*.json" \
+#       --index sloppy_ml/near_dup.sqlite --out_dir sloppy_ml/near_dup
+#
+# writes dup_findings_<ID>.csv (same columns as predicted_findings_<ID>.csv) for reports
+# with a match; predict_multilabel --dup_index adds the same finding to its own output.
+import argparse, glob, hashlib, json, re, sqlite3, zlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from instrument import Metrics, add_metrics_args
+from structured_io import iter_structured, normalize_report_id, DEFAULT_WORKERS, DEFAULT_BATCH
+
+LABEL_CODE = "DUPLICATED_NARRATIVE"
+ISSUE = "Report narrative duplicated from other report(s)"
+ACTION = "Describe the work actually done on this visit instead of copying text from an earlier report."
+
+NUM_PERM = 128
+BANDS = 16          # 16 bands x 8 rows: pairs above ~0.7 Jaccard almost always share a bucket
+SHINGLE = 3         # words per shingle
+BOILERPLATE_SAMPLE = 500   # texts a new index learns the form text from before matching
+# matching settings: a new index stores them (given or default), a reopened one reads them back
+SETTINGS = {"threshold": (float, 0.8), "min_words": (int, 8),
+            "boilerplate_df": (float, 0.3), "boilerplate_sample": (int, BOILERPLATE_SAMPLE)}
+_MERSENNE = np.uint64((1 << 61) - 1)
+_WORD = re.compile(r"\w+")
+
+def report_key(s, path):
+    # same ID predict_multilabel names its output after
+    rid = s.get("report_id")
+    return rid if rid is not None and str(rid).strip() != "" else normalize_report_id(s, path)
+
+def excerpt_text(s):
+    ex = s.get("excerpts", {}) or {}
+    return ((ex.get("comments", "") or "") + " " + (ex.get("attributes", "") or "")).strip()
+
+def shingles(text, k=SHINGLE):
+    words = _WORD.findall(str(text).lower())
+    if len(words) < k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+class MinHasher:
+    """Fixed random permutations (seeded), so signatures are comparable across runs."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        # a < 2^31 and 32-bit shingle hashes keep a*x + b inside uint64
+        self.a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+
+    def signature(self, grams):
+        x = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        h = (x[:, None] * self.a[None, :] + self.b[None, :]) % _MERSENNE
+        return (h & np.uint64(0xFFFFFFFF)).min(axis=0).astype(np.uint32)
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return float(np.mean(sig_a == sig_b))
+
+class NearDupIndex:
+    def __init__(self, path, num_perm=NUM_PERM, bands=BANDS, threshold=None, min_words=None,
+                 max_candidates=200, max_matches=10, boilerplate_df=None, boilerplate_sample=None):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # sharded predict runs update one index from several processes: wait for the write lock
+        self.db = sqlite3.connect(str(path), timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS reports (report_id TEXT PRIMARY KEY, text_sha TEXT, sig BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER, key INTEGER, report_id TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, key)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_report ON buckets (report_id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS matches (report_id TEXT, other_id TEXT, similarity REAL, "
+                        "PRIMARY KEY (report_id, other_id))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pending (report_id TEXT PRIMARY KEY, text TEXT)")
+        # the signature layout is fixed once the first report is stored
+        layout = {"num_perm": str(num_perm), "bands": str(bands), "shingle": str(SHINGLE)}
+        stored = dict(self.db.execute("SELECT key, value FROM meta WHERE key != 'boilerplate'"))
+        built = {k: stored[k] for k in layout if k in stored}
+        if built and built != layout:
+            raise ValueError(f"{path} was built with {built}; rebuild it or use the same settings")
+        # so are the matching settings; None means whatever the index was built with
+        given = {"threshold": threshold, "min_words": min_words,
+                 "boilerplate_df": boilerplate_df, "boilerplate_sample": boilerplate_sample}
+        settings = {k: cast(stored[k]) if k in stored else cast(given[k] if given[k] is not None else default)
+                    for k, (cast, default) in SETTINGS.items()}
+        conflict = {k: settings[k] for k, v in given.items() if v is not None and SETTINGS[k][0](v) != settings[k]}
+        if conflict:
+            raise ValueError(f"{path} was built with {conflict}; rebuild it or leave these settings out")
+        self.db.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)",
+                            [(k, str(v)) for k, v in {**layout, **settings}.items()])
+        self.db.commit()
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = settings["threshold"]
+        self.min_words = settings["min_words"]
+        self.max_candidates = max_candidates
+        self.max_matches = max_matches
+        self.boilerplate_df = settings["boilerplate_df"]
+        self.boilerplate_sample = max(1, settings["boilerplate_sample"])
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'boilerplate'").fetchone()
+        self.boilerplate = set(json.loads(row[0])) if row else None
+        self.added = self.skipped = self.waiting = 0
+
+    def _learn_boilerplate(self, texts):
+        """Form text printed on every report (field labels, section titles) would make all
+        reports look alike, so shingles in more than boilerplate_df of the first
+        boilerplate_sample+ texts are ignored from then on. Frozen in the index:
+        signatures must stay comparable."""
+        df = {}
+        for text in texts:
+            for g in shingles(text):
+                df[g] = df.get(g, 0) + 1
+        cut = self.boilerplate_df * len(texts)
+        common = sorted(g for g, n in df.items() if n > cut)
+        self.db.execute("INSERT INTO meta VALUES ('boilerplate', ?)", (json.dumps(common),))
+        self.boilerplate = set(common)
+
+    def _wait_for_sample(self, items):
+        """New index: park [(report_id, text)] in `pending` until boilerplate_sample texts are
+        there, then learn the boilerplate from all of them -> the items to index now."""
+        # write lock first: of several processes sharing a new index, one learns the boilerplate
+        self.db.execute("BEGIN IMMEDIATE")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'boilerplate'").fetchone()
+        if row:
+            self.boilerplate = set(json.loads(row[0]))
+            return items
+        self.db.executemany("INSERT OR REPLACE INTO pending VALUES (?, ?)", items)
+        waiting = self.db.execute("SELECT report_id, text FROM pending ORDER BY rowid").fetchall()
+        if len(waiting) < self.boilerplate_sample:
+            self.waiting = len(waiting)
+            return []
+        self._learn_boilerplate([text for _, text in waiting])
+        self.db.execute("DELETE FROM pending")
+        self.waiting = 0
+        return waiting
+
+    def _band_keys(self, sig):
+        # 8-byte digest of each band, as a signed int for SQLite
+        return [int.from_bytes(hashlib.blake2b(sig[i * self.rows:(i + 1) * self.rows].tobytes(), digest_size=8).digest(),
+                               "little", signed=True) for i in range(self.bands)]
+
+    def _remove(self, rid):
+        """Drop a report's buckets and matches -> the reports it was matched with."""
+        partners = [o for (o,) in self.db.execute("SELECT other_id FROM matches WHERE report_id = ?", (rid,))]
+        self.db.execute("DELETE FROM buckets WHERE report_id = ?", (rid,))
+        self.db.execute("DELETE FROM matches WHERE report_id = ? OR other_id = ?", (rid, rid))
+        return partners
+
+    def update(self, items):
+        """Index [(report_id, text)] and match them against everything indexed so far.
+
+        Returns the set of report IDs whose duplicate findings may have changed (new or
+        changed reports and their old and new matches). All of a batch is indexed before
+        matching, so copies within the same batch find each other too. While a new index
+        waits for its boilerplate sample nothing is matched; the batch that completes the
+        sample returns every report that waited.
+        """
+        fresh, affected = [], set()
+        items = [(str(rid), text) for rid, text in items]
+        if self.boilerplate is None:
+            items = self._wait_for_sample(items)
+        for rid, text in items:
+            sha = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            row = self.db.execute("SELECT text_sha FROM reports WHERE report_id = ?", (rid,)).fetchone()
+            if row and row[0] == sha:
+                self.skipped += 1
+                continue
+            affected.add(rid)
+            affected.update(self._remove(rid))
+            grams = shingles(text) - self.boilerplate
+            n_words = len(_WORD.findall(text))
+            sig = self.hasher.signature(grams) if grams and n_words >= self.min_words else None
+            # too-short texts are remembered (so they are not re-read) but never matched
+            self.db.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?)",
+                            (rid, sha, sig.tobytes() if sig is not None else None))
+            if sig is not None:
+                self.db.executemany("INSERT INTO buckets VALUES (?, ?, ?)",
+                                    [(b, k, rid) for b, k in enumerate(self._band_keys(sig))])
+                fresh.append((rid, sig))
+            self.added += 1
+        for rid, sig in fresh:
+            affected.update(self._match(rid, sig))
+        self.db.commit()
+        return affected
+
+    def known(self, rids):
+        """The report IDs of `rids` already in the index (indexed or pending)."""
+        rids, found = [str(r) for r in rids], set()
+        for i in range(0, len(rids), 500):
+            part = rids[i:i + 500]
+            marks = ",".join("?" * len(part))
+            for table in ("reports", "pending"):
+                found.update(r for (r,) in self.db.execute(
+                    f"SELECT report_id FROM {table} WHERE report_id IN ({marks})", part))
+        return found
+
+    def candidates(self, sig, exclude=None):
+        found = set()
+        for b, k in enumerate(self._band_keys(sig)):
+            rows = self.db.execute("SELECT report_id FROM buckets WHERE band = ? AND key = ? LIMIT ?",
+                                   (b, k, self.max_candidates + 1))
+            found.update(r for (r,) in rows)
+        found.discard(exclude)
+        return found
+
+    def _match(self, rid, sig):
+        scored = []
+        for other in self.candidates(sig, exclude=rid):
+            blob = self.db.execute("SELECT sig FROM reports WHERE report_id = ?", (other,)).fetchone()[0]
+            sim = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if sim >= self.threshold:
+                scored.append((sim, other))
+        scored.sort(reverse=True)
+        for sim, other in scored[:self.max_matches]:
+            self.db.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?)",
+                                [(rid, other, sim), (other, rid, sim)])
+        return [other for _, other in scored[:self.max_matches]]
+
+    def query(self, text):
+        """[(report_id, similarity)] for a text that is not (necessarily) in the index."""
+        grams = shingles(text) - (self.boilerplate or set())
+        if not grams or len(_WORD.findall(text)) < self.min_words:
+            return []
+        sig = self.hasher.signature(grams)
+        out = []
+        for other in self.candidates(sig):
+            blob = self.db.execute("SELECT sig FROM reports WHERE report_id = ?", (other,)).fetchone()[0]
+            sim = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if sim >= self.threshold:
+                out.append((other, sim))
+        return sorted(out, key=lambda t: -t[1])[:self.max_matches]
+
+    def duplicates(self, rid):
+        """[(other report_id, similarity)], most similar first."""
+        rows = self.db.execute("SELECT other_id, similarity FROM matches WHERE report_id = ? "
+                               "ORDER BY similarity DESC, other_id LIMIT ?", (str(rid), self.max_matches))
+        return rows.fetchall()
+
+    def findings(self, rid):
+        """The duplicated-narrative finding for a report (predict_multilabel row format), or []."""
+        dups = self.duplicates(rid)
+        if not dups:
+            return []
+        return [{"report_id": rid, "label_code": LABEL_CODE, "confidence": round(dups[0][1], 3),
+                 "issue": ISSUE, "action_request": ACTION,
+                 "matched_reports": ";".join(f"{o} ({s:.2f})" for o, s in dups)}]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def print_waiting(index):
+    if index.waiting:
+        print(f"[INFO] {index.waiting} reports wait for {index.boilerplate_sample} to learn the form text from "
+              "before they are matched (--boilerplate_sample)")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--structured_glob", required=True, nargs="+", help="Glob(s) or file(s) of structured_*.json")
+    ap.add_argument("--index", required=True, help="SQLite index file (created if missing)")
+    ap.add_argument("--out_dir", default=None, help="Write dup_findings_<ID>.csv for reports with a match")
+    # stored in a new index; an existing one keeps the values it was built with
+    ap.add_argument("--threshold", type=float, default=None, help="Minimum estimated Jaccard similarity (default 0.8)")
+    ap.add_argument("--min_words", type=int, default=None, help="Shorter excerpts are never flagged (default 8)")
+    ap.add_argument("--boilerplate_df", type=float, default=None,
+                    help="New index: ignore word 3-grams found in more than this share of the first "
+                         "--boilerplate_sample+ reports (form text; default 0.3)")
+    ap.add_argument("--boilerplate_sample", type=int, default=None,
+                    help=f"New index: reports to learn the form text from; nothing is matched until then "
+                         f"(default {BOILERPLATE_SAMPLE})")
+    ap.add_argument("--io_workers", type=int, default=DEFAULT_WORKERS)
+    ap.add_argument("--batch_size", type=int, default=DEFAULT_BATCH)
+    add_metrics_args(ap)
+    args = ap.parse_args()
+
+    with Metrics.from_args("near_dup", args) as metrics:
+        run(args, metrics)
+
+def run(args, metrics):
+    index = NearDupIndex(args.index, threshold=args.threshold, min_words=args.min_words,
+                         boilerplate_df=args.boilerplate_df, boilerplate_sample=args.boilerplate_sample)
+    paths = [p for g in args.structured_glob for p in glob.glob(g)]
+    out = Path(args.out_dir) if args.out_dir else None
+    if out:
+        out.mkdir(parents=True, exist_ok=True)
+    touched = set()
+    try:
+        for batch in metrics.iterate("read", iter_structured(paths, batch_size=max(1, args.batch_size),
+                                                              workers=args.io_workers)):
+            items = []
+            for path, s, err in batch:
+                if err is not None:
+                    print(f"[SKIP] {path}: {err}")
+                    continue
+                items.append((report_key(s, path), excerpt_text(s)))
+            with metrics.stage("index", len(items)):
+                touched |= index.update(items)
+        print(f"[INFO] {index.added} reports indexed, {index.skipped} unchanged")
+        print_waiting(index)
+        if out:
+            with metrics.stage("write", len(touched)):
+                n = 0
+                for rid in sorted(touched):
+                    rows = index.findings(rid)
+                    path = out / f"dup_findings_{rid}.csv"
+                    if rows:
+                        pd.DataFrame(rows).to_csv(path, index=False)
+                        n += 1
+                    elif path.exists():
+                        path.unlink()  # no longer a copy (text changed)
+            print(f"Wrote {n} dup_findings_<ID>.csv to {out}")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
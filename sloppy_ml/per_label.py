@@ -0,0 +1,33 @@
+# per_label.py
+# The final step of a --streaming multilabel Pipeline: one binary classifier per label,
+# each trained with partial_fit chunk by chunk in train_multilabel.train_streaming. Also wraps
+# the one LogisticRegression of a single-label model (train_multilabel.per_label_outputs).
+# Lives in its own module so pickled models load from predict_multilabel, serve and watch
+# (a class defined in a script would be pickled as __main__.<name>).
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+class PerLabelClassifier(ClassifierMixin, BaseEstimator):
+    """Fitted per-label binary classifiers -> the outputs of a fitted OneVsRestClassifier:
+    predict_proba / decision_function are n_samples x n_labels, predict the 0/1 matrix."""
+
+    def __init__(self, estimators=()):
+        self.estimators = estimators
+
+    def fit(self, X=None, y=None):
+        """Nothing to learn: the estimators are already fitted."""
+        for e in self.estimators:
+            if not hasattr(e, "coef_"):
+                raise ValueError(f"{type(e).__name__} is not fitted")
+        self.estimators_ = list(self.estimators)
+        return self
+
+    def decision_function(self, X):
+        return np.column_stack([np.ravel(e.decision_function(X)) for e in self.estimators_])
+
+    def predict_proba(self, X):
+        # probability of class 1 per label
+        return np.column_stack([e.predict_proba(X)[:, list(e.classes_).index(1)] for e in self.estimators_])
+
+    def predict(self, X):
+        return (self.decision_function(X) > 0).astype(int)
@@ -1,8 +1,15 @@
 # predict_multilabel.py
-import argparse, json, glob, joblib, yaml, re
+import argparse, glob, joblib, yaml, re
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from compact_model import is_compact, load_compact
+from feature_cache import FeatureCache, DEFAULT_MAX_MB, file_sha256
+from instrument import Metrics, add_metrics_args
+from near_dup import NearDupIndex, report_key, excerpt_text, print_waiting, LABEL_CODE as DUP_CODE
+from report_store import ReportStore
+from structured_io import iter_structured, DEFAULT_WORKERS, DEFAULT_BATCH
 
 
 def load_taxonomy(tax_path):
@@ -10,11 +17,7 @@ def load_taxonomy(tax_path):
         y = yaml.safe_load(f)
     return pd.DataFrame(y["labels"])
 
-def load_structured(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def rec_to_df(s, num_cols):
+def rec_to_row(s, num_cols):
     flags = s.get("flags", {})
     comments = s.get("excerpts", {}).get("comments", "") or ""
     attrs    = s.get("excerpts", {}).get("attributes", "") or ""
@@ -28,57 +31,348 @@ def rec_to_df(s, num_cols):
     # ensure all numeric feature columns exist
     for c in num_cols:
         row[c] = bool(flags.get(c.replace("flag__",""), False)) if c.startswith("flag__") else row.get(c, False)
-    return pd.DataFrame([row])
+    return row
+
+def rec_to_df(s, num_cols):
+    return pd.DataFrame([rec_to_row(s, num_cols)])
+
+def recs_to_df(records, num_cols):
+    return pd.DataFrame([rec_to_row(s, num_cols) for s in records])
+
+def taxonomy_lookup(tax):
+    """code -> (issue, action); first entry wins, as with tax[tax["code"]==code].head(1)."""
+    lookup = {}
+    for code, issue, action in zip(tax["code"], tax["issue"], tax["action"]):
+        lookup.setdefault(code, (issue, action))
+    return lookup
+
+def load_multilabel(path):
+    """multilabel_model.joblib, or a multilabel_model.compact/ folder (mmap'd, no sklearn needed)."""
+    if is_compact(path):
+        return load_compact(path).as_model()
+    return joblib.load(path)
+
+def predict_proba_batch(pipe, df):
+    """One pipeline call for the whole chunk -> (n_reports, n_labels) probabilities."""
+    if hasattr(pipe, "predict_proba"):
+        proba = pipe.predict_proba(df)
+    else:
+        dec = pipe.decision_function(df)
+        proba = 1/(1+np.exp(-dec))
+    return np.asarray(proba, dtype=float).reshape(df.shape[0], -1)
+
+def cached_chunk(chunk, cache, version, pipe, num_cols, workers, read=None, hits=None):
+    """Feature rows for a chunk of paths: cached rows for unchanged files, pipe[:-1] for the rest.
+
+    Returns ([(report_id, 1 x n CSR row)] in path order). Files that had to be read are
+    appended to `read` as (path, structured) when given, cache hits to `hits` as (path, report_id).
+    """
+    got, todo = {}, []
+    for path in chunk:
+        sha = cache.known_hash(path)
+        hit = cache.get_vector(sha, version) if sha else None
+        if sha is None:
+            cache.misses += 1
+        if hit is None:
+            todo.append(path)
+        else:
+            got[path] = (hit[1], hit[0])
+            if hits is not None:
+                hits.append((path, hit[1]))
+    recs = []
+    for batch in iter_structured(todo, batch_size=max(1, len(todo)), workers=workers, with_hash=True):
+        for path, s, err, sha in batch:
+            if err is not None:
+                print(f"[SKIP] {path}: {err}")
+                continue
+            recs.append((path, s, sha))
+    if read is not None:
+        read.extend((path, s) for path, s, _ in recs)
+    if recs:
+        Xt = sp.csr_matrix(pipe[:-1].transform(recs_to_df([s for _, s, _ in recs], num_cols)))
+        for j, (path, s, sha) in enumerate(recs):
+            rid = s.get("report_id")
+            cache.put_vector(sha, version, Xt[j], rid)
+            cache.remember_hash(path, sha)
+            got[path] = (rid, Xt[j])
+    return [got[p] for p in chunk if p in got]
+
+def resolve_thresholds(mdl, threshold=None):
+    """--threshold wins; otherwise the per-label thresholds saved by `train_multilabel --search`, else 0.5."""
+    if threshold is not None:
+        return float(threshold)
+    return mdl.get("thresholds") or 0.5
+
+def findings_for_report(rid, proba, labels, threshold, lookup, explained=None):
+    # threshold: one value for all labels, or one per label (aligned with labels)
+    # explained: {label_code: (top_terms, top_flags)} from explain_batch
+    thresholds = np.broadcast_to(np.asarray(threshold, dtype=float), (len(labels),))
+    rows = []
+    for code, p, t in zip(labels, proba, thresholds):
+        p = float(p)
+        if p < t:
+            continue
+        row = {"report_id": rid, "label_code": code, "confidence": round(p,3)}
+        if code in lookup:
+            row["issue"], row["action_request"] = lookup[code]
+        if explained is not None:
+            row["top_terms"], row["top_flags"] = explained.get(code, ("", ""))
+        rows.append(row)
+    return rows
+
+# ---------------------------------------------------------------------------
+# Explanations: the model is linear in its features, so a label's decision value is
+# intercept + sum(x_f * coef_fj). The largest positive x_f * coef_fj of a report's nonzero
+# features are why the label fired; all chosen (report, label) pairs of a batch are
+# scored with a few array operations on the CSR feature matrix.
+# ---------------------------------------------------------------------------
+
+def linear_explainer(pipe, num_cols):
+    """(feature names, n_features x n_labels coefficients, is-flag mask) of a fitted model.
+
+    Hashed text features (streaming models) have no names; their coefficients are zeroed,
+    so only flags are explained.
+    """
+    if not hasattr(pipe, "steps"):
+        coef = np.vstack([np.asarray(pipe.a["coef_txt"]), np.asarray(pipe.a["coef_num"])])
+        names = pipe.feature_names()
+    else:
+        pre, clf = pipe.steps[0][1], pipe.steps[-1][1]
+        vec = {name: trans for name, trans, _ in pre.transformers_}["txt"]
+        n_txt = len(vec.vocabulary_) if hasattr(vec, "vocabulary_") else vec.n_features
+        coef = np.zeros((n_txt + len(num_cols), len(clf.estimators_)))
+        for j, est in enumerate(clf.estimators_):
+            if hasattr(est, "coef_"):           # labels constant in training have none
+                coef[:, j] = np.asarray(est.coef_).ravel()
+        if hasattr(vec, "vocabulary_"):
+            txt = np.asarray(vec.get_feature_names_out(), dtype=object)
+        else:
+            print("[WARN] --explain_top_k: hashed text features have no names; explaining flags only")
+            txt = np.full(n_txt, "", dtype=object)
+            coef[:n_txt] = 0.0
+        names = np.concatenate([txt, np.array(num_cols, dtype=object)])
+    is_flag = np.zeros(len(names), dtype=np.int64)
+    is_flag[len(names) - len(num_cols):] = 1
+    return names, coef, is_flag
+
+def explain_batch(X, proba, threshold, explainer, k):
+    """Top-k positive contributions per chosen (report, label) of a batch.
+
+    Returns one {label index: (top_terms, top_flags)} dict per report; each string is
+    'feature (+contribution); ...' in decreasing order.
+    """
+    names, coef, is_flag = explainer
+    X = sp.csr_matrix(X)
+    rows, labs = np.nonzero(proba >= np.asarray(threshold, dtype=float))
+    # every nonzero feature of every chosen pair, without a Python loop over pairs
+    counts = np.diff(X.indptr)[rows]
+    pair = np.repeat(np.arange(len(rows)), counts)
+    pos = np.arange(counts.sum()) + np.repeat(X.indptr[rows] - (np.cumsum(counts) - counts), counts)
+    feat = X.indices[pos]
+    contrib = X.data[pos] * coef[feat, labs[pair]]
+    keep = contrib > 0
+    # rank within (pair, terms|flags), largest first
+    group, feat, contrib = pair[keep] * 2 + is_flag[feat[keep]], feat[keep], contrib[keep]
+    order = np.lexsort((-contrib, group))
+    group, feat, contrib = group[order], feat[order], contrib[order]
+    start = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    rank = np.arange(len(group)) - np.repeat(start, np.diff(np.r_[start, len(group)]))
+    top = rank < k
+    parts = [([], []) for _ in rows]
+    for g, f, c in zip(group[top].tolist(), feat[top].tolist(), contrib[top].tolist()):
+        parts[g >> 1][g & 1].append(f"{names[f]} ({c:+.3f})")
+    out = [{} for _ in range(X.shape[0])]
+    for (i, j), (terms, flags) in zip(zip(rows.tolist(), labs.tolist()), parts):
+        out[i][j] = ("; ".join(terms), "; ".join(flags))
+    return out
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--structured_glob", required=True)
-    ap.add_argument("--model_path", required=True)
+    ap.add_argument("--structured_glob", required=True, nargs="+", help="Glob(s) or file(s) of structured_*.json")
+    ap.add_argument("--model_path", required=True, help="multilabel_model.joblib or multilabel_model.compact")
     ap.add_argument("--taxonomy_yaml", required=True)
-    ap.add_argument("--threshold", type=float, default=0.5)
+    ap.add_argument("--threshold", type=float, default=None,
+                    help="Default: the model's tuned per-label thresholds if it has them, else 0.5")
     ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--io_workers", type=int, default=DEFAULT_WORKERS, help="Threads reading structured JSONs")
+    ap.add_argument("--batch_size", type=int, default=DEFAULT_BATCH, help="Reports per predict_proba call")
+    ap.add_argument("--cache_dir", default=None, help="Feature cache folder; unchanged reports skip featurization")
+    ap.add_argument("--cache_max_mb", type=float, default=DEFAULT_MAX_MB)
+    ap.add_argument("--dup_index", default=None,
+                    help="near_dup SQLite index: index the reports read and add DUPLICATED_NARRATIVE findings")
+    ap.add_argument("--store", default=None, help="report_store SQLite file: also save the findings there")
+    ap.add_argument("--explain_top_k", type=int, default=0,
+                    help="Add top_terms/top_flags columns: the k n-grams and k flags that pushed each label up most")
+    add_metrics_args(ap)
     args = ap.parse_args()
 
+    with Metrics.from_args("predict_multilabel", args) as metrics:
+        predict(args, metrics)
+
+def predict(args, metrics):
     out = Path(args.out_dir); out.mkdir(parents=True, exist_ok=True)
-    tax = load_taxonomy(args.taxonomy_yaml)
-    mdl = joblib.load(args.model_path)
+    with metrics.stage("load"):
+        lookup = taxonomy_lookup(load_taxonomy(args.taxonomy_yaml))
+        mdl = load_multilabel(args.model_path)
     pipe = mdl["pipe"]; labels = mdl["label_cols"]; num_cols = mdl["num_cols"]
+    staged = hasattr(pipe, "steps")
+    threshold = resolve_thresholds(mdl, args.threshold)
+    index = NearDupIndex(args.dup_index) if args.dup_index else None
+    store = ReportStore(args.store) if args.store else None
+    run_id = store.start_run("predict") if store is not None else None
+    pending = []
+    explainer = None
+    if args.explain_top_k > 0:
+        with metrics.stage("load"):
+            explainer = linear_explainer(pipe, num_cols)
 
-    for path in glob.glob(args.structured_glob):
-        s = load_structured(path)
-        df = rec_to_df(s, num_cols)
+    def explain(X, proba):
+        if explainer is None:
+            return [None] * len(proba)
+        with metrics.stage("explain", len(proba)):
+            return [{labels[j]: v for j, v in e.items()}
+                    for e in explain_batch(X, proba, threshold, explainer, args.explain_top_k)]
 
-        # Fill any missing expected numeric columns with False/0
-        for c in num_cols:
-            if c not in df.columns:
-                df[c] = False
+    def compact_features(df):
+        # compact model: featurize once, for both the probabilities and the explanations
+        docs, cols, w, num = wts = pipe.weights(df)
+        n_txt = len(pipe.a["vocab"])
+        X = sp.hstack([sp.csr_matrix((w, (docs, cols)), shape=(len(df), n_txt)), sp.csr_matrix(num)], format="csr")
+        return wts, X
 
-        # Predict probabilities if available
-        if hasattr(pipe, "predict_proba"):
-            proba = pipe.predict_proba(df)[0]
-        else:
-            dec = pipe.decision_function(df)[0]
-            proba = 1/(1+np.exp(-dec))
-
-        chosen = []
-        for i, code in enumerate(labels):
-            p = float(proba[i]) if hasattr(proba, "__len__") else float(proba)
-            if p >= args.threshold:
-                chosen.append((code, p))
-
-        rid = s.get("report_id")
-        rows = []
-        for code, p in chosen:
-            row = {"report_id": rid, "label_code": code, "confidence": round(p,3)}
-            hit = tax[tax["code"]==code].head(1)
-            if not hit.empty:
-                row["issue"] = hit["issue"].iloc[0]
-                row["action_request"] = hit["action"].iloc[0]
-            rows.append(row)
+    def index_reports(read):
+        # copies inside the batch and of anything indexed earlier are found here
+        if index is not None and read:
+            with metrics.stage("dup_index", len(read)):
+                items = [(report_key(s, path), excerpt_text(s)) for path, s in read]
+                affected = index.update(items)
+            # this batch is written next; reports written before it get their dup rows redone
+            refresh_dups(affected - {str(rid) for rid, _ in items})
+
+    def refresh_dups(rids):
+        """Replace the DUPLICATED_NARRATIVE rows of already written predicted_findings_<ID>.csv."""
+        for rid in sorted(rids):
+            out_csv = out / f"predicted_findings_{rid}.csv"
+            if not out_csv.exists():
+                continue  # not predicted into this --out_dir (yet)
+            try:
+                old = pd.read_csv(out_csv, dtype=str)
+            except pd.errors.EmptyDataError:
+                old = pd.DataFrame(columns=["label_code"])
+            dups = index.findings(rid)
+            kept = old[old["label_code"] != DUP_CODE]
+            if not dups and len(kept) == len(old):
+                continue  # had no copies and still has none
+            rows = kept.to_dict("records") + dups
+            pd.DataFrame(rows).to_csv(out_csv, index=False)
+            print("Rewrote", out_csv)
+            if store is not None:
+                pending.append((rid, rows))
 
+    def write(rid, p, explained=None):
+        rows = findings_for_report(rid, p, labels, threshold, lookup, explained)
+        if index is not None:
+            rows += index.findings(str(rid))
         out_csv = out / f"predicted_findings_{rid}.csv"
         pd.DataFrame(rows).to_csv(out_csv, index=False)
         print("Wrote", out_csv)
+        if store is not None:
+            pending.append((rid, rows))
+
+    def flush():
+        # one store transaction per batch
+        if pending:
+            with metrics.stage("store", len(pending)):
+                store.write_findings(run_id, "predict", pending)
+            pending.clear()
+
+    def close():
+        if store is not None:
+            store.close()
+        if index is not None:
+            index.close()
+
+    paths = [p for g in args.structured_glob for p in glob.glob(g)]
+    batch_size = max(1, args.batch_size)
+
+    # Cached path: transformed rows are reused across runs for the same model file
+    if args.cache_dir and staged:
+        cache = FeatureCache(args.cache_dir, args.cache_max_mb)
+        version = "model-" + file_sha256(args.model_path)[:16]
+        try:
+            for i in range(0, len(paths), batch_size):
+                # read + featurize whatever is not cached
+                read, hits = [], []
+                with metrics.stage("featurize") as st:
+                    got = cached_chunk(paths[i:i + batch_size], cache, version, pipe, num_cols, args.io_workers,
+                                       read, hits)
+                    st.rows = len(got)
+                if index is not None and hits:
+                    # cache hits are not re-read, unless the index has not seen them (e.g. a new --dup_index)
+                    known = index.known(rid for _, rid in hits if rid is not None)
+                    unseen = [p for p, rid in hits if rid is None or str(rid) not in known]
+                    for batch in iter_structured(unseen, batch_size=max(1, len(unseen)), workers=args.io_workers):
+                        read.extend((path, s) for path, s, err in batch if err is None)
+                index_reports(read)
+                if not got:
+                    continue
+                X = sp.vstack([v for _, v in got], format="csr")
+                with metrics.stage("predict", len(got)):
+                    proba = predict_proba_batch(pipe[-1], X)
+                explained = explain(X, proba)
+                with metrics.stage("write", len(got)):
+                    for (rid, _), p, e in zip(got, proba, explained):
+                        write(rid, p, e)
+                flush()
+            if index is not None:
+                print_waiting(index)
+            if store is not None:
+                store.finish_run(run_id)
+        finally:
+            cache.close()
+            close()
+        return
+
+    try:
+        for batch in metrics.iterate("read", iter_structured(paths, batch_size=batch_size, workers=args.io_workers)):
+            recs, read = [], []
+            for path, s, err in batch:
+                if err is not None:
+                    print(f"[SKIP] {path}: {err}")
+                    continue
+                recs.append(s)
+                read.append((path, s))
+            if not recs:
+                continue
+            index_reports(read)
+
+            # Missing flags are filled with False by rec_to_row
+            with metrics.stage("featurize", len(recs)):
+                df = recs_to_df(recs, num_cols)
+                X = None
+                if staged:
+                    X = pipe[:-1].transform(df)
+                elif explainer is not None:
+                    wts, X = compact_features(df)
+            with metrics.stage("predict", len(recs)):
+                if staged:
+                    proba = predict_proba_batch(pipe[-1], X)
+                elif explainer is not None:
+                    proba = pipe.predict_proba(df, wts)
+                else:
+                    proba = predict_proba_batch(pipe, df)
+            explained = explain(X, proba)
+
+            with metrics.stage("write", len(recs)):
+                for s, p, e in zip(recs, proba, explained):
+                    write(s.get("report_id"), p, e)
+            flush()
+        if index is not None:
+            print_waiting(index)
+        if store is not None:
+            store.finish_run(run_id)
+    finally:
+        close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,244 @@
+# report_store.py
+# One SQLite file (WAL mode) for what otherwise lives in thousands of per-report files:
+#   reports   normalized structured_<ID>.json row per report (aggregate_dataset)
+#   labels    labels_template.csv, one row per (report, label_code)
+#   runs      one row per stage run (stage, start time)
+#   findings  every findings row a stage wrote, per run (history)
+#   latest    (report, stage) -> run that last wrote it, i.e. the current findings
+# Stages write in batches (--store on aggregate_dataset, predict_multilabel, merge_hybrid,
+# score); queries hit indexes on report_id, label_code, category and run time instead of
+# globbing folders:
+#
+#   python report_store.py --store sloppy_ml/reports.sqlite --report_id 4083505
+#   python report_store.py --store sloppy_ml/reports.sqlite --label_code RUN_LOG_INCOMPLETE --since 2025-09-01
+#   python report_store.py --store sloppy_ml/reports.sqlite --import_glob "sloppy_ml/predicted/final_findings_*.csv" --stage merge
+import argparse, glob, json, re, sqlite3, time
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+
+# first-class columns of a findings row; anything else (row_index, sloppiness_score,
+# source, matched_reports ...) is kept in `data` with the rest of the row
+FINDING_COLS = ["label_code", "category", "issue", "action_request", "confidence"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (report_id TEXT PRIMARY KEY, data TEXT, updated REAL);
+CREATE TABLE IF NOT EXISTS labels (report_id TEXT, label_code TEXT, updated REAL);
+CREATE INDEX IF NOT EXISTS labels_report ON labels (report_id);
+CREATE INDEX IF NOT EXISTS labels_code ON labels (label_code);
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, stage TEXT, started REAL, finished REAL);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS findings (run_id INTEGER, stage TEXT, report_id TEXT, label_code TEXT, category TEXT,
+                                     issue TEXT, action_request TEXT, confidence REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS findings_report ON findings (report_id, stage, run_id);
+CREATE INDEX IF NOT EXISTS findings_label ON findings (label_code);
+CREATE INDEX IF NOT EXISTS findings_category ON findings (category);
+CREATE INDEX IF NOT EXISTS findings_run ON findings (run_id);
+CREATE TABLE IF NOT EXISTS latest (report_id TEXT, stage TEXT, run_id INTEGER, PRIMARY KEY (report_id, stage));
+"""
+
+def _plain(v):
+    # numpy scalars -> Python, NaN/NA -> null
+    if v is pd.NA:
+        return None
+    if hasattr(v, "item"):
+        v = v.item()
+    if isinstance(v, float) and v != v:
+        return None
+    return v
+
+def _records(rows):
+    if isinstance(rows, pd.DataFrame):
+        rows = rows.to_dict("records")
+    return [{k: _plain(v) for k, v in r.items()} for r in rows]
+
+def _timestamp(s):
+    """'2025-09-01' / ISO datetime / epoch seconds -> epoch seconds."""
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.fromisoformat(s).timestamp()
+
+class ReportStore:
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # several processes (sharded predict, parallel stages) may write: wait for the lock
+        self.db = sqlite3.connect(str(path), timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    # --- runs
+    def start_run(self, stage):
+        cur = self.db.execute("INSERT INTO runs (stage, started) VALUES (?, ?)", (stage, time.time()))
+        self.db.commit()
+        return cur.lastrowid
+
+    def finish_run(self, run_id):
+        self.db.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+        self.db.commit()
+
+    # --- writers (one transaction per call)
+    def upsert_reports(self, rows):
+        """Normalized structured rows (dicts with report_id); unchanged rows keep their timestamp."""
+        now = time.time()
+        data = [(str(r["report_id"]), json.dumps(r), now) for r in _records(rows)
+                if r.get("report_id") is not None]
+        with self.db:
+            self.db.executemany("INSERT INTO reports VALUES (?, ?, ?) ON CONFLICT (report_id) DO UPDATE "
+                                "SET data = excluded.data, updated = excluded.updated WHERE data != excluded.data",
+                                data)
+        return len(data)
+
+    def replace_labels(self, labels):
+        """{report_id: [label codes]} for every labeled report (the labels CSV is the source of truth).
+
+        A report labeled with no codes is kept as one row with an empty label_code.
+        """
+        now = time.time()
+        data = [(str(rid), code, now) for rid, codes in labels.items() for code in (codes or [""])]
+        with self.db:
+            self.db.execute("DELETE FROM labels")
+            self.db.executemany("INSERT INTO labels VALUES (?, ?, ?)", data)
+        return len(labels)
+
+    def write_findings(self, run_id, stage, by_report):
+        """[(report_id, rows)] with rows a DataFrame or list of dicts; a report with no rows
+        still becomes current (its findings are now none)."""
+        data, latest = [], []
+        for rid, rows in by_report:
+            rid = str(rid)
+            latest.append((rid, stage, run_id))
+            for r in _records(rows):
+                # empty cells are left out of `data`; they come back as NaN
+                data.append((run_id, stage, rid) + tuple(r.get(c) for c in FINDING_COLS) +
+                            (json.dumps({k: v for k, v in r.items() if v is not None}, default=str),))
+        with self.db:
+            self.db.executemany("INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", data)
+            self.db.executemany("INSERT INTO latest VALUES (?, ?, ?) ON CONFLICT (report_id, stage) "
+                                "DO UPDATE SET run_id = excluded.run_id", latest)
+        return len(data)
+
+    # --- readers
+    def structured_rows(self):
+        """All stored report rows as a DataFrame (aggregate_dataset's load_structured_jsons layout)."""
+        rows = [json.loads(d) for (d,) in self.db.execute("SELECT data FROM reports ORDER BY rowid")]
+        df = pd.DataFrame(rows)
+        if "report_id" in df.columns:
+            df["report_id"] = pd.to_numeric(df["report_id"], errors="coerce").astype("Int64")
+        return df
+
+    def labels_frame(self):
+        """report_id, label_codes (';'-joined), as in labels_template.csv."""
+        labels = {}
+        for rid, code in self.db.execute("SELECT report_id, label_code FROM labels ORDER BY rowid"):
+            codes = labels.setdefault(rid, [])
+            if code:
+                codes.append(code)
+        return pd.DataFrame({"report_id": list(labels), "label_codes": [";".join(c) for c in labels.values()]})
+
+    def findings(self, report_id=None, label_code=None, category=None, stage=None, since=None, history=False):
+        """Findings as a DataFrame: current ones (latest run per report and stage), or every
+        run's with history=True. since: epoch seconds of the earliest run."""
+        sql = ["SELECT f.report_id, f.stage, f.run_id, r.started, f.data FROM findings f "
+               "JOIN runs r ON r.run_id = f.run_id"]
+        if not history:
+            sql.append("JOIN latest l ON l.report_id = f.report_id AND l.stage = f.stage AND l.run_id = f.run_id")
+        where, params = [], []
+        for col, val in (("f.report_id", report_id), ("f.label_code", label_code),
+                         ("f.category", category), ("f.stage", stage)):
+            if val is not None:
+                where.append(f"{col} = ?")
+                params.append(str(val))
+        if since is not None:
+            where.append("r.started >= ?")
+            params.append(float(since))
+        if where:
+            sql.append("WHERE " + " AND ".join(where))
+        sql.append("ORDER BY f.report_id, f.stage, f.run_id, f.rowid")
+        rows = []
+        for rid, stg, run_id, started, data in self.db.execute(" ".join(sql), params):
+            row = json.loads(data)
+            row.update(report_id=rid, stage=stg, run_id=run_id,
+                       run_started=datetime.fromtimestamp(started).isoformat(timespec="seconds"))
+            rows.append(row)
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return pd.DataFrame(columns=["report_id", "stage", "run_id", "run_started"] + FINDING_COLS)
+        lead = ["report_id", "stage", "run_id", "run_started"]
+        return df[lead + [c for c in df.columns if c not in lead]]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def save_findings(path, stage, by_report, batch_size=1000):
+    """[(report_id, findings)] -> one run of `stage` in the store at path, one transaction per batch."""
+    store = ReportStore(path)
+    try:
+        run_id = store.start_run(stage)
+        batch, n = [], 0
+        for item in by_report:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                n += store.write_findings(run_id, stage, batch)
+                batch = []
+        n += store.write_findings(run_id, stage, batch)
+        store.finish_run(run_id)
+    finally:
+        store.close()
+    print(f"Saved {n} {stage} findings to {path}")
+    return run_id
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--store", required=True, help="SQLite store file")
+    ap.add_argument("--report_id", default=None)
+    ap.add_argument("--label_code", default=None)
+    ap.add_argument("--category", default=None)
+    ap.add_argument("--stage", default=None, help="predict, merge, score ... (with --import_glob: the stage to file under)")
+    ap.add_argument("--since", default=None, help="Runs started on/after this date (YYYY-MM-DD) or epoch seconds")
+    ap.add_argument("--history", action="store_true", help="All runs, not only each report's latest")
+    ap.add_argument("--out_csv", default=None, help="Write the result here instead of printing it")
+    ap.add_argument("--import_glob", default=None, nargs="+",
+                    help="Load existing <name>_<ID>.csv findings files into the store (one run)")
+    args = ap.parse_args()
+
+    store = ReportStore(args.store)
+    try:
+        if args.import_glob:
+            if not args.stage:
+                ap.error("--import_glob needs --stage")
+            import_findings(store, args.import_glob, args.stage)
+            return
+        df = store.findings(args.report_id, args.label_code, args.category, args.stage,
+                            _timestamp(args.since) if args.since else None, args.history)
+        if args.out_csv:
+            df.to_csv(args.out_csv, index=False)
+            print(f"Wrote {len(df)} findings to {args.out_csv}")
+        else:
+            with pd.option_context("display.max_rows", 200, "display.width", 200):
+                print(df.to_string(index=False) if len(df) else "[INFO] no findings")
+    finally:
+        store.close()
+
+def import_findings(store, globs, stage, batch_size=1000):
+    paths = sorted({p for g in globs for p in glob.glob(g)})
+    run_id = store.start_run(stage)
+    n = 0
+    for i in range(0, len(paths), batch_size):
+        batch = []
+        for path in paths[i:i + batch_size]:
+            m = re.findall(r"(\d+)", Path(path).stem)
+            try:
+                rows = pd.read_csv(path)
+            except pd.errors.EmptyDataError:
+                rows = pd.DataFrame()
+            batch.append((m[-1] if m else Path(path).stem, rows))
+        n += store.write_findings(run_id, stage, batch)
+    store.finish_run(run_id)
+    print(f"[OK] imported {n} findings from {len(paths)} files as {stage} run {run_id}")
+
+if __name__ == "__main__":
+    main()
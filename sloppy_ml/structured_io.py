@@ -0,0 +1,141 @@
+# structured_io.py
+# Shared loader for structured_<ID>.json: files are read and parsed on a thread pool
+# (the structured folder usually sits on a network share, so we wait on I/O, not CPU)
+# and handed out in batches, so the archive never sits in memory as one list of dicts.
+import glob, hashlib, json, re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import orjson
+    _loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:  # stdlib fallback
+    _loads = json.loads
+    JSON_BACKEND = "json"
+
+DEFAULT_WORKERS = 16
+DEFAULT_BATCH = 1000
+# bump when structured_to_row changes, so cached rows are not reused
+ROW_VERSION = 2
+
+def read_structured(path):
+    """Parse one structured JSON -> (path, record, error)."""
+    try:
+        with open(path, "rb") as f:
+            return path, _loads(f.read()), None
+    except Exception as e:
+        return path, None, e
+
+def read_structured_hashed(path):
+    """Like read_structured, plus the sha256 of the file bytes -> (path, record, error, sha256)."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except Exception as e:
+        return path, None, e, None
+    sha = hashlib.sha256(raw).hexdigest()
+    try:
+        return path, _loads(raw), None, sha
+    except Exception as e:
+        return path, None, e, sha
+
+def iter_structured(paths, batch_size=DEFAULT_BATCH, workers=DEFAULT_WORKERS, with_hash=False):
+    """Yield lists of (path, record, error[, sha256]) in path order; at most ~2 batches are in flight."""
+    if isinstance(paths, str):
+        paths = glob.glob(paths)
+    paths = list(paths)
+    read = read_structured_hashed if with_hash else read_structured
+    if workers <= 1:
+        for i in range(0, len(paths), batch_size):
+            yield [read(p) for p in paths[i:i + batch_size]]
+        return
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        pending = deque()
+        it = iter(paths)
+        def fill(n):
+            for p in it:
+                pending.append(ex.submit(read, p))
+                n -= 1
+                if n == 0:
+                    break
+        fill(2 * batch_size)
+        while pending:
+            batch = [pending.popleft().result() for _ in range(min(batch_size, len(pending)))]
+            fill(batch_size)
+            yield batch
+
+def normalize_report_id(s, path):
+    rid = s.get("report_id")
+    if rid is None or str(rid).strip() == "":
+        # fallback: last number in filename
+        m = re.findall(r"(\d+)", Path(path).stem)
+        return int(m[-1]) if m else None
+    return int(re.findall(r"(\d+)", str(rid))[0])
+
+def structured_to_row(s, path):
+    """One structured JSON -> flat training/prediction row (flags become flag__<name>)."""
+    excerpts = s.get("excerpts", {}) or {}
+    row = {
+        "report_id": normalize_report_id(s, path),
+        "arrival": s.get("arrival"),
+        "departure": s.get("departure"),
+        "total_time_spent": s.get("total_time_spent"),
+        "attributes_filled": bool(s.get("attributes_filled", False)),
+        "comments": excerpts.get("comments", ""),
+        "attributes_excerpt": excerpts.get("attributes", ""),
+    }
+    # boolean flags
+    for k, v in (s.get("flags", {}) or {}).items():
+        row[f"flag__{k}"] = bool(v)
+    return row
+
+def _normalize_batch(batch, rows, cache=None):
+    for item in batch:
+        path, s, err = item[:3]
+        if err is None:
+            try:
+                rows[path] = structured_to_row(s, path)
+                if cache is not None:
+                    # cached by content: identical files under other names share the entry, so the
+                    # file-name fallback for a missing report_id is applied on every read instead
+                    cache.put_row(item[3], ROW_VERSION, dict(rows[path], report_id=normalize_report_id(s, "")))
+                    cache.remember_hash(path, item[3])
+                continue
+            except Exception as e:
+                err = e
+        print(f"[SKIP] {path}: {err}")
+
+def iter_structured_rows(paths, batch_size=DEFAULT_BATCH, workers=DEFAULT_WORKERS, cache=None):
+    """Yield lists of normalized rows; unreadable or malformed files are reported and skipped.
+
+    With a feature_cache.FeatureCache, files whose size/mtime are unchanged are served
+    from the cached row without being opened; only new or changed files are read.
+    """
+    if cache is None:
+        for batch in iter_structured(paths, batch_size, workers):
+            rows = {}
+            _normalize_batch(batch, rows)
+            yield [rows[item[0]] for item in batch if item[0] in rows]
+        return
+    if isinstance(paths, str):
+        paths = glob.glob(paths)
+    paths = list(paths)
+    for i in range(0, len(paths), batch_size):
+        chunk = paths[i:i + batch_size]
+        rows, todo = {}, []
+        for path in chunk:
+            sha = cache.known_hash(path)
+            row = cache.get_row(sha, ROW_VERSION) if sha else None
+            if sha is None:
+                cache.misses += 1
+            if row is None:
+                todo.append(path)
+            else:
+                if row["report_id"] is None:
+                    row["report_id"] = normalize_report_id({}, path)
+                rows[path] = row
+        for batch in iter_structured(todo, batch_size, workers, with_hash=True):
+            _normalize_batch(batch, rows, cache)
+        yield [rows[p] for p in chunk if p in rows]
@@ -1,26 +1,70 @@
 # train_multilabel.py
-import argparse, pandas as pd, numpy as np, joblib
+import argparse, itertools, time, pandas as pd, numpy as np, joblib
 from pathlib import Path
-from sklearn.model_selection import train_test_split
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from sklearn.model_selection import train_test_split, KFold
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, CountVectorizer, TfidfTransformer
 from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.multiclass import OneVsRestClassifier
 from sklearn.metrics import f1_score, classification_report
+from dataset_io import dataset_columns, read_dataset, iter_dataset, infer_label_cols
+from compact_model import export_multilabel
+from instrument import Metrics, add_metrics_args
+from per_label import PerLabelClassifier
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--dataset_csv", required=True)
+    ap.add_argument("--dataset", "--dataset_csv", dest="dataset", required=True,
+                    help="dataset.parquet / .arrow / .csv from aggregate_dataset.py")
     ap.add_argument("--out_dir", required=True)
     ap.add_argument("--test_size", type=float, default=0.2)
     ap.add_argument("--min_positives", type=int, default=1,
                     help="Drop labels with fewer than this many positives.")
+    # streaming (out-of-core) mode
+    ap.add_argument("--streaming", action="store_true",
+                    help="Read the dataset in chunks; hashed text features + one SGD classifier per label")
+    ap.add_argument("--chunk_rows", type=int, default=50000, help="Streaming: rows per chunk")
+    ap.add_argument("--n_features", type=int, default=2**18, help="Streaming: hashed text feature space")
+    ap.add_argument("--alpha", type=float, default=1e-5, help="Streaming: SGD regularization")
+    ap.add_argument("--epochs", type=int, default=1, help="Streaming: passes over the training rows")
+    ap.add_argument("--warm_start", default=None,
+                    help="Streaming: continue from this multilabel_model.joblib (itself trained with --streaming)")
+    # search mode: cross-validated grid over C / ngram range / vocabulary size
+    ap.add_argument("--search", action="store_true",
+                    help="Cross-validate the grid below, refit the best on all rows, tune per-label thresholds")
+    ap.add_argument("--cv", type=int, default=5, help="Search: folds")
+    ap.add_argument("--grid_C", default="0.5,1,2,4", help="Search: LogisticRegression C values")
+    ap.add_argument("--grid_ngram_max", default="1,2", help="Search: n of ngram_range=(1,n)")
+    ap.add_argument("--grid_max_features", default="5000,20000,50000", help="Search: TF-IDF vocabulary sizes")
+    ap.add_argument("--scoring", choices=["micro", "macro"], default="micro", help="Search: F1 average to rank by")
+    ap.add_argument("--n_jobs", type=int, default=-1, help="Search: parallel fits (-1 = all cores)")
+    ap.add_argument("--compact", action="store_true",
+                    help="Also write multilabel_model.compact/ (mmap-able arrays, predicts without sklearn)")
+    add_metrics_args(ap)
     args = ap.parse_args()
+    if args.warm_start and not args.streaming:
+        ap.error("--warm_start needs --streaming")
+    if args.search and args.streaming:
+        ap.error("--search and --streaming cannot be combined")
 
-    out = Path(args.out_dir); out.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(args.dataset_csv)
+    with Metrics.from_args("train_multilabel", args) as metrics:
+        (train_streaming if args.streaming else search if args.search else train)(args, metrics)
+
+def load_frame(args, metrics):
+    """Dataset -> (frame with __text__, kept label columns, y, numeric flag columns)."""
+    # Columnar datasets name their label columns and let us load only what the model uses
+    names, label_cols = dataset_columns(args.dataset)
+    columns = None
+    if label_cols is not None:
+        columns = [c for c in names if c in ("comments", "attributes_excerpt", "attributes_filled")
+                   or c.startswith("flag__") or c in label_cols]
+    with metrics.stage("load") as st:
+        df, candidate_labels = read_dataset(args.dataset, columns=columns)
+        st.rows = len(df)
 
     # Build single text column to avoid any custom function in the pipeline
     for col in ["comments", "attributes_excerpt"]:
@@ -28,8 +72,7 @@ def main():
             df[col] = ""
     df["__text__"] = (df["comments"].fillna("") + " " + df["attributes_excerpt"].fillna("")).str.strip()
 
-    # Infer label columns (UPPERCASE 0/1)
-    candidate_labels = [c for c in df.columns if c.isupper() and set(df[c].dropna().unique()) <= {0,1}]
+    # Label columns come from the dataset metadata (CSV: inferred as UPPERCASE 0/1)
     # Keep labels with enough positives
     keep = []
     pos_counts = {}
@@ -47,11 +90,13 @@ def main():
     num_cols = [c for c in df.columns if c.startswith("flag__")]
     if "attributes_filled" in df.columns:
         num_cols.append("attributes_filled")
+    return df, keep, y, num_cols
 
+def build_pipe(num_cols, C=2.0, ngram_max=2, max_features=20000):
     # Preprocess: TF-IDF on __text__, scale numeric flags
     pre = ColumnTransformer(
         transformers=[
-            ("txt", TfidfVectorizer(max_features=20000, ngram_range=(1,2)), "__text__"),
+            ("txt", TfidfVectorizer(max_features=max_features, ngram_range=(1,ngram_max)), "__text__"),
             ("num", StandardScaler(with_mean=False), num_cols),
         ],
         remainder="drop",
@@ -59,24 +104,342 @@ def main():
     )
 
     clf = OneVsRestClassifier(
-        LogisticRegression(max_iter=2000, class_weight="balanced", C=2.0, solver="liblinear")
+        LogisticRegression(max_iter=2000, class_weight="balanced", C=C, solver="liblinear")
     )
-    pipe = Pipeline([("pre", pre), ("clf", clf)])
+    return Pipeline([("pre", pre), ("clf", clf)])
 
-    X_train, X_test, y_train, y_test = train_test_split(df, y, test_size=args.test_size, random_state=42)
-    pipe.fit(X_train, y_train)
+def per_label_outputs(pipe, keep):
+    """One kept label: OneVsRestClassifier sees a binary target and predicts n x 2 (P(0), P(1)).
+    Its one classifier goes into a PerLabelClassifier, so the outputs are n x 1 like any label count."""
+    if len(keep) == 1:
+        pipe.steps[-1] = ("clf", PerLabelClassifier(pipe.named_steps["clf"].estimators_).fit())
+    return pipe
 
-    y_pred = pipe.predict(X_test)
-    micro_f1 = f1_score(y_test, y_pred, average="micro", zero_division=0)
-    macro_f1 = f1_score(y_test, y_pred, average="macro", zero_division=0)
+def save_model(out, mdl, compact=False):
+    joblib.dump(mdl, out/"multilabel_model.joblib")
+    print("Saved model to", out/"multilabel_model.joblib")
+    if compact:
+        try:
+            print("Wrote compact model", export_multilabel(mdl, out/"multilabel_model.compact"))
+        except ValueError as e:
+            print(f"[WARN] no compact export: {e}")
+
+def print_scores(y_test, y_pred, keep):
+    y_test = np.asarray(y_test).reshape(len(y_test), -1)
+    y_pred = (y_pred.toarray() if hasattr(y_pred, "toarray") else np.asarray(y_pred)).reshape(len(y_test), -1)
+    kw = {}
+    if len(keep) == 1:
+        # a single 0/1 column is a binary target to sklearn: score its positive class
+        y_test, y_pred, kw = y_test.ravel(), y_pred.ravel(), {"labels": [1]}
+    micro_f1 = f1_score(y_test, y_pred, average="micro", zero_division=0, **kw)
+    macro_f1 = f1_score(y_test, y_pred, average="macro", zero_division=0, **kw)
     print("Micro-F1:", micro_f1, " Macro-F1:", macro_f1)
-    print(classification_report(y_test, y_pred, target_names=keep, zero_division=0))
+    print(classification_report(y_test, y_pred, target_names=keep, zero_division=0, **kw))
 
-    joblib.dump({"pipe": pipe,
-                 "label_cols": keep,
-                 "num_cols": num_cols},
-                out/"multilabel_model.joblib")
-    print("Saved model to", out/"multilabel_model.joblib")
+def train(args, metrics):
+    out = Path(args.out_dir); out.mkdir(parents=True, exist_ok=True)
+    df, keep, y, num_cols = load_frame(args, metrics)
+    pipe = build_pipe(num_cols)
+
+    X_train, X_test, y_train, y_test = train_test_split(df, y, test_size=args.test_size, random_state=42)
+    with metrics.stage("fit", len(X_train)):
+        per_label_outputs(pipe.fit(X_train, y_train), keep)
+
+    with metrics.stage("predict", len(X_test)):
+        y_pred = pipe.predict(X_test)
+    print_scores(y_test, y_pred, keep)
+
+    with metrics.stage("write"):
+        save_model(out, {"pipe": pipe,
+                         "label_cols": keep,
+                         "num_cols": num_cols}, args.compact)
+
+# ---------------------------------------------------------------------------
+# Search mode: each fold's text is tokenized once per ngram range (CountVectorizer
+# with the full vocabulary); every max_features is then a column slice of those
+# counts (same top-by-frequency rule as TfidfVectorizer) + TF-IDF weighting, so
+# the grid reuses cached sparse matrices instead of re-tokenizing. The fits for
+# all (fold, C, ngram, max_features) run in parallel with joblib.
+# ---------------------------------------------------------------------------
+
+THRESHOLD_GRID = np.round(np.arange(0.05, 0.96, 0.05), 2)
+
+def parse_grid(text, cast):
+    return [cast(v) for v in str(text).split(",") if v.strip()]
+
+def count_fold(texts, train_idx, val_idx, ngram_max):
+    cv = CountVectorizer(ngram_range=(1, ngram_max))
+    return cv.fit_transform(texts[train_idx]), cv.transform(texts[val_idx])
+
+def top_features(counts, max_features):
+    """Columns TfidfVectorizer(max_features=k) would keep: highest total count, ties in vocabulary order."""
+    if max_features is None or max_features >= counts.shape[1]:
+        return np.arange(counts.shape[1])
+    tfs = np.asarray(counts.sum(axis=0)).ravel()
+    return np.sort((-tfs).argsort(kind="stable")[:max_features])
+
+def fold_matrix(counts_tr, counts_va, num_tr, num_va, max_features):
+    cols = top_features(counts_tr, max_features)
+    tfidf = TfidfTransformer()
+    txt_tr = tfidf.fit_transform(counts_tr[:, cols])
+    txt_va = tfidf.transform(counts_va[:, cols])
+    scaler = StandardScaler(with_mean=False)
+    Xtr = sp.hstack([txt_tr, sp.csr_matrix(scaler.fit_transform(num_tr))], format="csr")
+    Xva = sp.hstack([txt_va, sp.csr_matrix(scaler.transform(num_va))], format="csr")
+    return Xtr, Xva
+
+def fit_score(Xtr, ytr, Xva, C):
+    t0 = time.perf_counter()
+    clf = OneVsRestClassifier(LogisticRegression(max_iter=2000, class_weight="balanced", C=C, solver="liblinear"))
+    clf.fit(Xtr, ytr)
+    proba = np.asarray(clf.predict_proba(Xva), dtype=np.float32).reshape(Xva.shape[0], -1)
+    # one label column: P(0), P(1) -> P(1)
+    return proba[:, -ytr.shape[1]:], time.perf_counter() - t0
+
+def best_thresholds(y, proba, average="micro", passes=2):
+    """Per-label thresholds from THRESHOLD_GRID by coordinate ascent on the out-of-fold F1
+    (`average` as ranked); starts at 0.5 everywhere, so it never scores below the default."""
+    thr = np.full(y.shape[1], 0.5)
+    score = lambda t: f1_score(y, (proba >= t[None, :]).astype(int), average=average, zero_division=0)
+    best = score(thr)
+    for _ in range(passes):
+        for j in range(y.shape[1]):
+            for v in THRESHOLD_GRID:
+                cand = thr.copy(); cand[j] = v
+                f = score(cand)
+                if f > best + 1e-12:
+                    best, thr = f, cand
+    return [float(v) for v in thr]
+
+def search(args, metrics):
+    out = Path(args.out_dir); out.mkdir(parents=True, exist_ok=True)
+    df, keep, y, num_cols = load_frame(args, metrics)
+    Cs = parse_grid(args.grid_C, float)
+    ngrams = parse_grid(args.grid_ngram_max, int)
+    max_features = parse_grid(args.grid_max_features, int)
+    texts = df["__text__"].to_numpy(dtype=object)
+    num = df[num_cols].astype(float).to_numpy() if num_cols else np.zeros((len(df), 0))
+    folds = list(KFold(n_splits=args.cv, shuffle=True, random_state=42).split(texts))
+
+    # tokenize once per (fold, ngram range)
+    with metrics.stage("featurize", len(df) * len(folds) * len(ngrams)):
+        counts = Parallel(n_jobs=args.n_jobs)(
+            delayed(count_fold)(texts, tr, va, n) for (tr, va), n in itertools.product(folds, ngrams))
+        counts = dict(zip(itertools.product(range(len(folds)), ngrams), counts))
+        mats = {(f, n, k): fold_matrix(*counts[f, n], num[tr], num[va], k)
+                for (f, (tr, va)), n, k in itertools.product(enumerate(folds), ngrams, max_features)}
+    del counts
+
+    grid = list(itertools.product(ngrams, max_features, Cs))
+    tasks = [(f, n, k, C) for (n, k, C) in grid for f in range(len(folds))]
+    print(f"[INFO] search: {len(grid)} settings x {len(folds)} folds = {len(tasks)} fits on {len(df)} rows, {len(keep)} labels")
+    with metrics.stage("fit", len(tasks)):
+        results = Parallel(n_jobs=args.n_jobs)(
+            delayed(fit_score)(mats[f, n, k][0], y[folds[f][0]], mats[f, n, k][1], C) for f, n, k, C in tasks)
+    results = dict(zip(tasks, results))
+    del mats
+
+    # out-of-fold probabilities per setting -> leaderboard
+    board, oof = [], {}
+    for (n, k, C) in grid:
+        proba = np.zeros(y.shape, dtype=np.float32)
+        micro, macro, secs = [], [], 0.0
+        for f, (tr, va) in enumerate(folds):
+            p, t = results[f, n, k, C]
+            proba[va] = p
+            pred = (p >= 0.5).astype(int)
+            micro.append(f1_score(y[va], pred, average="micro", zero_division=0))
+            macro.append(f1_score(y[va], pred, average="macro", zero_division=0))
+            secs += t
+        oof[n, k, C] = proba
+        board.append({"C": C, "ngram_max": n, "max_features": k,
+                      "micro_f1": np.mean(micro), "micro_f1_std": np.std(micro),
+                      "macro_f1": np.mean(macro), "macro_f1_std": np.std(macro), "fit_seconds": round(secs, 2)})
+    board = pd.DataFrame(board).sort_values([f"{args.scoring}_f1", "fit_seconds"], ascending=[False, True], ignore_index=True)
+    board.insert(0, "rank", np.arange(1, len(board) + 1))
+    board.to_csv(out / "leaderboard.csv", index=False)
+    print(board.head(10).to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print("Wrote", out / "leaderboard.csv")
+
+    best = board.iloc[0]
+    n, k, C = int(best["ngram_max"]), int(best["max_features"]), float(best["C"])
+    thresholds = best_thresholds(y, oof[n, k, C], args.scoring)
+    tuned = (oof[n, k, C] >= np.array(thresholds)[None, :]).astype(int)
+    print(f"Best: C={C} ngram_range=(1,{n}) max_features={k}")
+    print("Per-label thresholds:", dict(zip(keep, thresholds)))
+    print("Out-of-fold Micro-F1 with tuned thresholds:", f1_score(y, tuned, average="micro", zero_division=0),
+          " Macro-F1:", f1_score(y, tuned, average="macro", zero_division=0))
+
+    # refit the best setting on every row
+    pipe = build_pipe(num_cols, C=C, ngram_max=n, max_features=k)
+    with metrics.stage("fit", len(df)):
+        per_label_outputs(pipe.fit(df, y), keep)
+
+    with metrics.stage("write"):
+        save_model(out, {"pipe": pipe,
+                         "label_cols": keep,
+                         "num_cols": num_cols,
+                         "thresholds": thresholds,
+                         "params": {"C": C, "ngram_max": n, "max_features": k}}, args.compact)
+
+# ---------------------------------------------------------------------------
+# Streaming mode: the dataset is never loaded whole. Pass 1 reads only flags and
+# labels (label counts, flag scaler), pass 2 hashes the text chunk by chunk and
+# partial_fits one SGDClassifier per label, pass 3 scores the held-out rows.
+# The result is a fitted Pipeline(pre, per_label.PerLabelClassifier) with the outputs of a
+# OneVsRestClassifier, so the artifact keys and predict_multilabel stay the same.
+# ---------------------------------------------------------------------------
+
+def text_column(df):
+    # same single text column as the in-memory mode
+    parts = [df[c].astype(object).fillna("") if c in df.columns else pd.Series("", index=df.index, dtype=object)
+             for c in ("comments", "attributes_excerpt")]
+    return (parts[0] + " " + parts[1]).str.strip()
+
+def holdout_mask(n, chunk_no, test_size):
+    # fixed per chunk position, so every pass sees the same split
+    return np.random.default_rng([42, chunk_no]).random(n) < test_size
+
+def streaming_chunks(args, columns, metrics, name):
+    for i, chunk in enumerate(metrics.iterate(name, iter_dataset(args.dataset, columns, args.chunk_rows))):
+        yield i, chunk
+
+def numeric_frame(df, num_cols):
+    return pd.DataFrame({c: (df[c].fillna(False).astype(float) if c in df.columns else 0.0) for c in num_cols},
+                        index=df.index)
+
+def is_streaming_model(mdl):
+    pipe = mdl.get("pipe")
+    try:
+        txt = pipe.named_steps["pre"].named_transformers_["txt"]
+        clf = pipe.named_steps["clf"]
+    except (AttributeError, KeyError):
+        return False
+    return isinstance(txt, HashingVectorizer) and all(isinstance(e, SGDClassifier) for e in clf.estimators_)
+
+def train_streaming(args, metrics):
+    out = Path(args.out_dir); out.mkdir(parents=True, exist_ok=True)
+    names, label_cols = dataset_columns(args.dataset)
+    if label_cols is None:
+        # CSV: infer from the first chunk, like read_dataset does for the whole file
+        label_cols = infer_label_cols(next(iter_dataset(args.dataset, None, args.chunk_rows)))
+    num_cols = [c for c in names if c.startswith("flag__")]
+    if "attributes_filled" in names:
+        num_cols.append("attributes_filled")
+
+    prev = None
+    if args.warm_start:
+        prev = joblib.load(args.warm_start)
+        if not is_streaming_model(prev):
+            raise SystemExit(f"[ERROR] {args.warm_start} was not trained with --streaming; retrain it once with --streaming")
+        new_flags = [c for c in num_cols if c not in prev["num_cols"]]
+        if new_flags:
+            print(f"[WARN] flags not in the previous model are ignored until a full retrain: {new_flags}")
+        num_cols = list(prev["num_cols"])
+        print(f"[INFO] warm start from {args.warm_start} ({len(prev['label_cols'])} labels)")
+
+    # Pass 1: label counts (train rows) and flag scaling, reading only those columns
+    scaler = prev["pipe"].named_steps["pre"].named_transformers_["num"] if prev else StandardScaler(with_mean=False)
+    pos_all = pd.Series(0, index=label_cols, dtype="int64")
+    pos_train = pos_all.copy()
+    n_train = 0
+    light = [c for c in names if c in num_cols or c in label_cols]
+    for i, chunk in streaming_chunks(args, light, metrics, "scan"):
+        train_rows = ~holdout_mask(len(chunk), i, args.test_size)
+        labels = chunk[label_cols].fillna(0).astype("int64")
+        pos_all += labels.sum()
+        pos_train += labels[train_rows].sum()
+        n_train += int(train_rows.sum())
+        if num_cols and train_rows.any():
+            scaler.partial_fit(numeric_frame(chunk[train_rows], num_cols))
+    pos_counts = {c: int(v) for c, v in pos_all.items()}
+    print("Label positives in full dataset:", pos_counts)
+
+    keep = [c for c in label_cols if pos_counts[c] >= args.min_positives]
+    if prev:
+        keep = list(prev["label_cols"]) + [c for c in keep if c not in prev["label_cols"]]
+    if not keep or n_train == 0:
+        raise SystemExit("No labels meet min_positives threshold. Lower --min_positives or add data.")
+
+    if prev:
+        pre = prev["pipe"].named_steps["pre"]
+        estimators = dict(zip(prev["label_cols"], prev["pipe"].named_steps["clf"].estimators_))
+    else:
+        pre = ColumnTransformer(
+            transformers=[
+                ("txt", HashingVectorizer(n_features=args.n_features, ngram_range=(1,2), alternate_sign=False), "__text__"),
+                ("num", StandardScaler(with_mean=False), num_cols),
+            ],
+            remainder="drop",
+            sparse_threshold=1.0
+        )
+        estimators = {}
+    for c in keep:
+        if c not in estimators:
+            estimators[c] = SGDClassifier(loss="log_loss", alpha=args.alpha, average=True, random_state=42)
+    trainable = [c for c in keep if c in label_cols]
+
+    # "balanced" class weights from the pass-1 counts, as sample weights (partial_fit has no class_weight)
+    weights = {}
+    for c in trainable:
+        pos, neg = int(pos_train[c]), n_train - int(pos_train[c])
+        weights[c] = (n_train / (2.0 * pos) if pos else 1.0, n_train / (2.0 * neg) if neg else 1.0)
+
+    # Pass 2: hash the text and partial_fit each label's classifier, chunk by chunk
+    fitted_pre = prev is not None
+    for epoch in range(max(1, args.epochs)):
+        for i, chunk in streaming_chunks(args, None, metrics, "load"):
+            train_rows = ~holdout_mask(len(chunk), i, args.test_size)
+            chunk = chunk[train_rows]
+            if chunk.empty:
+                continue
+            with metrics.stage("featurize", len(chunk)):
+                df = numeric_frame(chunk, num_cols)
+                df["__text__"] = text_column(chunk).to_numpy()
+                if not fitted_pre:
+                    # HashingVectorizer is stateless; the scaler from pass 1 replaces the one fitted here
+                    pre.fit(df)
+                    pre.transformers_ = [(n, scaler if n == "num" else t, cols) for n, t, cols in pre.transformers_]
+                    fitted_pre = True
+                X = pre.transform(df)
+            with metrics.stage("fit", len(chunk)):
+                for c in trainable:
+                    y = chunk[c].fillna(0).astype("int64").to_numpy()
+                    w_pos, w_neg = weights[c]
+                    estimators[c].partial_fit(X, y, classes=np.array([0, 1]), sample_weight=np.where(y == 1, w_pos, w_neg))
+        if args.epochs > 1:
+            print(f"[INFO] epoch {epoch + 1}/{args.epochs} done")
+
+    # One fitted estimator around the per-label classifiers (predict_proba -> n_samples x n_labels)
+    unfitted = [c for c in keep if not hasattr(estimators[c], "coef_")]
+    if unfitted:
+        print(f"[WARN] labels without training rows are dropped: {unfitted}")
+        keep = [c for c in keep if c not in unfitted]
+    clf = PerLabelClassifier([estimators[c] for c in keep]).fit()
+    pipe = Pipeline([("pre", pre), ("clf", clf)])
+
+    # Pass 3: held-out rows
+    if args.test_size > 0:
+        y_test, y_pred = [], []
+        for i, chunk in streaming_chunks(args, None, metrics, "load"):
+            chunk = chunk[holdout_mask(len(chunk), i, args.test_size)]
+            if chunk.empty:
+                continue
+            with metrics.stage("predict", len(chunk)):
+                df = numeric_frame(chunk, num_cols)
+                df["__text__"] = text_column(chunk).to_numpy()
+                pred = pipe.predict(df)
+                y_pred.append(pred.toarray() if hasattr(pred, "toarray") else np.asarray(pred))
+                y_test.append(np.column_stack([chunk[c].fillna(0).astype("int64").to_numpy() if c in chunk.columns
+                                               else np.zeros(len(chunk), dtype="int64") for c in keep]))
+        if y_test:
+            y_test, y_pred = np.vstack(y_test), np.vstack(y_pred)
+            print_scores(y_test, y_pred, keep)
+
+    with metrics.stage("write"):
+        save_model(out, {"pipe": pipe,
+                         "label_cols": keep,
+                         "num_cols": num_cols}, args.compact)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,341 @@
+# sloppy_reports_reader.py
+# Importable/CLI version of the PDF extractor in sloppy_reports_reader.ipynb.
+# Writes structured_<ID>.json, findings_<ID>.csv and quote_stub_<ID>.csv per PDF,
+# in parallel, and skips PDFs whose content hash is unchanged since the last run.
+#
+# Two stages: the PDF text layer (slow: PyPDF2/pdfminer) is kept gzipped per content
+# hash in <base_dir>/text_cache, and the cue rules (fast) are re-run on that text
+# whenever CUES or extract_report change, so iterating on a regex does not re-parse PDFs.
+import argparse, gzip, hashlib, inspect, json, os, re, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import pandas as pd
+from .sloppy_ml.instrument import Metrics, add_metrics_args
+
+MANIFEST_NAME = "extract_manifest.json"
+TEXT_CACHE_NAME = "text_cache"
+TEXT_VERSION = "pypdf2-pdfminer-1"  # bump when extract_text_from_pdf changes
+
+# --- Cues: name -> (pattern, needs). `needs` are lowercase words, one of which is in every
+# match: the text is lowercased once and a cue whose words are all absent is not searched
+# at all (most cues are absent from most reports). Fields are group 1 of the pattern.
+F = re.I | re.S
+CUES = {
+    "report_id": (r"(?:Service\s*report|Servicerapport)\s*#?\s*(\d+)", ("service",)),
+    "arrival": (r"(?:Time of Arrival|Arrival)[^\d]*([0-2]?\d:[0-5]\d)", ("arrival",)),
+    "departure": (r"(?:Time of Departure|Departure)[^\d]*([0-2]?\d:[0-5]\d)", ("departure",)),
+    "total": (r"(?:Total time spent working|Working hours)[^\d]*([0-2]?\d:[0-5]\d)", ("working",)),
+    "attributes_block": (r"Attributes\s*:?\s*(.*?)(?:Executed maintenance|Comments|Signature|$)", ("attributes",)),
+    "comments": (r"(?:Comments|Notes)\s*:?\s*(.*?)(?:Signature|Executed maintenance|Situation on arrival|$)",
+                 ("comments", "notes")),
+    "run_log_line": (r"(Record data on run log[^\n]*)", ("record data on run log",)),
+    # problem cues
+    "fuel_polisher_leak": (r"fuel\s+polisher\s+pump.*leak", ("polisher",)),
+    "fuel_level_indicator_issue": (r"fuel\s+level\s+indicator.*(not|fault|replace)", ("indicator",)),
+    "repair_advice_present": (r"(repair|replacement)\s+(advice|advies)", ("advice", "advies")),
+}
+RX_ATTR_VALUE = re.compile(r"\d|\bV\b|\bA\b|\bL\b|\bbar\b|\b°C\b")
+RX_RUN_LOG_BAD = re.compile(r"(not|n/?a|ordered|missing|later|resched)", re.I)
+RX_REMEDY = re.compile(r"(action|remedy|repaired|replaced|vervangen)", re.I)
+
+# --- PDF text extractor ---
+def extract_text_from_pdf(pdf_path: Path) -> str:
+    text = ""
+    try:
+        from PyPDF2 import PdfReader
+        text = "\n".join([(p.extract_text() or "") for p in PdfReader(str(pdf_path)).pages])
+    except Exception:
+        pass
+    if not text.strip():
+        from pdfminer.high_level import extract_text
+        text = extract_text(str(pdf_path))
+    return text
+
+def load_text(cache_dir, sha):
+    if cache_dir is None:
+        return None
+    try:
+        with gzip.open(Path(cache_dir) / TEXT_VERSION / sha[:2] / f"{sha}.txt.gz", "rt", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, EOFError):
+        return None
+
+def store_text(cache_dir, sha, text):
+    path = Path(cache_dir) / TEXT_VERSION / sha[:2] / f"{sha}.txt.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # per-process tmp name: workers may extract identical PDFs at the same time
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# --- Cue scanner
+class CueScanner:
+    def __init__(self, cues=None):
+        self.rx = {k: re.compile(p, F) for k, (p, _) in (cues or CUES).items()}
+        self.needs = {k: tuple(w.lower() for w in needs) for k, (_, needs) in (cues or CUES).items()}
+
+    def scan(self, text):
+        """name -> first match (or None) of every cue."""
+        low = text.lower()
+        return {k: rx.search(text) if any(w in low for w in self.needs[k]) else None
+                for k, rx in self.rx.items()}
+
+def value(m):
+    return m.group(1).strip() if m else None
+
+_SCANNERS = {}
+
+def get_scanner(cues=None):
+    """CueScanner per cue table, compiled once per process."""
+    key = json.dumps(cues, sort_keys=True) if cues else None
+    if key not in _SCANNERS:
+        _SCANNERS[key] = CueScanner(cues)
+    return _SCANNERS[key]
+
+def load_cues(path):
+    """CUES with the entries of a JSON file ({"name": [pattern, [needs...]]}) replaced."""
+    with open(path, "r", encoding="utf-8") as f:
+        override = json.load(f)
+    unknown = set(override) - set(CUES)
+    if unknown:
+        raise ValueError(f"{path}: unknown cue(s) {sorted(unknown)}; known: {sorted(CUES)}")
+    return {**CUES, **{k: (p, tuple(needs)) for k, (p, needs) in override.items()}}
+
+_VERSIONS = {}
+
+def rules_version(cues=None):
+    """Changes when the cues or the rules in extract_report change -> outputs are re-derived."""
+    key = json.dumps(cues, sort_keys=True) if cues else None
+    if key not in _VERSIONS:
+        _VERSIONS[key] = _rules_version(json.dumps(cues or CUES, sort_keys=True))
+    return _VERSIONS[key]
+
+def _rules_version(cues_json):
+    try:
+        code = inspect.getsource(extract_report)
+    except (OSError, TypeError):
+        code = ""
+    parts = [cues_json, RX_ATTR_VALUE.pattern, RX_RUN_LOG_BAD.pattern, RX_REMEDY.pattern, code]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+def file_sha256(path, bufsize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(bufsize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def fallback_report_id(pdf_path: Path):
+    parts = pdf_path.stem.split("_")
+    if len(parts) > 2:
+        return parts[2]  # the middle ID from filename
+    m = re.findall(r"(\d+)", pdf_path.stem)
+    return m[-1] if m else pdf_path.stem
+
+def extract_report(text: str, pdf_path: Path, cues=None):
+    """Text of one service report -> (report_id, structured dict, findings rows, quote stub rows)."""
+    hits = get_scanner(cues).scan(text)
+
+    # --- Light extraction
+    report_id = value(hits["report_id"])
+    arrival   = value(hits["arrival"])
+    departure = value(hits["departure"])
+    total     = value(hits["total"])
+
+    attributes_block = value(hits["attributes_block"])
+    attributes_filled = bool(attributes_block and RX_ATTR_VALUE.search(attributes_block or ""))
+
+    comments = value(hits["comments"]) or ""
+
+    # Problem cues
+    fuel_polisher_leak = hits["fuel_polisher_leak"] is not None
+    fuel_level_indicator_issue = hits["fuel_level_indicator_issue"] is not None
+    repair_advice_present = hits["repair_advice_present"] is not None
+    run_log_line = value(hits["run_log_line"])
+    run_log_incomplete = bool(run_log_line and RX_RUN_LOG_BAD.search(run_log_line))
+
+    # Findings
+    findings = []
+    if not total or total in ("0:00","00:00"):
+        findings.append(dict(category="Admin", issue="Working hours missing/zero",
+                             action_request="Enter arrival, departure, and total working time."))
+
+    if not attributes_filled:
+        findings.append(dict(category="Attributes", issue="Attributes not filled",
+                             action_request="Fill power/battery/capacity/spec fields."))
+
+    if fuel_polisher_leak and not RX_REMEDY.search(comments):
+        findings.append(dict(category="Fuel System", issue="Action missing for fuel polisher pump leak",
+                             action_request="Add remedy (repair/replace), parts, and hours estimate."))
+
+    if fuel_level_indicator_issue:
+        findings.append(dict(category="Fuel System", issue="Fuel level indicator decision missing",
+                             action_request="Record customer decision (do not use / do not replace / replace)."))
+
+    if run_log_incomplete:
+        findings.append(dict(category="Electrical/Logging", issue="Run log not completed",
+                             action_request="Attach metering run log or reschedule with tooling."))
+
+    # Quote stub
+    quote_stub = []
+    if fuel_polisher_leak or repair_advice_present:
+        quote_stub.append(dict(repair_advice="Fuel polisher pump repair/replacement",
+                               material_code="", specification="", quantity="", hours_estimate=""))
+    if fuel_level_indicator_issue:
+        quote_stub.append(dict(repair_advice="Fuel l3evel indicator replacement",
+                               material_code="", specification="", quantity="", hours_estimate=""))
+
+    rid = report_id or fallback_report_id(pdf_path)
+    structured = dict(
+        report_id=rid,
+        arrival=arrival, departure=departure, total_time_spent=total,
+        attributes_filled=attributes_filled,
+        flags=dict(
+            fuel_polisher_pump_leak=bool(fuel_polisher_leak),
+            fuel_level_indicator_issue=bool(fuel_level_indicator_issue),
+            repair_advice_present=bool(repair_advice_present),
+            run_log_incomplete=bool(run_log_incomplete),
+        ),
+        excerpts=dict(comments=comments[:400], attributes=(attributes_block or "")[:400])
+    )
+    return rid, structured, findings, quote_stub
+
+def write_outputs(rid, structured, findings, quote_stub, out_findings, out_quotes, out_struct):
+    pd.DataFrame(findings).to_csv(Path(out_findings) / f"findings_{rid}.csv", index=False)
+    pd.DataFrame(quote_stub).to_csv(Path(out_quotes) / f"quote_stub_{rid}.csv", index=False)
+    with open(Path(out_struct) / f"structured_{rid}.json", "w", encoding="utf-8") as f:
+        json.dump(structured, f, indent=2, ensure_ascii=False)
+
+def process_pdf(pdf_path, out_findings, out_quotes, out_struct, known_sha=None, text_cache=None,
+                cues=None, reparse=False):
+    """Extract one PDF unless its hash equals known_sha. Returns a manifest entry (+ 'skipped'/'error').
+
+    The text layer comes from text_cache when this content was parsed before (unless reparse).
+    """
+    pdf_path = Path(pdf_path)
+    t0 = time.perf_counter()
+    st = pdf_path.stat()
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "rules": rules_version(cues)}
+    try:
+        entry["sha256"] = sha = file_sha256(pdf_path)
+        if known_sha and sha == known_sha:
+            entry["skipped"] = True
+            return pdf_path.name, entry
+        text = None if reparse else load_text(text_cache, sha)
+        entry["text_cached"] = text is not None
+        if text is None:
+            text = extract_text_from_pdf(pdf_path)
+            if text_cache is not None:
+                store_text(text_cache, sha, text)
+        rid, structured, findings, quote_stub = extract_report(text, pdf_path, cues)
+        write_outputs(rid, structured, findings, quote_stub, out_findings, out_quotes, out_struct)
+        entry["report_id"] = str(rid)
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - t0, 3)
+    return pdf_path.name, entry
+
+def load_manifest(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path):
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def run_extraction(base_dir, out_findings=None, out_quotes=None, out_struct=None,
+                   manifest_path=None, workers=1, force=False, metrics=None,
+                   text_cache=None, cues=None, reparse=False):
+    metrics = metrics or Metrics(None)
+    base_dir = Path(base_dir)
+    out_findings = Path(out_findings or base_dir / "findings")
+    out_quotes = Path(out_quotes or base_dir / "quote_stub")
+    out_struct = Path(out_struct or base_dir / "structured")
+    manifest_path = Path(manifest_path or base_dir / MANIFEST_NAME)
+    text_cache = Path(text_cache or base_dir / TEXT_CACHE_NAME)
+    for d in (out_findings, out_quotes, out_struct):
+        d.mkdir(parents=True, exist_ok=True)
+
+    get_scanner(cues)  # bad cue patterns fail here, not once per PDF
+    manifest = {} if force else load_manifest(manifest_path)
+    rules = rules_version(cues)
+    todo = []
+    for pdf in sorted(base_dir.glob("*.pdf")):
+        old = manifest.get(pdf.name)
+        # outputs made by other rules are re-derived (from the cached text)
+        known = bool(old) and "error" not in old and old.get("rules") == rules
+        if known:
+            st = pdf.stat()
+            # same size and mtime: trust the stored hash without re-reading the file
+            if old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns:
+                continue
+        todo.append((pdf, old.get("sha256") if known else None))
+
+    print(f"[INFO] {len(todo)} new/changed PDFs to check in {base_dir} ({len(manifest)} in manifest)")
+    args = (out_findings, out_quotes, out_struct)
+    opts = dict(text_cache=text_cache, cues=cues, reparse=reparse)
+    n_done = n_skip = n_err = 0
+    n_cached = 0
+    try:
+        with metrics.stage("extract", len(todo)):
+            if workers > 1 and len(todo) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as ex:
+                    futs = [ex.submit(process_pdf, pdf, *args, sha, **opts) for pdf, sha in todo]
+                    for fut in as_completed(futs):
+                        name, entry = fut.result()
+                        metrics.slow("extract", name, entry.get("seconds", 0))
+                        n_cached += bool(entry.get("text_cached"))
+                        n_done, n_skip, n_err = _record(manifest, name, entry, n_done, n_skip, n_err)
+            else:
+                for pdf, sha in todo:
+                    print(f"Processing {pdf.name} ...")
+                    name, entry = process_pdf(pdf, *args, sha, **opts)
+                    metrics.slow("extract", name, entry.get("seconds", 0))
+                    n_cached += bool(entry.get("text_cached"))
+                    n_done, n_skip, n_err = _record(manifest, name, entry, n_done, n_skip, n_err)
+    finally:
+        save_manifest(manifest, manifest_path)
+    print(f"[OK] extracted {n_done} ({n_cached} from cached text), unchanged {n_skip}, failed {n_err}; "
+          f"manifest: {manifest_path}")
+    return manifest
+
+def _record(manifest, name, entry, n_done, n_skip, n_err):
+    if entry.pop("skipped", False):
+        manifest[name] = {**manifest.get(name, {}), **entry}
+        return n_done, n_skip + 1, n_err
+    manifest[name] = entry
+    if "error" in entry:
+        print(f"[SKIP] {name}: {entry['error']}")
+        return n_done, n_skip, n_err + 1
+    return n_done + 1, n_skip, n_err
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base_dir", required=True, help="Folder with the service report PDFs")
+    ap.add_argument("--out_findings", default=None, help="Default: <base_dir>/findings")
+    ap.add_argument("--out_quotes", default=None, help="Default: <base_dir>/quote_stub")
+    ap.add_argument("--out_structured", default=None, help="Default: <base_dir>/structured")
+    ap.add_argument("--manifest", default=None, help=f"Default: <base_dir>/{MANIFEST_NAME}")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--force", action="store_true", help="Ignore the manifest and re-extract every PDF")
+    ap.add_argument("--text_cache", default=None, help=f"Extracted PDF text per content hash. Default: <base_dir>/{TEXT_CACHE_NAME}")
+    ap.add_argument("--reparse", action="store_true", help="Parse new/changed PDFs again instead of using the text cache (with --force: all PDFs)")
+    ap.add_argument("--cues", default=None, help='JSON overriding cue patterns: {"fuel_polisher_leak": [pattern, ["polisher"]]}')
+    add_metrics_args(ap)
+    args = ap.parse_args()
+
+    cues = load_cues(args.cues) if args.cues else None
+    with Metrics.from_args("extract", args) as metrics:
+        run_extraction(args.base_dir, args.out_findings, args.out_quotes, args.out_structured,
+                       manifest_path=args.manifest, workers=max(1, args.workers), force=args.force,
+                       metrics=metrics, text_cache=args.text_cache, cues=cues, reparse=args.reparse)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# conftest.py
+# Registers the checkout as the package `sloppy_detector` (as run_orchestrate.py does), so the
+# tests import it the same way whatever the folder is called; sloppy_ml scripts import their
+# siblings, so that folder goes on sys.path as when they run from it.
+import sys, types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+if "sloppy_detector" not in sys.modules:
+    pkg = types.ModuleType("sloppy_detector")
+    pkg.__path__ = [str(ROOT)]
+    sys.modules["sloppy_detector"] = pkg
+if str(ROOT / "sloppy_ml") not in sys.path:
+    sys.path.insert(0, str(ROOT / "sloppy_ml"))
@@ -0,0 +1,59 @@
+# test_merge_hybrid.py
+# All-reports mode (--rule_glob/--ml_glob --out_dir) must write, per report, the same bytes as
+# single-file mode (--rule_findings_csv/--ml_findings_csv) on that report's two files.
+import sys
+import pytest
+import merge_hybrid
+
+RULE = "category,issue,action_request\n"
+ML = "report_id,label_code,confidence,issue,action_request\n"
+
+RULES = {
+    "101": RULE + "Attributes,Attributes not filled,Fill the fields.\nVideo,Video link missing,Add the link.\n",
+    "102": RULE,  # nothing found: header only
+    "103": RULE + 'Comments,"Comment spans\nlines",Rewrite.\n',
+    "104": "issue,category\nHours missing,Hours\n",  # other columns, other order
+    "105": RULE + "Attributes,Attributes not filled,\n",  # blank action_request
+    "106": RULE.replace("\n", "\r\n") + "Video,Video link missing,Add the link.\r\n",
+    "108": RULE + "Attributes,Attributes not filled,Fill the fields.\n",
+}
+PREDICTED = {
+    "101": ML + "101,ATTRIBUTES_NOT_FILLED,0.91,Attributes not filled,Fill the fields.\n"
+                "101,MATERIALS_NOT_BOOKED,0.62,Materials not booked,Book the materials.\n",
+    "102": ML + "102,VIDEO_LINK_MISSING,0.75,Video link missing,Add the link.\n",
+    "103": "",  # no label over the threshold
+    "104": ML + "104,HOURS_MISSING,1,Hours missing,\n",  # whole-number confidence
+    "105": ML + "105,ATTRIBUTES_NOT_FILLED,0.55,Attributes not filled,\n",
+    "107": ML + "107,VIDEO_LINK_MISSING,0.8,Video link missing,Add the link.\n",
+    "108": "report_id,label_code,confidence,issue,reviewed\n108,ATTRIBUTES_NOT_FILLED,0.7,Attributes not filled,True\n",
+}
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["merge_hybrid.py", *map(str, args)])
+    merge_hybrid.main()
+
+@pytest.fixture
+def inputs(tmp_path):
+    (tmp_path / "rules").mkdir()
+    (tmp_path / "ml").mkdir()
+    for rid, text in RULES.items():
+        (tmp_path / "rules" / f"findings_{rid}.csv").write_bytes(text.encode("utf-8"))
+    for rid, text in PREDICTED.items():
+        (tmp_path / "ml" / f"predicted_findings_{rid}.csv").write_bytes(text.encode("utf-8"))
+    return tmp_path
+
+def test_out_dir_matches_single_file_mode(inputs, monkeypatch):
+    run(monkeypatch, "--rule_glob", inputs / "rules", "--ml_glob", inputs / "ml", "--out_dir", inputs / "all")
+    rids = sorted(set(RULES) | set(PREDICTED))
+    assert sorted(p.name for p in (inputs / "all").iterdir()) == [f"final_findings_{rid}.csv" for rid in rids]
+    for rid in rids:
+        one = inputs / "one" / f"final_findings_{rid}.csv"
+        one.parent.mkdir(exist_ok=True)
+        run(monkeypatch, "--rule_findings_csv", inputs / "rules" / f"findings_{rid}.csv",
+            "--ml_findings_csv", inputs / "ml" / f"predicted_findings_{rid}.csv", "--out_csv", one)
+        assert (inputs / "all" / one.name).read_bytes() == one.read_bytes(), rid
+
+def test_whole_number_confidence_alone_stays_integer(inputs):
+    frames, frame_of, _ = merge_hybrid.load_all(sorted(map(str, (inputs / "ml").iterdir())))
+    assert frames[frame_of["104"]]["confidence"].dtype == "int64"
+    assert frames[frame_of["101"]]["confidence"].dtype == "float64"
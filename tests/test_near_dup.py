@@ -0,0 +1,27 @@
+# test_near_dup.py
+# An index keeps the matching settings it was built with: predict_multilabel --dup_index opens
+# it without any and must still match (and wait) the way near_dup.py --threshold ... set up.
+import pytest
+from near_dup import NearDupIndex
+
+COPY = "replaced the coolant pump seal and tested the genset under load for two hours"
+
+def test_reopened_index_keeps_its_settings(tmp_path):
+    path = tmp_path / "near_dup.sqlite"
+    index = NearDupIndex(path, threshold=0.5, min_words=3, boilerplate_df=1.0, boilerplate_sample=2)
+    index.update([("1", COPY)])
+    assert index.waiting == 1
+    index.close()
+
+    index = NearDupIndex(path)
+    assert (index.threshold, index.min_words, index.boilerplate_df, index.boilerplate_sample) == (0.5, 3, 1.0, 2)
+    index.update([("2", COPY + " again")])
+    assert index.waiting == 0
+    assert [r["report_id"] for r in index.findings("2")] == ["2"]
+    index.close()
+
+def test_other_settings_for_existing_index(tmp_path):
+    NearDupIndex(tmp_path / "near_dup.sqlite", threshold=0.5).close()
+    NearDupIndex(tmp_path / "near_dup.sqlite", threshold=0.5, min_words=8).close()  # same values: fine
+    with pytest.raises(ValueError, match="threshold"):
+        NearDupIndex(tmp_path / "near_dup.sqlite", threshold=0.8)
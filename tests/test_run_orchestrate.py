@@ -0,0 +1,33 @@
+# test_run_orchestrate.py
+# run_orchestrate.py with --workers under the `spawn` start method (Windows; forkserver on
+# newer Linux Pythons): the worker processes must be able to import sloppy_detector.
+import subprocess, sys
+from conftest import ROOT
+
+QUOTE = """repair_advice,material_code,specification,quantity,hours_estimate
+Replace the pump seal,M1,spec a,1,1
+ok,,spec b,-2,1
+"""
+
+# runpy.run_path makes the launcher __main__ by path, as `python run_orchestrate.py` does
+DRIVER = """
+import multiprocessing, runpy, sys
+multiprocessing.set_start_method("spawn")
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def test_spawned_workers_import_the_package(tmp_path):
+    quotes = tmp_path / "reports" / "quote_stub"
+    quotes.mkdir(parents=True)
+    for rid in (101, 102, 103):
+        (quotes / f"quote_stub_{rid}.csv").write_text(QUOTE, encoding="utf-8")
+    (tmp_path / "ml").mkdir()
+    proc = subprocess.run([sys.executable, "-c", DRIVER, str(ROOT / "run_orchestrate.py"),
+                           "--reports_dir", str(tmp_path / "reports"), "--ml_dir", str(tmp_path / "ml"),
+                           "--schema_json", str(ROOT / "schema.json"), "--workers", "2", "--verbose"],
+                          cwd=tmp_path, capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "[OK] score_quotes" in proc.stdout
+    assert sorted(p.name for p in (tmp_path / "reports" / "quote_findings").iterdir()) == \
+        ["findings_101.csv", "findings_102.csv", "findings_103.csv"]
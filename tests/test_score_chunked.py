@@ -0,0 +1,84 @@
+# test_score_chunked.py
+# score.py --chunksize must write the same findings as scoring the whole file at once, also
+# when a column's cells only look numeric (or boolean) in some chunks.
+import json, sys
+import numpy as np
+import pandas as pd
+import pytest
+from sloppy_detector import score, train
+from sloppy_detector.features import featureize_frame, feature_names
+from conftest import ROOT
+
+# repair_advice: digits in the first rows, text after; quantity: numbers, then junk and blanks
+ROWS = """repair_advice,material_code,specification,quantity,hours_estimate
+12345678,M1,spec a,1,1
+99999999,M2,spec b,2,0.5
+Replace the pump,M3,spec c,x,2
+ok,,spec d,,-1
+Seal replaced on the inlet flange,M5,,3,
+"""
+
+# attributes_complete: only True/False in the first rows, free text after
+SERVICE_ROWS = """arrival_time,departure_time,total_hours,attributes_complete,video_link
+08:00,10:00,2,True,https://x.sharepoint.com/v1
+08:30,09:00,0.5,False,
+09:00,12:00,3,False,https://youtu.be/v2
+10:00,,1,no,12345
+11:00,13:00,2,yes,https://x.sharepoint.com/v3
+"""
+
+def run_score(monkeypatch, in_csv, out_csv, *extra, form_type="quote_stub"):
+    monkeypatch.setattr(sys, "argv", ["score.py", "--input_csv", str(in_csv),
+                                      "--schema_json", str(ROOT / "schema.json"), "--form_type", form_type,
+                                      "--out_findings_csv", str(out_csv), *extra])
+    score.main()
+    return out_csv.read_text(encoding="utf-8")
+
+@pytest.mark.parametrize("chunksize", [1, 2, 3])
+def test_chunked_matches_whole_file(tmp_path, monkeypatch, chunksize):
+    in_csv = tmp_path / "quote_stub_42.csv"
+    in_csv.write_text(ROWS, encoding="utf-8")
+    whole = run_score(monkeypatch, in_csv, tmp_path / "whole.csv")
+    chunked = run_score(monkeypatch, in_csv, tmp_path / "chunked.csv", "--chunksize", str(chunksize))
+    assert chunked == whole
+
+def test_digit_text_is_text(tmp_path, monkeypatch):
+    in_csv = tmp_path / "quote_stub_42.csv"
+    in_csv.write_text(ROWS, encoding="utf-8")
+    out = run_score(monkeypatch, in_csv, tmp_path / "chunked.csv", "--chunksize", "2")
+    # "12345678" is 8 characters of repair advice, not a number: only "ok" is too short
+    assert out.count("Text for 'repair_advice' too short") == 1
+
+def service_model(tmp_path, monkeypatch):
+    # small IsolationForest on service rows whose attributes_complete is mostly True
+    rng = np.random.default_rng(0)
+    n = 300
+    pd.DataFrame({"arrival_time": "08:00", "departure_time": "10:00", "total_hours": rng.uniform(1, 4, n).round(1),
+                  "attributes_complete": np.where(rng.random(n) < 0.9, "True", "False"),
+                  "video_link": "https://x.sharepoint.com/v"}).to_csv(tmp_path / "history.csv", index=False)
+    monkeypatch.setattr(sys, "argv", ["train.py", "--records_csv", str(tmp_path / "history.csv"),
+                                      "--schema_json", str(ROOT / "schema.json"), "--form_type", "service_report",
+                                      "--out_dir", str(tmp_path / "model"), "--n_estimators", "20",
+                                      "--feats_format", "none"])
+    train.main()
+    return tmp_path / "model" / "model_service_report.joblib"
+
+@pytest.mark.parametrize("chunksize", [1, 2, 3])
+def test_service_report_chunked_matches_whole_file(tmp_path, monkeypatch, chunksize):
+    model = service_model(tmp_path, monkeypatch)
+    in_csv = tmp_path / "service_42.csv"
+    in_csv.write_text(SERVICE_ROWS, encoding="utf-8")
+    args = ("--model_path", str(model))
+    whole = run_score(monkeypatch, in_csv, tmp_path / "whole.csv", *args, form_type="service_report")
+    chunked = run_score(monkeypatch, in_csv, tmp_path / "chunked.csv", *args, "--chunksize", str(chunksize),
+                        form_type="service_report")
+    assert chunked == whole
+
+def test_false_text_is_false(tmp_path):
+    schema = json.load(open(ROOT / "schema.json"))
+    in_csv = tmp_path / "service_42.csv"
+    in_csv.write_text(SERVICE_ROWS, encoding="utf-8")
+    dtype = score.text_dtypes(score.compile_rules(schema, "service_report"))
+    X = featureize_frame(pd.read_csv(in_csv, dtype=dtype), schema, "service_report")
+    col = feature_names(schema, "service_report").index("false__attributes_complete")
+    assert X[:, col].tolist() == [0, 1, 1, 1, 0]
@@ -0,0 +1,41 @@
+# test_train_multilabel.py
+# A dataset where only one label has positives: every training mode keeps that single label
+# and the saved pipeline still predicts an n_samples x 1 matrix.
+import sys
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import train_multilabel
+
+def write_dataset(path, n=80):
+    rng = np.random.default_rng(0)
+    leak = rng.random(n) < 0.4
+    pd.DataFrame({
+        "report_id": range(1000, 1000 + n),
+        "comments": np.where(leak, "coolant leak at the pump seal", "all checks done, genset ok"),
+        "attributes_excerpt": "Repair or replacement advice?",
+        "attributes_filled": ~leak,
+        "flag__repair_advice_present": leak,
+        "VIDEO_MISSING": leak.astype(int),
+        "HOURS_MISSING": 0,  # no positives: dropped by --min_positives 1
+    }).to_csv(path, index=False)
+
+@pytest.mark.parametrize("mode", [
+    [],
+    ["--search", "--cv", "2", "--grid_C", "1", "--grid_ngram_max", "1", "--grid_max_features", "50", "--n_jobs", "1"],
+    ["--streaming", "--chunk_rows", "30", "--n_features", "1024"],
+], ids=["default", "search", "streaming"])
+def test_single_kept_label(tmp_path, monkeypatch, mode):
+    write_dataset(tmp_path / "dataset.csv")
+    monkeypatch.setattr(sys, "argv", ["train_multilabel.py", "--dataset", str(tmp_path / "dataset.csv"),
+                                      "--out_dir", str(tmp_path / "model_out"), *mode])
+    train_multilabel.main()
+
+    mdl = joblib.load(tmp_path / "model_out" / "multilabel_model.joblib")
+    assert mdl["label_cols"] == ["VIDEO_MISSING"]
+    df = pd.DataFrame({"__text__": ["coolant leak at the pump seal", "all checks done, genset ok"],
+                       "attributes_filled": [False, True], "flag__repair_advice_present": [True, False]})
+    proba = mdl["pipe"].predict_proba(df)
+    assert proba.shape == (2, 1)
+    assert proba[0, 0] > proba[1, 0]
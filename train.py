@@ -1,8 +1,66 @@
 import argparse, json, os
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
-from joblib import dump
-from .features import featureize_record
+from joblib import dump, load, parallel_config
+from .features import featureize_frame, feature_names, align_features
+from .rules import compile_rules
+from .score import text_dtypes
+from .sloppy_ml.compact_model import export_isolation_forest
+from .sloppy_ml.dataset_io import check_format
+from .sloppy_ml.instrument import Metrics, add_metrics_args
+
+# score_quantiles_: anomaly score (-score_samples) at 0%, 0.1%, ..., 100% of the calibration
+# rows; score.py maps a row's score onto it for a 0..1 percentile
+QUANTILES = 1001
+# calib_sample_: up to HISTORY_ROWS of the rows scored by calibrate(), standing for the
+# n_rows_seen_ rows the model was trained on; a warm start calibrates on them plus the new rows
+HISTORY_ROWS = 20000
+
+def max_samples_arg(s):
+    """'auto' (min(256, rows)), a row count per tree ("512") or a fraction of the rows ("0.05")."""
+    if s == "auto":
+        return s
+    v = float(s)
+    return int(v) if v >= 1 else v
+
+def fit_forest(model, X, n_jobs):
+    # contamination="auto" while fitting: sklearn would otherwise score every training row
+    # just to place offset_; calibrate() does that on a sample instead
+    contamination = model.contamination
+    model.set_params(contamination="auto", n_jobs=n_jobs)
+    model.fit(X)
+    model.set_params(contamination=contamination)
+    return model
+
+def _sample(X, k, rng):
+    return X.iloc[np.sort(rng.choice(len(X), k, replace=False))] if k < len(X) else X
+
+def calibrate(model, X, calib_rows, n_jobs, history=None, seen=0):
+    """offset_ (the contamination cut) and score_quantiles_ from up to calib_rows training rows.
+
+    Warm start: history is the previous calib_sample_ (standing for `seen` earlier rows) and
+    is mixed with X in proportion seen : len(X), so the cut and the percentiles describe all
+    rows trained on so far, not just the new ones.
+    """
+    rng = np.random.default_rng(42)
+    limit = calib_rows or np.inf
+    if history is None or not len(history) or not seen:
+        X = _sample(X, int(min(limit, len(X))), rng)
+    else:
+        share = len(X) / (seen + len(X))
+        # as many rows as calib_rows and the smaller side allow at that mix
+        k = min(limit, len(X) / share, len(history) / (1 - share))
+        k_new = min(len(X), int(round(k * share)))
+        k_old = min(len(history), int(round(k)) - k_new)
+        X = pd.concat([_sample(history, k_old, rng), _sample(X, k_new, rng)], ignore_index=True)
+    # sklearn scores tree by tree in threads; n_jobs only reaches it through the joblib config
+    with parallel_config(backend="threading", n_jobs=n_jobs):
+        scores = model.score_samples(X)
+    model.offset_ = float(np.percentile(scores, 100.0 * model.contamination))
+    model.score_quantiles_ = np.quantile(-scores, np.linspace(0, 1, QUANTILES))
+    model.calib_sample_ = _sample(X, min(HISTORY_ROWS, len(X)), rng).to_numpy(np.float32)
+    return len(X)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -11,25 +69,84 @@ def main():
     ap.add_argument("--form_type", required=True, choices=["quote_stub","service_report"])
     ap.add_argument("--out_dir", required=True)
     ap.add_argument("--contamination", type=float, default=0.15)
+    ap.add_argument("--n_estimators", type=int, default=200)
+    ap.add_argument("--max_samples", type=max_samples_arg, default="auto",
+                    help="Rows per tree: auto (min(256, rows)), a count, or a fraction of the rows")
+    ap.add_argument("--n_jobs", type=int, default=-1, help="Threads for fitting and calibration (-1 = all cores)")
+    ap.add_argument("--calib_rows", type=int, default=200000,
+                    help="Rows scored for the contamination cut and score quantiles (0 = all)")
+    ap.add_argument("--warm_start", default=None,
+                    help="Add trees fitted on --records_csv to this model_<form_type>.joblib instead of refitting")
+    ap.add_argument("--add_estimators", type=int, default=50, help="Warm start: trees to add")
+    ap.add_argument("--feats_format", choices=["csv", "parquet", "none"], default="csv",
+                    help="Feature dump format (parquet keeps the float32 columns; needs pyarrow; none = no dump)")
+    ap.add_argument("--compact", action="store_true",
+                    help="Also write model_<form_type>.compact/ (mmap-able arrays, scores without sklearn)")
+    add_metrics_args(ap)
     args = ap.parse_args()
 
     os.makedirs(args.out_dir, exist_ok=True)
+    feats_path = os.path.join(args.out_dir, f"feats_{args.form_type}.{args.feats_format}")
+    if args.feats_format == "parquet":
+        check_format(feats_path)
 
-    schema = json.load(open(args.schema_json))
+    with Metrics.from_args("train", args) as metrics:
+        with metrics.stage("load") as st:
+            schema = json.load(open(args.schema_json))
+            # text columns read as score.py reads them, so features match at scoring time
+            df = pd.read_csv(args.records_csv, dtype=text_dtypes(compile_rules(schema, args.form_type)))
+            st.rows = len(df)
+            prev = load(args.warm_start) if args.warm_start else None
 
-    df = pd.read_csv(args.records_csv)
-    feats = []
-    for _, row in df.iterrows():
-        rec = row.to_dict()
-        feats.append(featureize_record(rec, schema, args.form_type))
-    X = pd.DataFrame(feats).fillna(0.0)
+        with metrics.stage("featurize", len(df)):
+            names = feature_names(schema, args.form_type)
+            X = featureize_frame(df, schema, args.form_type)
+            if prev is not None:
+                # the old trees split on the old columns: keep their order
+                wanted = list(getattr(prev, "feature_names_in_", names))
+                new = [c for c in names if c not in wanted]
+                if new:
+                    print(f"[WARN] features not in the previous model are ignored until a full retrain: {new}")
+                X, names = align_features(X, names, wanted), wanted
+            X = pd.DataFrame(X, columns=names)
+            history, seen = None, 0
+            if prev is not None:
+                if getattr(prev, "calib_sample_", None) is not None:
+                    history, seen = pd.DataFrame(prev.calib_sample_, columns=names), prev.n_rows_seen_
+                else:
+                    print(f"[WARN] {args.warm_start} has no calibration sample (trained before train.py kept "
+                          "one): the cut and score percentiles come from the new rows only")
 
-    model = IsolationForest(n_estimators=200, contamination=args.contamination, random_state=42)
-    model.fit(X)
+        with metrics.stage("fit", len(X)):
+            if prev is None:
+                model = IsolationForest(n_estimators=args.n_estimators, max_samples=args.max_samples,
+                                        contamination=args.contamination, random_state=42)
+            else:
+                model = prev
+                if len(X) < model._max_samples:
+                    raise SystemExit(f"[ERROR] warm start needs at least {model._max_samples} rows "
+                                     f"(the previous trees' sample size), got {len(X)}")
+                # new trees draw as many rows as the old ones, so all trees share one normalization
+                model.set_params(warm_start=True, max_samples=int(model._max_samples),
+                                 n_estimators=len(model.estimators_) + args.add_estimators,
+                                 contamination=args.contamination)
+                print(f"[INFO] warm start from {args.warm_start}: {len(model.estimators_)} trees "
+                      f"+ {args.add_estimators} on {len(X)} new rows")
+            fit_forest(model, X, args.n_jobs)
+
+        with metrics.stage("calibrate") as st:
+            st.rows = calibrate(model, X, args.calib_rows, args.n_jobs, history, seen)
+            model.n_rows_seen_ = seen + len(X)
 
-    dump(model, os.path.join(args.out_dir, f"model_{args.form_type}.joblib"))
-    X.to_csv(os.path.join(args.out_dir, f"feats_{args.form_type}.csv"), index=False)
-    print("Saved model and features.")
+        with metrics.stage("write", len(X)):
+            dump(model, os.path.join(args.out_dir, f"model_{args.form_type}.joblib"))
+            if args.compact:
+                export_isolation_forest(model, os.path.join(args.out_dir, f"model_{args.form_type}.compact"))
+            if args.feats_format == "parquet":
+                X.to_parquet(feats_path, index=False)
+            elif args.feats_format == "csv":
+                X.to_csv(feats_path, index=False)
+        print(f"Saved model ({len(model.estimators_)} trees)" + (" and features." if args.feats_format != "none" else "."))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
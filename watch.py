@@ -0,0 +1,300 @@
+# watch.py
+# Watch-folder daemon: instead of reprocessing whole folders at the end of the day
+# (runchecks.bat), keep one process running that notices new or changed service report
+# PDFs and structured_<ID>.json files and pushes only those through
+#
+#     extraction (sloppy_reports_reader) -> rules on quote stubs (score.py)
+#         -> predict_multilabel -> merge_hybrid (final_findings_<ID>.csv)
+#
+# in-process, with the models loaded once. File events come from watchdog when it is
+# installed (inotify on Linux, ReadDirectoryChangesW on Windows); otherwise the folders
+# are polled. Bursts of arrivals are debounced into one batch. What has been processed
+# (size/mtime per file) is kept in a state file, so a restart only picks up what changed
+# while the daemon was down.
+import argparse, json, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from queue import Queue, Empty
+import pandas as pd
+from .rules import compile_rules
+from .score import load_model, read_input_csv, score_frame, text_dtypes
+from .sloppy_reports_reader import process_pdf, load_manifest, save_manifest, TEXT_CACHE_NAME
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "sloppy_ml"))
+from predict_multilabel import (load_taxonomy, taxonomy_lookup, recs_to_df,
+                                predict_proba_batch, findings_for_report, resolve_thresholds,
+                                load_multilabel)
+from merge_hybrid import read_findings, merge_one
+from structured_io import iter_structured
+
+STATE_NAME = "watch_state.json"
+
+def _stat(path):
+    try:
+        st = Path(path).stat()
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _unchanged(old, st):
+    return bool(old) and st is not None and old.get("size") == st["size"] and old.get("mtime_ns") == st["mtime_ns"]
+
+class Pipeline:
+    def __init__(self, base_dir, pred_dir, ml_model_path, taxonomy_yaml, threshold=None,
+                 structured_dir=None, findings_dir=None, quotes_dir=None,
+                 schema=None, model_path=None, quote_findings_dir=None,
+                 state_path=None, workers=1):
+        self.base_dir = Path(base_dir)
+        self.pred_dir = Path(pred_dir)
+        self.structured_dir = Path(structured_dir or self.base_dir / "structured")
+        self.findings_dir = Path(findings_dir or self.base_dir / "findings")
+        self.quotes_dir = Path(quotes_dir or self.base_dir / "quote_stub")
+        self.quote_findings_dir = Path(quote_findings_dir or self.base_dir / "quote_findings")
+        for d in (self.pred_dir, self.structured_dir, self.findings_dir, self.quotes_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        self.state_path = Path(state_path or self.base_dir / STATE_NAME)
+        self.state = load_manifest(self.state_path)
+        self.state.setdefault("pdf", {}); self.state.setdefault("structured", {})
+        self.workers = workers
+        self.threshold = threshold
+
+        # rules on quote stubs only when a schema is given
+        self.schema = schema
+        self.compiled = compile_rules(schema, "quote_stub") if schema else None
+        self.anomaly_model = load_model(model_path) if schema else None
+        if schema:
+            self.quote_findings_dir.mkdir(parents=True, exist_ok=True)
+
+        self.lookup = taxonomy_lookup(load_taxonomy(taxonomy_yaml))
+        self.ml_model_path = Path(ml_model_path)
+        self._load_ml()
+
+    def _load_ml(self):
+        mdl = load_multilabel(self.ml_model_path)
+        self.pipe = mdl["pipe"]; self.labels = mdl["label_cols"]; self.num_cols = mdl["num_cols"]
+        self.thresholds = resolve_thresholds(mdl, self.threshold)
+        self.ml_stat = _stat(self.ml_model_path)
+
+    def reload_if_retrained(self):
+        # runtraining.bat may replace the model while we run
+        st = _stat(self.ml_model_path)
+        if st and not _unchanged(self.ml_stat, st):
+            print(f"[INFO] {self.ml_model_path.name} changed; reloading")
+            self._load_ml()
+
+    # --- what needs work
+    def is_input(self, path):
+        p = Path(path)
+        if p.parent.resolve() == self.base_dir.resolve() and p.suffix.lower() == ".pdf":
+            return True
+        return p.parent.resolve() == self.structured_dir.resolve() and p.name.startswith("structured_") and p.suffix == ".json"
+
+    def _section(self, path):
+        return "pdf" if Path(path).suffix.lower() == ".pdf" else "structured"
+
+    def changed(self, paths, retry_failed=False):
+        """Inputs whose size/mtime differ from the state file (new, modified, not yet done)."""
+        out = []
+        for p in dict.fromkeys(paths):
+            if not self.is_input(p):
+                continue
+            st = _stat(p)
+            old = self.state[self._section(p)].get(Path(p).name)
+            if retry_failed and old and "error" in old:
+                old = None
+            if st is not None and not _unchanged(old, st):
+                out.append(Path(p))
+        return out
+
+    def scan(self, retry_failed=False):
+        paths = list(self.base_dir.glob("*.pdf")) + list(self.structured_dir.glob("structured_*.json"))
+        return self.changed(paths, retry_failed)
+
+    # --- stages
+    def extract(self, pdfs):
+        """PDFs -> report IDs whose outputs were (re)written."""
+        done = []
+        section = self.state["pdf"]
+        args = (self.findings_dir, self.quotes_dir, self.structured_dir)
+        text_cache = self.base_dir / TEXT_CACHE_NAME
+        jobs = []
+        for pdf in pdfs:
+            old = section.get(pdf.name) or {}
+            jobs.append((pdf, None if "error" in old else old.get("sha256")))
+        if self.workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as ex:
+                results = list(ex.map(process_pdf, [j[0] for j in jobs], *[[a] * len(jobs) for a in args], [j[1] for j in jobs],
+                                      [text_cache] * len(jobs)))
+        else:
+            results = [process_pdf(pdf, *args, sha, text_cache) for pdf, sha in jobs]
+        for name, entry in results:
+            if entry.pop("skipped", False):
+                # touched but same content: nothing downstream to redo
+                section[name] = {**section.get(name, {}), **entry}
+                continue
+            section[name] = entry
+            if "error" in entry:
+                # retried when the file changes again or on restart
+                print(f"[SKIP] {name}: {entry['error']}")
+                continue
+            done.append(entry["report_id"])
+        return done
+
+    def score_quotes(self, rids):
+        if self.compiled is None:
+            return
+        for rid in rids:
+            path = self.quotes_dir / f"quote_stub_{rid}.csv"
+            if not path.exists():
+                continue
+            out = score_frame(read_input_csv(path, text_dtypes(self.compiled)), self.schema, "quote_stub", self.anomaly_model, self.compiled)
+            out.to_csv(self.quote_findings_dir / f"findings_{rid}.csv", index=False)
+
+    def predict(self, paths):
+        """structured JSONs -> report IDs with a fresh predicted_findings_<ID>.csv."""
+        rids, recs = [], []
+        for batch in iter_structured(paths, batch_size=max(1, len(paths)), workers=min(16, max(1, len(paths)))):
+            for path, s, err in batch:
+                if err is not None:
+                    # like a failed PDF: retried when the file changes again or on restart
+                    err = f"{type(err).__name__}: {err}"
+                    self.state["structured"][Path(path).name] = {**(_stat(path) or {}), "error": err}
+                    print(f"[SKIP] {path}: {err}")
+                    continue
+                recs.append((path, s))
+        if not recs:
+            return rids
+        proba = predict_proba_batch(self.pipe, recs_to_df([s for _, s in recs], self.num_cols))
+        for (path, s), p in zip(recs, proba):
+            rid = s.get("report_id")
+            rows = findings_for_report(rid, p, self.labels, self.thresholds, self.lookup)
+            pd.DataFrame(rows).to_csv(self.pred_dir / f"predicted_findings_{rid}.csv", index=False)
+            self.state["structured"][Path(path).name] = _stat(path)
+            rids.append(rid)
+        return rids
+
+    def merge(self, rids):
+        for rid in rids:
+            combined = merge_one(read_findings(self.findings_dir / f"findings_{rid}.csv"),
+                                 read_findings(self.pred_dir / f"predicted_findings_{rid}.csv"))
+            combined.to_csv(self.pred_dir / f"final_findings_{rid}.csv", index=False)
+
+    def process(self, paths):
+        t0 = time.perf_counter()
+        pdfs = [p for p in paths if p.suffix.lower() == ".pdf"]
+        structured = {p.resolve(): p for p in paths if p.suffix == ".json"}
+        try:
+            rids = self.extract(pdfs) if pdfs else []
+            self.score_quotes(rids)
+            # structured JSONs just written by extraction go through the model in the same batch
+            for rid in rids:
+                p = self.structured_dir / f"structured_{rid}.json"
+                if p.exists():
+                    structured.setdefault(p.resolve(), p)
+            predicted = self.predict(list(structured.values())) if structured else []
+            self.merge(predicted)
+        finally:
+            save_manifest(self.state, self.state_path)
+        print(f"[OK] {len(pdfs)} PDFs, {len(structured)} structured JSONs -> "
+              f"{len(predicted)} final_findings in {time.perf_counter() - t0:.1f}s")
+
+def event_source(dirs, poll_interval, force_poll=False):
+    """Queue of touched paths, fed by watchdog if available (else None: caller polls)."""
+    if force_poll:
+        return None
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        print("[INFO] watchdog not installed; polling every", poll_interval, "s (py -m pip install watchdog)")
+        return None
+    q = Queue()
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            q.put(Path(getattr(event, "dest_path", "") or event.src_path))
+    obs = Observer()
+    for d in dict.fromkeys(dirs):
+        obs.schedule(Handler(), str(d), recursive=False)
+    obs.daemon = True
+    obs.start()
+    return q
+
+def run(pipeline, debounce=2.0, max_delay=30.0, poll_interval=5.0, force_poll=False, once=False):
+    # catch up on whatever arrived while we were down
+    todo = pipeline.scan(retry_failed=True)
+    print(f"[INFO] {len(todo)} new/changed inputs since last run")
+    if todo:
+        pipeline.process(todo)
+    if once:
+        return
+    q = event_source([pipeline.base_dir, pipeline.structured_dir], poll_interval, force_poll)
+    print(f"[INFO] watching {pipeline.base_dir} and {pipeline.structured_dir} (Ctrl+C to stop)")
+    while True:
+        if q is None:
+            time.sleep(poll_interval)
+            touched = pipeline.scan()
+        else:
+            touched = [q.get()]
+        # debounce: keep collecting until things are quiet for `debounce` s (at most max_delay)
+        first = time.monotonic()
+        while True:
+            wait = min(debounce, max_delay - (time.monotonic() - first))
+            if wait <= 0:
+                break
+            if q is None:
+                before = {p: _stat(p) for p in touched}
+                time.sleep(wait)
+                touched = pipeline.scan()
+                if {p: _stat(p) for p in touched} == before:
+                    break
+            else:
+                try:
+                    touched.append(q.get(timeout=wait))
+                except Empty:
+                    break
+        todo = pipeline.changed(touched)
+        if todo:
+            try:
+                pipeline.reload_if_retrained()
+                pipeline.process(todo)
+            except Exception as e:
+                # keep watching; unfinished inputs are not in the state file and are retried
+                print(f"[WARN] batch of {len(todo)} failed: {type(e).__name__}: {e}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base_dir", required=True, help="Folder the service report PDFs arrive in")
+    ap.add_argument("--structured_dir", default=None, help="Default: <base_dir>/structured")
+    ap.add_argument("--findings_dir", default=None, help="Default: <base_dir>/findings")
+    ap.add_argument("--quotes_dir", default=None, help="Default: <base_dir>/quote_stub")
+    ap.add_argument("--pred_dir", required=True, help="predicted_findings_<ID>.csv and final_findings_<ID>.csv go here")
+    ap.add_argument("--ml_model_path", required=True, help="multilabel_model.joblib or multilabel_model.compact")
+    ap.add_argument("--taxonomy_yaml", required=True)
+    ap.add_argument("--threshold", type=float, default=None,
+                    help="Default: the model's tuned per-label thresholds if it has them, else 0.5")
+    ap.add_argument("--schema_json", default=None, help="Also run the quote-stub rules (score.py)")
+    ap.add_argument("--model_path", default=None, help="Optional IsolationForest for quote-stub rows")
+    ap.add_argument("--quote_findings_dir", default=None, help="Default: <base_dir>/quote_findings")
+    ap.add_argument("--state", default=None, help=f"Default: <base_dir>/{STATE_NAME}")
+    ap.add_argument("--workers", type=int, default=1, help="Processes for PDF extraction in a burst")
+    ap.add_argument("--debounce", type=float, default=2.0, help="Seconds of quiet before a batch is processed")
+    ap.add_argument("--max_delay", type=float, default=30.0, help="Longest a file waits during a steady stream")
+    ap.add_argument("--poll_interval", type=float, default=5.0)
+    ap.add_argument("--poll", action="store_true", help="Poll even if watchdog is installed (e.g. network shares)")
+    ap.add_argument("--once", action="store_true", help="Process what changed since the last run, then exit")
+    args = ap.parse_args()
+
+    schema = json.load(open(args.schema_json)) if args.schema_json else None
+    pipeline = Pipeline(args.base_dir, args.pred_dir, args.ml_model_path, args.taxonomy_yaml, args.threshold,
+                        args.structured_dir, args.findings_dir, args.quotes_dir,
+                        schema, args.model_path, args.quote_findings_dir,
+                        args.state, max(1, args.workers))
+    try:
+        run(pipeline, args.debounce, args.max_delay, args.poll_interval, args.poll, args.once)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()